@@ -21,4 +21,8 @@
 LMI Reflex
 '''
 
-from .pd import Decoder
+try:
+    from .pd import Decoder
+except ModuleNotFoundError as e:  # Standalone use of the engine without libsigrokdecode
+    if e.name != 'sigrokdecode':
+        raise
@@ -0,0 +1,154 @@
+import json
+from collections import namedtuple
+from .regmap import pick_texts
+
+KELVIN = 273.15
+
+# Annotation class of each rule, from ANOMALY_ANN on
+TEMPERATURE, CELLS, PACK, USB_MISMATCH, ADDRESS = range(5)
+RULES = ('temperature', 'cells', 'pack', 'usb', 'address')
+# Checks a chip can put on its fields in its anomalies, by name
+CHECKS = ('celsius', 'kelvin', 'cell', 'last_cell', 'bat', 'pack', 'rdo')
+
+# A rule hit in the event log: the rule, where (chip and field name, or address), the first and last sample the
+# condition held, its worst value, the limit and the number of values breaking it
+Event = namedtuple('Event', ('rule', 'source', 'ss', 'es', 'value', 'limit', 'count'))
+
+
+# Checks decoded values against fixed limits while decoding. Every chip names the checks watching its fields, with
+# the limit they compare to, in its anomalies; they are compiled at start() into a map from field id to check, so a
+# value costs one dict lookup unless a rule watches its field.
+# A rule hit opens an episode that lasts while the following values of the field keep breaking the limit, and is
+# put as one annotation and one Event spanning the episode once a value is back within the limit or decoding ends.
+# install() wraps the engine's emit_field, unknown_address and end.
+# limits maps rule names to limits: temperatures in °C, voltage differences in volts.
+# Events are kept in `events` and, given a log_path, appended to that file as JSON lines.
+class AnomalyDetector:
+    def __init__(self, engine, limits, ann_base, log_path=''):
+        self.engine = engine
+        self.limits = limits
+        self.ann_base = ann_base
+        self.log_path = log_path
+        self.log = None
+        self.checks = {}  # Field id -> (check(ss, es, info, value, limit), limit)
+        self.open = {}  # Episode key -> [rule, source, ss, es, worst value, count]
+        self.cells = {}  # Cell name -> last voltage of the read being decoded
+        self.bat_voltage = None
+        self.events = []
+        for info in engine.regmap.fields:
+            check = info.chip.anomalies.get(info.name)
+            if check is None:
+                continue
+            name, limit = check
+            if name not in CHECKS:
+                raise ValueError('Unknown anomaly check {} of {} {}'.format(name, info.chip.value, info.name))
+            self.checks[info.id] = (getattr(self, 'check_' + name), None if limit is None else limits[limit])
+
+    def install(self):
+        engine = self.engine
+        self.engine_emit_field = engine.emit_field
+        self.engine_end = engine.end
+        engine.emit_field = self.emit_field
+        engine.unknown_address = self.unknown_address
+        engine.end = self.end
+
+    def emit_field(self, ss, es, slot, raw):
+        self.engine_emit_field(ss, es, slot, raw)
+        check = self.checks.get(slot[5].id)
+        if check is not None:
+            check[0](ss, es, slot[5], slot[0].value(raw), check[1])
+
+    def check_celsius(self, ss, es, info, celsius, limit):
+        self.check((TEMPERATURE, info.id), '{} {}'.format(info.chip.value, info.name), ss, es, celsius, limit)
+
+    def check_kelvin(self, ss, es, info, kelvin, limit):
+        self.check_celsius(ss, es, info, round(kelvin - KELVIN, 2), limit)
+
+    def check_cell(self, ss, es, info, volts, limit):
+        self.cells[info.name] = volts
+
+    # Cell spread is checked once the last cell of a read arrives, cells reading 0 V are not fitted
+    def check_last_cell(self, ss, es, info, volts, limit):
+        self.cells[info.name] = volts
+        cells = [volts for volts in self.cells.values() if volts > 0]
+        self.cells.clear()
+        if len(cells) > 1:
+            self.check((CELLS, info.chip.index), info.chip.value + ' cells', ss, es, round(max(cells) - min(cells), 3),
+                       limit)
+
+    def check_bat(self, ss, es, info, volts, limit):
+        self.bat_voltage = volts
+
+    def check_pack(self, ss, es, info, volts, limit):
+        if self.bat_voltage is not None:
+            self.check((PACK, info.chip.index), '{} {}'.format(info.chip.value, info.name), ss, es,
+                       round(abs(volts - self.bat_voltage), 3), limit)
+            self.bat_voltage = None
+
+    def check_rdo(self, ss, es, info, rdo, limit):
+        mismatch = 'Capability mismatch' in rdo[2]
+        self.check((USB_MISMATCH, info.chip.index), '{} {}'.format(info.chip.value, info.name), ss, es,
+                   int(mismatch), 0)
+
+    def unknown_address(self, ss, es, address):
+        self.check((ADDRESS, address), '0x{:02X}'.format(address), ss, es, 1, 0)
+
+    def check(self, key, source, ss, es, value, limit):
+        episode = self.open.get(key)
+        if value > limit:
+            if episode is None:
+                self.open[key] = [key[0], source, ss, es, value, limit, 1]
+            else:
+                episode[3] = es
+                episode[4] = max(episode[4], value)
+                episode[6] += 1
+        elif episode is not None:
+            self.close(key)
+
+    def close(self, key):
+        rule, source, ss, es, value, limit, count = self.open.pop(key)
+        event = Event(RULES[rule], source, ss, es, value, limit, count)
+        self.events.append(event)
+        if self.log_path:
+            if self.log is None:
+                self.log = open(self.log_path, 'a', encoding='utf-8')
+            self.log.write(json.dumps(event._asdict()) + '\n')
+        if self.engine.annotate:
+            self.engine.put_ann(ss, es, [self.ann_base + rule, self.get_texts(rule, source, value, limit, count)])
+
+    def get_texts(self, rule, source, value, limit, count):
+        if rule == TEMPERATURE:
+            texts = ('Over-temperature: {} up to {}°C, limit {}°C, {} values'.format(source, value, limit, count),
+                     '{} over {}°C: {}°C'.format(source, limit, value), 'Hot {}°C'.format(value))
+        elif rule == CELLS:
+            texts = ('Cell imbalance: spread up to {}V, limit {}V, {} reads'.format(value, limit, count),
+                     'Cell spread {}V'.format(value), 'Cells')
+        elif rule == PACK:
+            texts = ('PACK/BAT mismatch: up to {}V apart, limit {}V, {} reads'.format(value, limit, count),
+                     'PACK/BAT {}V apart'.format(value), 'PACK')
+        elif rule == USB_MISMATCH:
+            texts = ('USB PD capability mismatch, {} reads'.format(count), 'Capability mismatch', 'Mismatch')
+        else:
+            texts = ('Unknown chip address {}, {} transfers'.format(source, count), 'Unknown {}'.format(source),
+                     source)
+        if self.engine.level == 'values':
+            return [texts[-1]]
+        return pick_texts(texts, self.engine.level)
+
+    # Open episodes as JSON-friendly [key, rule, source, ss, es, value, limit, count] lists, and the values a check
+    # still waits to compare
+    def get_state(self):
+        return [[list(key)] + episode for key, episode in self.open.items()], dict(self.cells), self.bat_voltage
+
+    def set_state(self, state):
+        episodes, cells, self.bat_voltage = state
+        self.open = {tuple(episode[0]): episode[1:] for episode in episodes}
+        self.cells = dict(cells)
+
+    def end(self):
+        self.engine_end()
+        for key in sorted(self.open, key=lambda key: self.open[key][2]):
+            self.close(key)
+        if self.log is not None:
+            self.log.close()
+            self.log = None
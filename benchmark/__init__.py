@@ -0,0 +1,4 @@
+'''
+Throughput benchmark for the LMI Reflex decoder, runnable without sigrok:
+python -m <package>.benchmark
+'''
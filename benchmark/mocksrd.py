@@ -0,0 +1,36 @@
+import sys
+
+OUTPUT_ANN = 0
+OUTPUT_PYTHON = 1
+OUTPUT_BINARY = 2
+OUTPUT_LOGIC = 3
+OUTPUT_META = 4
+SRD_CONF_SAMPLERATE = 10000
+
+
+# Stand-in for sigrokdecode.Decoder that counts what the decoder puts per output type
+class Decoder:
+    options = ()
+
+    def __init__(self):
+        pass
+
+    def setup(self, options=None):
+        self.options = {option['id']: option['default'] for option in type(self).options}
+        if options:
+            self.options.update(options)
+        self.output_types = []
+        self.put_counts = {}
+
+    def register(self, output_type, meta=None, proto_id=None):
+        self.output_types.append(output_type)
+        return len(self.output_types) - 1
+
+    def put(self, ss, es, output_id, data):
+        output_type = self.output_types[output_id]
+        self.put_counts[output_type] = self.put_counts.get(output_type, 0) + 1
+
+
+# Makes 'import sigrokdecode' resolve to this module for the benchmark process
+def install():
+    sys.modules['sigrokdecode'] = sys.modules[__name__]
@@ -0,0 +1,92 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from . import mocksrd
+from .traffic import MIXES, Traffic
+
+mocksrd.install()
+from ..pd import Decoder  # noqa: E402  (needs the stand-in sigrokdecode)
+from ..regmap import LEVELS  # noqa: E402
+
+CHIPS_SHOWN = {'PIC': 'yes', 'BMS': 'yes', 'USB-PD': 'yes', 'Hall': 'yes'}
+
+
+def decode(events, options):
+    decoder = Decoder()
+    decoder.setup(options)
+    decoder.start()
+    for ss, es, command, databyte in events:
+        decoder.decode(ss, es, [command, databyte])
+    decoder.end()
+    return decoder
+
+
+# Best-of-`repeat` throughput, then one traced pass for the peak memory of the decoder
+def measure(events, options, repeat):
+    elapsed = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decoder = decode(events, options)
+        run_time = time.perf_counter() - start
+        elapsed = run_time if elapsed is None else min(elapsed, run_time)
+
+    tracemalloc.start()
+    decode(events, options)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    num_bytes = sum(1 for event in events if event[2] in ('ADDRESS READ', 'ADDRESS WRITE', 'DATA READ',
+                                                          'DATA WRITE'))
+    annotations = decoder.put_counts.get(mocksrd.OUTPUT_ANN, 0)
+    return {
+        'bytes': num_bytes,
+        'annotations': annotations,
+        'seconds': elapsed,
+        'bytes_per_sec': num_bytes / elapsed,
+        'annotations_per_sec': annotations / elapsed,
+        'peak_bytes': peak,
+    }
+
+
+def parse_options(pairs):
+    options = dict(CHIPS_SHOWN)
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        options[key] = int(value) if value.isdigit() else value
+    return options
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='benchmark', description='Measure LMI Reflex decoder throughput on '
+                                     'synthetic bus traffic.')
+    parser.add_argument('-d', '--duration', type=float, default=2.0, help='seconds of bus traffic per mix')
+    parser.add_argument('-m', '--mix', default=','.join(MIXES), help='comma separated chip mixes')
+    parser.add_argument('-l', '--levels', default='full', help="comma separated verbosity levels, or 'all'")
+    parser.add_argument('-o', '--option', action='append', default=[], metavar='ID=VALUE', help='decoder option')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='timed runs per case, the best one counts')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--min-bytes-per-sec', type=float, help='exit with status 1 if any case is slower')
+    args = parser.parse_args(argv)
+
+    levels = LEVELS if args.levels == 'all' else args.levels.split(',')
+    options = parse_options(args.option)
+    results = []
+    for mix in args.mix.split(','):
+        events = Traffic(mix, seed=args.seed).generate(args.duration)
+        for level in levels:
+            result = measure(events, dict(options, verbosity=level), args.repeat)
+            result.update(mix=mix, level=level)
+            results.append(result)
+            if not args.json:
+                print('{:<8} {:<8} {:>10.0f} bytes/s {:>10.0f} ann/s {:>8.1f} KiB peak'.format(
+                    mix, level, result['bytes_per_sec'], result['annotations_per_sec'], result['peak_bytes'] / 1024))
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    if args.min_bytes_per_sec is not None:
+        slow = [result for result in results if result['bytes_per_sec'] < args.min_bytes_per_sec]
+        if slow:
+            sys.exit(1)
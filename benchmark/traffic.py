@@ -0,0 +1,156 @@
+import random
+
+BUS_RATE = 400000  # Hz, I2C fast mode as on the Reflex
+SAMPLERATE = 4000000
+IDLE_BITS = 20  # Bus idle time between transfers
+
+# Relative transfer counts per chip, named after the Chip values
+MIXES = {
+    'all': {'PIC': 1, 'BMS': 1, 'USB-PD': 1, 'Hall': 1},
+    'reflex': {'PIC': 2, 'BMS': 3, 'USB-PD': 1, 'Hall': 8},  # Polling pattern of a running unit
+    'pic': {'PIC': 1},
+    'bms': {'BMS': 1},
+    'usb': {'USB-PD': 1},
+    'hall': {'Hall': 1},
+}
+
+
+# Slowly drifting sensor reading, so polled values repeat like on a real bus
+class Walk:
+    def __init__(self, rng, value, low, high, step=1, change=0.1):
+        self.rng = rng
+        self.value = value
+        self.low = low
+        self.high = high
+        self.step = step
+        self.change = change
+
+    def next(self):
+        if self.rng.random() < self.change:
+            self.value = min(self.high, max(self.low, self.value + self.rng.choice((-self.step, self.step))))
+        return self.value
+
+
+# Generates the (ss, es, command, databyte) events the sigrok i2c decoder would feed the LMI Reflex decoder
+class Traffic:
+    def __init__(self, mix='all', samplerate=SAMPLERATE, bus_rate=BUS_RATE, seed=0):
+        self.rng = random.Random(seed)
+        self.mix = MIXES[mix] if isinstance(mix, str) else mix
+        self.bit = max(1, samplerate // bus_rate)
+        self.samplerate = samplerate
+        self.sample = 0
+        self.events = []
+
+        rng = self.rng
+        self.pic_volts = Walk(rng, 124, 110, 130)
+        self.pic_temp = Walk(rng, 70, 40, 120)
+        self.pic_config = [0x01, 30, 128, 20, 2, 0b010001, 64, 0x01, 0xF4]
+        self.soc = Walk(rng, 80, 0, 100, change=0.01)
+        self.cells = [Walk(rng, 3900, 3000, 4200, step=2, change=0.3) for _ in range(4)]
+        self.currents = [Walk(rng, 500, 0, 3000, step=5, change=0.3) for _ in range(4)]
+        self.temps = [Walk(rng, 3010, 2900, 3400, change=0.2) for _ in range(7)]
+        self.pdo = 0x0406412C  # 3A at 20V, USB communication capable
+        self.rdo = 0x1304B12C  # Object position 1, 3A requested
+        self.hall_axes = [Walk(rng, rng.randrange(-500, 500), -2048, 2047, step=3, change=0.2) for _ in range(3)]
+        self.hall_temp = Walk(rng, 340, 300, 400, change=0.01)
+        self.hall_frame = 0
+
+        self.transfers = {
+            'PIC': (self.pic_status, self.pic_status, self.pic_config_write),
+            'BMS': (self.bms_soc, self.bms_da_status_1, self.bms_da_status_2),
+            'USB-PD': (self.usb_pdo_num, self.usb_pdo_sink, self.usb_rdo_status),
+            'Hall': (self.hall_poll,),
+        }
+
+    def put(self, bits, command, databyte=None):
+        es = self.sample + bits * self.bit
+        self.events.append((self.sample, es, command, databyte))
+        self.sample = es
+
+    def write_bytes(self, address, data):
+        self.put(8, 'ADDRESS WRITE', address)
+        self.put(1, 'ACK')
+        for databyte in data:
+            self.put(8, 'DATA WRITE', databyte)
+            self.put(1, 'ACK')
+
+    def read_bytes(self, address, data):
+        self.put(8, 'ADDRESS READ', address)
+        self.put(1, 'ACK')
+        for i, databyte in enumerate(data):
+            self.put(8, 'DATA READ', databyte)
+            self.put(1, 'NACK' if i == len(data) - 1 else 'ACK')
+
+    def write(self, address, data):
+        self.put(1, 'START')
+        self.write_bytes(address, data)
+        self.put(1, 'STOP')
+        self.sample += IDLE_BITS * self.bit
+
+    def read(self, address, data, command=None):
+        self.put(1, 'START')
+        if command is not None:
+            self.write_bytes(address, command)
+            self.put(1, 'START REPEAT')
+        self.read_bytes(address, data)
+        self.put(1, 'STOP')
+        self.sample += IDLE_BITS * self.bit
+
+    @staticmethod
+    def words(values):
+        data = []
+        for value in values:
+            data += [value & 0xFF, value >> 8 & 0xFF]
+        return data
+
+    def pic_status(self):
+        self.read(0x50, [self.pic_volts.next(), self.pic_temp.next(), 0x12, 0x34, 7, ord('B')])
+
+    def pic_config_write(self):
+        self.pic_config[1] = self.rng.choice((10, 30, 50))
+        self.write(0x50, self.pic_config)
+
+    def bms_soc(self):
+        self.read(0x0B, [100 - self.soc.next(), 0x00], command=[0x0D])
+
+    def bms_block(self, subcommand, values):
+        self.write(0x0B, [0x44, 0x02, subcommand, 0x00])
+        data = self.words(values)
+        self.read(0x0B, [len(data) + 2, subcommand, 0x00] + data, command=[0x44])
+
+    def bms_da_status_1(self):
+        cells = [cell.next() for cell in self.cells]
+        currents = [current.next() for current in self.currents]
+        powers = [cell * current // 10000 for cell, current in zip(cells, currents)]
+        self.bms_block(0x71, cells + [sum(cells), sum(cells) - 20] + currents + powers + [sum(powers)] * 2)
+
+    def bms_da_status_2(self):
+        self.bms_block(0x72, [temp.next() for temp in self.temps] + [0] * 9)
+
+    def usb_pdo_num(self):
+        self.read(0x28, [3], command=[0x70])
+
+    def usb_pdo_sink(self):
+        self.read(0x28, list(self.pdo.to_bytes(4, 'little')), command=[0x8D])
+
+    def usb_rdo_status(self):
+        self.read(0x28, list(self.rdo.to_bytes(4, 'little')), command=[0x91])
+
+    # TLV493D frame: 12-bit axes and temperature split into high bytes and nibbles, a running frame counter
+    def hall_poll(self):
+        bx, by, bz = (walk.next() & 0xFFF for walk in self.hall_axes)
+        temp = self.hall_temp.next()
+        self.hall_frame = (self.hall_frame + 1) & 0b11
+        self.read(0x5E, [bx >> 4, by >> 4, bz >> 4, temp >> 8 << 4 | self.hall_frame << 2, (bx & 0xF) << 4 | by & 0xF,
+                         bz & 0xF, temp & 0xFF, 0x12, 0x34, 0x56])
+
+    # Events of `duration` seconds of bus traffic
+    def generate(self, duration):
+        chips = list(self.mix)
+        weights = [self.mix[chip] for chip in chips]
+        end = int(duration * self.samplerate)
+        while self.sample < end:
+            chip = self.rng.choices(chips, weights)[0]
+            self.rng.choice(self.transfers[chip])()
+        events, self.events = self.events, []
+        return events
@@ -1,138 +1,322 @@
+import re
+from .regmap import Bitfield, Choice, Field, Register, pick_texts
+from .smbus import BLOCK
+
+SOC = 0x0D  # RelativeStateOfCharge
+BATTERY_STATUS = 0x16
+MBA = 0x44  # ManufacturerBlockAccess
+FIRMWARE_VERSION = 0x0002
+SAFETY_ALERT = 0x0050
+SAFETY_STATUS = 0x0051
+OPERATION_STATUS = 0x0054
+MANUFACTURER_INFO = 0x0070
+DA_STATUS_1 = 0x0071
+DA_STATUS_2 = 0x0072
+
+# SBS commands reading one word: command, name, label, unit, signed
+SBS_WORDS = (
+    (0x08, 'Temperature', 'Temp', 'K', False),
+    (0x09, 'Voltage', 'Voltage', 'V', False),
+    (0x0A, 'Current', 'Current', 'A', True),
+    (0x0B, 'AverageCurrent', 'Avg current', 'A', True),
+    (0x0C, 'MaxError', 'Max error', '%', False),
+    (0x0E, 'AbsoluteStateOfCharge', 'Abs charge', '%', False),
+    (0x0F, 'RemainingCapacity', 'Remaining', 'mAh', False),
+    (0x10, 'FullChargeCapacity', 'Full charge', 'mAh', False),
+    (0x11, 'RunTimeToEmpty', 'To empty', 'min', False),
+    (0x12, 'AverageTimeToEmpty', 'Avg to empty', 'min', False),
+    (0x13, 'AverageTimeToFull', 'Avg to full', 'min', False),
+    (0x14, 'ChargingCurrent', 'Charge current', 'A', False),
+    (0x15, 'ChargingVoltage', 'Charge voltage', 'V', False),
+    (0x17, 'CycleCount', 'Cycles', '', False),
+    (0x18, 'DesignCapacity', 'Design capacity', 'mAh', False),
+    (0x19, 'DesignVoltage', 'Design voltage', 'V', False),
+    (0x3C, 'CellVoltage4', 'Cell 4', 'V', False),
+    (0x3D, 'CellVoltage3', 'Cell 3', 'V', False),
+    (0x3E, 'CellVoltage2', 'Cell 2', 'V', False),
+    (0x3F, 'CellVoltage1', 'Cell 1', 'V', False),
+)
+# SBS commands reading a block: command, name, label
+SBS_BLOCKS = (
+    (0x20, 'ManufacturerName', 'Mfg name'),
+    (0x21, 'DeviceName', 'Device name'),
+    (0x22, 'DeviceChemistry', 'Chemistry'),
+    (0x23, 'ManufacturerData', 'Mfg data'),
+)
+
+# ManufacturerBlockAccess subcommands: subcommand, annotation texts
+MAC_COMMANDS = (
+    (0x0001, ('DeviceType', 'DevType')),
+    (FIRMWARE_VERSION, ('FirmwareVersion', 'FwVersion', 'FW')),
+    (0x0003, ('HardwareVersion', 'HwVersion', 'HW')),
+    (0x0006, ('ChemicalID', 'ChemID')),
+    (0x0010, ('ShutdownMode', 'Shutdown')),
+    (0x0011, ('SleepMode', 'Sleep')),
+    (0x001F, ('ChargeFET', 'CHG FET')),
+    (0x0020, ('DischargeFET', 'DSG FET')),
+    (0x0021, ('Gauging', 'Gauge')),
+    (0x0022, ('FETControl', 'FET ctrl')),
+    (0x0030, ('SealDevice', 'Seal')),
+    (0x0041, ('DeviceReset', 'Reset')),
+    (SAFETY_ALERT, ('SafetyAlert', 'SafeAlert')),
+    (SAFETY_STATUS, ('SafetyStatus', 'SafeStatus')),
+    (0x0052, ('PFAlert', 'PFA')),
+    (0x0053, ('PFStatus', 'PFS')),
+    (OPERATION_STATUS, ('OperationStatus', 'OpStatus')),
+    (0x0055, ('ChargingStatus', 'ChgStatus')),
+    (0x0056, ('GaugingStatus', 'GaugeStatus')),
+    (0x0057, ('ManufacturingStatus', 'MfgStatus')),
+    (MANUFACTURER_INFO, ('ManufacturerInfo', 'MInfo')),
+    (DA_STATUS_1, ('DAStatus 1 (Voltages, Currents, Power)', 'DAStatus1', 'DA1')),
+    (DA_STATUS_2, ('DAStatus 2 (Temperatures)', 'DAStatus2', 'DA2')),
+    (0x0073, ('GaugeStatus1', 'GS1')),
+    (0x0074, ('GaugeStatus2', 'GS2')),
+    (0x0075, ('GaugeStatus3', 'GS3')),
+    (0x0076, ('CBStatus', 'CB')),
+    (0x0077, ('StateOfHealth', 'SOH')),
+    (0x007B, ('DAStatus3', 'DA3')),
+)
+
+# SMBus frame of every command: the data bytes of a word, or BLOCK for a length-prefixed block
+FRAMES = {0x00: 2, SOC: 2, BATTERY_STATUS: 2, MBA: BLOCK}
+FRAMES.update({cmd: 2 for cmd, name, label, unit, signed in SBS_WORDS})
+FRAMES.update({cmd: BLOCK for cmd, name, label in SBS_BLOCKS})
+
+DA_STATUS_1_WORDS = (
+    ('cell1_voltage', 14, 'V', ('Cell 1 Voltage: {}V', 'Cell 1: {}V', '{}V')),
+    ('cell2_voltage', 14, 'V', ('Cell 2 Voltage: {}V', 'Cell 2: {}V', '{}V')),
+    ('cell3_voltage', 14, 'V', ('Cell 3 Voltage: {}V', 'Cell 3: {}V', '{}V')),
+    ('cell4_voltage', 14, 'V', ('Cell 4 Voltage: {}V', 'Cell 4: {}V', '{}V')),
+    ('bat_voltage', 15, 'V', ('BAT pin voltage: {} Volts', 'BAT voltage: {}V', 'BAT: {}V', '{}V')),
+    ('pack_voltage', 16, 'V', ('PACK voltage: {} Volts', 'PACK: {} Volts', 'PACK: {}V', '{}V')),
+    ('cell1_current', 17, 'A', ('Cell 1 Current: {}A', 'Cell 1: {}A', '{}A')),
+    ('cell2_current', 17, 'A', ('Cell 2 Current: {}A', 'Cell 2: {}A', '{}A')),
+    ('cell3_current', 17, 'A', ('Cell 3 Current: {}A', 'Cell 3: {}A', '{}A')),
+    ('cell4_current', 17, 'A', ('Cell 4 Current: {}A', 'Cell 4: {}A', '{}A')),
+    ('cell1_power', 18, 'W', ('Cell 1 Power: {}W', 'Cell 1: {}W', '{}W')),
+    ('cell2_power', 18, 'W', ('Cell 2 Power: {}W', 'Cell 2: {}W', '{}W')),
+    ('cell3_power', 18, 'W', ('Cell 3 Power: {}W', 'Cell 3: {}W', '{}W')),
+    ('cell4_power', 18, 'W', ('Cell 4 Power: {}W', 'Cell 4: {}W', '{}W')),
+    ('calculated_power', 18, 'W', ('Calculated Power: {}W', 'Curr Power: {}W', '{}W')),
+    ('average_power', 18, 'W', ('Average Power: {}W', 'Avg Power: {}W', '{}W')),
+)
+
+DA_STATUS_2_WORDS = (
+    ('int_temp', 20, ('BMS Internal Temperature: {}K', 'Internal Temp: {}K', 'Int Temp: {}K', 'Int: {}K', '{}K')),
+    ('ts1_temp', 21, ('TS1 Temperature: {}K', 'TS1 Temp: {}K', 'TS1: {}K', '{}K')),
+    ('ts2_temp', 21, ('TS2 Temperature: {}K', 'TS2 Temp: {}K', 'TS2: {}K', '{}K')),
+    ('ts3_temp', 21, ('TS3 Temperature: {}K', 'TS3 Temp: {}K', 'TS3: {}K', '{}K')),
+    ('ts4_temp', 21, ('TS4 Temperature: {}K', 'TS4 Temp: {}K', 'TS4: {}K', '{}K')),
+    ('cell_temp', 22, ('Cell Temperature: {}K', 'Cell Temp: {}K', 'Cell: {}K', '{}K')),
+    ('fet_temp', 23, ('FET Temperature: {}K', 'FET Temp: {}K', 'FET: {}K', '{}K')),
+)
+
+# Fields checked by the anomaly rules: field name -> (check, limit)
+ANOMALY_CHECKS = {name: ('kelvin', 'bms_temp') for name, ann, texts in DA_STATUS_2_WORDS}
+ANOMALY_CHECKS.update({'cell1_voltage': ('cell', 'cell_delta'), 'cell2_voltage': ('cell', 'cell_delta'),
+                       'cell3_voltage': ('cell', 'cell_delta'), 'cell4_voltage': ('last_cell', 'cell_delta'),
+                       'bat_voltage': ('bat', None), 'pack_voltage': ('pack', 'pack_delta')})
+
+# Change-only mode deadbands of the DAStatus words by unit: 5 mV, 5 mA, 10 mW and 0.5 K
+DEADBANDS = {'V': 0.005, 'A': 0.005, 'W': 0.01, 'K': 0.5}
+
+SOC_TEXTS = ('Battery percent: {}%', 'Battery: {}%', '{}%')
+
+BATTERY_STATUS_BITS = Bitfield((
+    (0, 4, {1: 'Busy', 2: 'Reserved command', 3: 'Unsupported command', 4: 'Access denied', 5: 'Overflow/underflow',
+            6: 'Bad size', 7: 'Unknown error'}),
+    (4, 1, 'Fully discharged'),
+    (5, 1, 'Fully charged'),
+    (6, 1, 'Discharging'),
+    (7, 1, 'Initialized'),
+    (8, 1, 'Remaining time alarm'),
+    (9, 1, 'Remaining capacity alarm'),
+    (11, 1, 'Terminate discharge alarm'),
+    (12, 1, 'Overtemperature alarm'),
+    (14, 1, 'Terminate charge alarm'),
+    (15, 1, 'Overcharged alarm'),
+))
+SAFETY_BITS = Bitfield(tuple((bit, 1, text) for bit, text in enumerate((
+    'Cell undervoltage', 'Cell overvoltage', 'Overcurrent in charge 1', 'Overcurrent in charge 2',
+    'Overcurrent in discharge 1', 'Overcurrent in discharge 2', 'Overload in discharge', 'Overload in discharge latch',
+    'Short circuit in charge', 'Short circuit in charge latch', 'Short circuit in discharge',
+    'Short circuit in discharge latch', 'Overtemperature in charge', 'Overtemperature in discharge',
+    'Cell undervoltage compensated', None, 'Overtemperature FET', None, 'Precharge timeout', None, 'Charge timeout',
+    None, 'Overcharge', 'Overcharging current', 'Overcharging voltage', 'Over-precharge current',
+    'Undertemperature in charge', 'Undertemperature in discharge',
+)) if text is not None))
+OPERATION_BITS = Bitfield((
+    (0, 1, 'System present'),
+    (1, 1, 'DSG FET on'),
+    (2, 1, 'CHG FET on'),
+    (3, 1, 'PCHG FET on'),
+    (5, 1, 'Fuse'),
+    (8, 2, {1: 'Full access', 2: 'Unsealed', 3: 'Sealed'}),
+    (10, 1, 'Shutdown by voltage'),
+    (11, 1, 'Safety fault'),
+    (12, 1, 'Permanent failure'),
+    (13, 1, 'Discharge disabled'),
+    (14, 1, 'Charge disabled'),
+    (15, 1, 'Sleep'),
+    (16, 1, 'Shutdown by command'),
+    (17, 1, 'LED display on'),
+    (18, 1, 'Authentication in progress'),
+    (19, 1, 'Auto offset calibration'),
+    (20, 1, 'Calibration output'),
+    (21, 1, 'Calibration offset output'),
+    (24, 1, 'Initialized after reset'),
+    (25, 1, 'Auto CC offset calibration'),
+    (28, 1, 'Cell balancing'),
+    (29, 1, 'Emergency FET off'),
+))
+
+# Block read header: length byte followed by the echoed MAC subcommand
+MBA_HEADER = (
+    Field('block_length', 0, None),
+    Field('mac_echo', 1, None, width=2),
+)
+
+
 class BMS:
+    name = 'BMS'
+    address = 0x0B
+    desc = 'Display BMS traffic'
+    default = 'no'
+    annotations = (
+        (11, 'bms_request', 'BMS data request'),
+        (12, 'bms_mac', 'BMS MAC command (ManufacturerBlockAccess)'),
+        (13, 'bms_charge', 'Battery percentage'),
+        (14, 'bms_cell_volts', 'Battery cell voltages'),
+        (15, 'bms_bat_volts', 'BMS BAT pin voltage'),
+        (16, 'bms_pack_volts', 'BMS PACK voltage'),
+        (17, 'bms_cell_amps', 'Battery cell current'),
+        (18, 'bms_cell_watts', 'Battery cell power'),
+        (19, 'bms_power', 'BMS power data'),
+        (20, 'bms_int_temp', 'BMS internal temperature'),
+        (21, 'bms_sensor_temp', 'Temperature sensor temps'),
+        (22, 'bms_cell_temp', 'Battery cell temperature'),
+        (23, 'bms_fet_temp', 'FET temperature'),
+        (51, 'bms_sbs', 'BMS SBS and MAC values'),
+        (52, 'bms_status', 'BMS status flags'),
+        (53, 'bms_smbus', 'BMS SMBus PEC and framing'),
+    )
+    rows = (
+        ('bms', 'BMS chip (TI BQ4050)', (11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 51, 52, 53)),
+    )
+    summary_classes = (32, 36, 40)
+    frames = FRAMES
+    smbus_ann = 'bms_smbus'
+    anomalies = ANOMALY_CHECKS
+
+    # Status words of a MAC block read: register name, field name, label, flags
     @staticmethod
-    def write(decoder, databyte):
-        data = []
-        if decoder.data_key == 0:
-            if decoder.prev_chip != decoder.curr_chip:
-                decoder.curr_cmd = [databyte]
-            if databyte == 0x0D:
-                data = [11, ['BMS -> Get State Of Charge', 'Get SOC', 'SOC']]
-            elif databyte == 0x44:
-                data = [11, ['BMS -> ManufacturerBlockAccess', 'ManufactureAccess', 'MBAccess', 'MBA']]
-            else:
-                data = [11, ['Unknown', '?']]
-        elif decoder.data_key == 1:
-            decoder.curr_cmd.append(databyte)
-            if databyte == 0x02:
-                data = [12, ['ManufactureBlockAccess: Get Firmware Version', 'MAC: Get Firmware Version',
-                             'Firmware Version', 'Firmware', 'FV']]
-        elif decoder.data_key == 2:
-            decoder.work_var = databyte
-        elif decoder.data_key == 3:
-            decoder.curr_cmd.append((databyte << 8) | decoder.work_var)
-            if 0x0071 in decoder.curr_cmd:
-                data = [12, ['DAStatus 1 (Voltages, Currents, Power)', 'DAStatus1', 'DA1']]
-            elif 0x0072 in decoder.curr_cmd:
-                data = [12, ['DAStatus 2 (Temperatures)', 'DAStatus2', 'DA2']]
-            elif 0x0072 in decoder.curr_cmd:
-                data = [12, ['ManufacturerInfo', 'MInfo']]
-
-        return data
+    def get_status_register(subcommand, name, label, bits):
+        return Register(name, False, (MBA, subcommand), MBA_HEADER + (
+            Field(BMS.get_field_name(name), 3, 52, width=4, convert=lambda n: bits.flags(n),
+                  fmt=lambda n, level: BMS.flag_texts(name, label, bits, n, 8, level)),
+        ))
 
     @staticmethod
-    def read(decoder, databyte):
-        data = []
-        if decoder.curr_cmd[0] == 0x0D:
+    def compile_registers():
+        choices = {
+            SOC: ('BMS -> Get State Of Charge', 'Get SOC', 'SOC'),
+            BATTERY_STATUS: ('BMS -> BatteryStatus', 'BatteryStatus', 'Status'),
+            MBA: ('BMS -> ManufacturerBlockAccess', 'ManufactureAccess', 'MBAccess', 'MBA'),
+        }
+        choices.update({cmd: ('BMS -> ' + name, name, label) for cmd, name, label, unit, signed in SBS_WORDS})
+        choices.update({cmd: ('BMS -> ' + name, name, label) for cmd, name, label in SBS_BLOCKS})
+        registers = [
+            Register('command', True, None, (
+                Choice('command', 0, 11, choices, default=('Unknown', '?'), select=True),
+            )),
+            # Block write of a MAC subcommand: length byte, then the subcommand
+            Register('ManufacturerBlockAccess', True, MBA, (
+                Field('block_length', 1, None),
+                Choice('mac_command', 2, 12, dict(MAC_COMMANDS), default=('Unknown subcommand', '?'), width=2,
+                       select=True),
+            )),
             # ASK ABOUT FORMAT OF PERCENT!
-            percent = 100 - int(databyte)
-            data = [13, ['Battery percent: {}%'.format(percent), 'Battery: {}%'.format(percent), '{}%'.format(percent)]]
-        elif decoder.curr_cmd[0] == 0x44:
-            if 0x0071 in decoder.curr_cmd:
-                data = BMS.da_status_1(decoder, databyte, decoder.data_key - 3)
-            elif 0x0072 in decoder.curr_cmd:
-                data = BMS.da_status_2(decoder, databyte, decoder.data_key - 3)
-        else:
-            data = [14, ['Byte number {}'.format(decoder.data_key + 1), 'Byte #: {}'.format(decoder.data_key + 1),
-                         '{}'.format(decoder.data_key + 1)]]
-        return data
+            Register('RelativeStateOfCharge', False, SOC, (
+                Field('soc', 0, 13, SOC_TEXTS, width=2, convert=lambda n: 100 - n, unit='%'),
+            )),
+            Register('BatteryStatus', False, BATTERY_STATUS, (
+                Field('battery_status', 0, 52, width=2, convert=lambda n: BATTERY_STATUS_BITS.flags(n),
+                      fmt=lambda n, level: BMS.flag_texts('BatteryStatus', 'Status', BATTERY_STATUS_BITS, n, 4,
+                                                          level)),
+            )),
+            Register('FirmwareVersion', False, (MBA, FIRMWARE_VERSION), MBA_HEADER + (
+                # Sent most significant byte first
+                Field('device_number', 3, 51, ('Device number: {:04X}', 'Device: {:04X}', '{:04X}'), width=2,
+                      order='big', summary=False),
+                Field('firmware_version', 5, 51, ('Firmware version: {:04X}', 'Version: {:04X}', '{:04X}'), width=2,
+                      order='big', summary=False),
+                Field('build_number', 7, 51, ('Build number: {:04X}', 'Build: {:04X}', '{:04X}'), width=2,
+                      order='big', summary=False),
+                Field('firmware_type', 9, 51, ('Firmware type: {:02X}', 'Type: {:02X}', '{:02X}'), summary=False),
+                Field('it_version', 10, 51, ('Impedance Track version: {:04X}', 'IT version: {:04X}', '{:04X}'),
+                      width=2, order='big', summary=False),
+            )),
+            BMS.get_status_register(SAFETY_ALERT, 'SafetyAlert', 'Alert', SAFETY_BITS),
+            BMS.get_status_register(SAFETY_STATUS, 'SafetyStatus', 'Safety', SAFETY_BITS),
+            BMS.get_status_register(OPERATION_STATUS, 'OperationStatus', 'Operation', OPERATION_BITS),
+            Register('ManufacturerInfo', False, (MBA, MANUFACTURER_INFO), MBA_HEADER + (
+                Field('manufacturer_info', 3, 51, ('ManufacturerInfo: {}', 'MInfo: {}', '{}'), width=32, order='big',
+                      convert=lambda n: '{:064X}'.format(n), summary=False),
+            )),
+            Register('DAStatus1', False, (MBA, DA_STATUS_1), MBA_HEADER + tuple(
+                Field(name, 3 + 2 * i, ann, texts, width=2, convert=lambda n, unit=unit: BMS.convert_val(n, unit),
+                      unit=unit, deadband=DEADBANDS[unit])
+                for i, (name, ann, unit, texts) in enumerate(DA_STATUS_1_WORDS)
+            )),
+            Register('DAStatus2', False, (MBA, DA_STATUS_2), MBA_HEADER + tuple(
+                Field(name, 3 + 2 * i, ann, texts, width=2, convert=lambda n: BMS.convert_val(n, 'K'), unit='K',
+                      deadband=DEADBANDS['K'])
+                for i, (name, ann, texts) in enumerate(DA_STATUS_2_WORDS)
+            )),
+        ]
+        for cmd, name, label, unit, signed in SBS_WORDS:
+            texts = (name + ': {}' + unit, label + ': {}' + unit, '{}' + unit)
+            registers.append(Register(name, False, cmd, (
+                Field(BMS.get_field_name(name), 0, 51, texts, width=2, unit=unit,
+                      convert=lambda n, unit=unit, signed=signed: BMS.convert_val(BMS.get_signed(n) if signed else n,
+                                                                                  unit)),
+            )))
+        return tuple(registers)
 
     @staticmethod
-    def da_status_1(decoder, databyte, da1_key):
-        data = []
-        value = None
-        if da1_key in range(0, 32, 2):
-            decoder.work_var = databyte
-        else:
-            unit = ''
-            if da1_key >= 21:
-                unit = 'WATT'
-            value = BMS.convert_val(databyte, decoder, unit)
-        if da1_key == 1:
-            data = [14, ['Cell 1 Voltage: {}V'.format(value), 'Cell 1: {}V'.format(value), '{}V'.format(value)]]
-        elif da1_key == 3:
-            data = [14, ['Cell 2 Voltage: {}V'.format(value), 'Cell 2: {}V'.format(value), '{}V'.format(value)]]
-        elif da1_key == 5:
-            data = [14, ['Cell 3 Voltage: {}V'.format(value), 'Cell 3: {}V'.format(value), '{}V'.format(value)]]
-        elif da1_key == 7:
-            data = [14, ['Cell 4 Voltage: {}V'.format(value), 'Cell 4: {}V'.format(value), '{}V'.format(value)]]
-        elif da1_key == 9:
-            data = [15, ['BAT pin voltage: {} Volts'.format(value), 'BAT voltage: {}V'.format(value),
-                         'BAT: {}V'.format(value), '{}V'.format(value)]]
-        elif da1_key == 11:
-            data = [16, ['PACK voltage: {} Volts'.format(value), 'PACK: {} Volts'.format(value),
-                         'PACK: {}V'.format(value), '{}V'.format(value)]]
-        elif da1_key == 13:
-            data = [17, ['Cell 1 Current: {}A'.format(value), 'Cell 1: {}A'.format(value), '{}A'.format(value)]]
-        elif da1_key == 15:
-            data = [17, ['Cell 2 Current: {}A'.format(value), 'Cell 2: {}A'.format(value), '{}A'.format(value)]]
-        elif da1_key == 17:
-            data = [17, ['Cell 3 Current: {}A'.format(value), 'Cell 3: {}A'.format(value), '{}A'.format(value)]]
-        elif da1_key == 19:
-            data = [17, ['Cell 4 Current: {}A'.format(value), 'Cell 4: {}A'.format(value), '{}A'.format(value)]]
-        elif da1_key == 21:
-            data = [18, ['Cell 1 Power: {}W'.format(value), 'Cell 1: {}W'.format(value), '{}W'.format(value)]]
-        elif da1_key == 23:
-            data = [18, ['Cell 2 Power: {}W'.format(value), 'Cell 2: {}W'.format(value), '{}W'.format(value)]]
-        elif da1_key == 25:
-            data = [18, ['Cell 3 Power: {}W'.format(value), 'Cell 3: {}W'.format(value), '{}W'.format(value)]]
-        elif da1_key == 27:
-            data = [18, ['Cell 4 Power: {}W'.format(value), 'Cell 4: {}W'.format(value), '{}W'.format(value)]]
-        elif da1_key == 29:
-            data = [18, ['Calculated Power: {}W'.format(value), 'Curr Power: {}W'.format(value), '{}W'.format(value)]]
-        elif da1_key == 31:
-            data = [18, ['Average Power: {}W'.format(value), 'Avg Power: {}W'.format(value), '{}W'.format(value)]]
-
-        return data
+    def default_read(decoder, databyte):
+        return [14, [text.format(decoder.state.data_key + 1)
+                     for text in pick_texts(('Byte number {}', 'Byte #: {}', '{}'), decoder.level)]]
 
     @staticmethod
-    def da_status_2(decoder, databyte, da2_key):
-        temp = 0
-        data = []
-        if da2_key in range(0, 32, 2):
-            decoder.work_var = databyte
-        else:
-            temp = BMS.convert_val(databyte, decoder, 'KELVIN')
-        if da2_key == 1:
-            data = [20, ['BMS Internal Temperature: {}K'.format(temp), 'Internal Temp: {}K'.format(temp),
-                         'Int Temp: {}K'.format(temp), 'Int: {}K'.format(temp), '{}K'.format(temp)]]
-        elif da2_key == 3:
-            data = [21, ['TS1 Temperature: {}K'.format(temp), 'TS1 Temp: {}K'.format(temp), 'TS1: {}K'.format(temp),
-                         '{}K'.format(temp)]]
-        elif da2_key == 5:
-            data = [21, ['TS2 Temperature: {}K'.format(temp), 'TS2 Temp: {}K'.format(temp), 'TS2: {}K'.format(temp),
-                         '{}K'.format(temp)]]
-        elif da2_key == 7:
-            data = [21, ['TS3 Temperature: {}K'.format(temp), 'TS3 Temp: {}K'.format(temp), 'TS3: {}K'.format(temp),
-                         '{}K'.format(temp)]]
-        elif da2_key == 9:
-            data = [21, ['TS4 Temperature: {}K'.format(temp), 'TS4 Temp: {}K'.format(temp), 'TS4: {}K'.format(temp),
-                         '{}K'.format(temp)]]
-        elif da2_key == 11:
-            data = [22, ['Cell Temperature: {}K'.format(temp), 'Cell Temp: {}K'.format(temp), 'Cell: {}K'.format(temp),
-                         '{}K'.format(temp)]]
-        elif da2_key == 13:
-            data = [23, ['FET Temperature: {}K'.format(temp), 'FET Temp: {}K'.format(temp), 'FET: {}K'.format(temp),
-                         '{}K'.format(temp)]]
-        return data
+    def flag_texts(name, label, bits, word, digits, level):
+        if level == 'values':
+            return ['0x{:0{}X}'.format(word, digits)]
+        elif level == 'minimal':
+            return ['{} 0x{:0{}X}'.format(label, word, digits)]
+        flags = ', '.join(bits.flags(word)) or 'None'
+        return pick_texts(('{}: {}'.format(name, flags), '{}: {}'.format(label, flags),
+                           '{} 0x{:0{}X}'.format(label, word, digits)), level)
+
+    # SBS names in snake case, e.g. 'AverageCurrent' -> 'average_current'
+    @staticmethod
+    def get_field_name(name):
+        return re.sub('(?<=[a-z])(?=[A-Z0-9])', '_', name).lower()
+
+    @staticmethod
+    def get_signed(word):
+        return word - 0x10000 if word & 0x8000 else word
 
     # Handles conversion from 16 bit num to volts, amps, watts, Kelvin
     @staticmethod
-    def convert_val(databyte, decoder, unit=''):
-        num = int(databyte << 8 | decoder.work_var)
-        if unit == 'KELVIN':
+    def convert_val(num, unit=''):
+        if unit == 'K':
             return num / 10
-        elif unit == 'WATT':
+        elif unit == 'W':
             return num / 100
-        else:
+        elif unit in ('V', 'A'):
             return num / 1000
+        return num
+
 
+BMS.registers = BMS.compile_registers()
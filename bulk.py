@@ -0,0 +1,151 @@
+from .chips import CHIPS, BMS, HALL
+from .engine import Engine
+from .events import is_binary, read_batches, read_events
+from .hall import CELSIUS_PER_LSB, MILLITESLA_PER_LSB, TEMP_OFFSET, Hall
+from .regmap import Part
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Registers collected by decode_bulk: chip and register name
+BULK_REGISTERS = ((BMS, 'DAStatus1'), (BMS, 'DAStatus2'), (HALL, 'measurement'))
+BULK_OPTIONS = {'annotations': 'no', 'records': 'none', 'transactions': 'yes', 'changes': 'no', 'summary': 'no',
+                'anomalies': 'no', 'profile': 'no'}
+
+
+# The Hall conversions rounding their results, over arrays. numpy.round gives what round gives for every 12-bit
+# value, the convert of every other field works on NumPy arrays as it does on ints.
+def get_flux_densities(values):
+    return numpy.round(Hall.get_signed(values) * MILLITESLA_PER_LSB, 3)
+
+
+def get_magnitudes(axes):
+    x, y, z = (Hall.get_signed(axes >> shift & 0xFFF) for shift in (24, 12, 0))
+    return numpy.round(numpy.sqrt(x * x + y * y + z * z) * MILLITESLA_PER_LSB, 3)
+
+
+def get_angles(axes):
+    return numpy.round(numpy.degrees(numpy.arctan2(Hall.get_signed(axes >> 12 & 0xFFF), Hall.get_signed(axes >> 24))),
+                       1)
+
+
+def get_temperatures(values):
+    return numpy.round((values - TEMP_OFFSET) * CELSIUS_PER_LSB + 25, 1)
+
+
+ARRAY_CONVERTS = {(HALL, 'bx'): get_flux_densities, (HALL, 'by'): get_flux_densities, (HALL, 'bz'): get_flux_densities,
+                  (HALL, 'magnitude'): get_magnitudes, (HALL, 'angle'): get_angles,
+                  (HALL, 'temperature'): get_temperatures}
+
+
+# The bytes of every complete read of one register, converted into columns once decoding is done
+class Block:
+    def __init__(self, chip, register):
+        self.chip = chip
+        self.register = register
+        self.fields = []  # Recorded fields and the parts of frames, with the field holding their bytes
+        for field in register.fields:
+            if field.parts is not None:
+                self.fields.extend((part, field) for part in field.parts)
+            elif field.record:
+                self.fields.append((field, field))
+        self.size = max(field.offset + field.width for field in register.fields)
+        self.data = bytearray()
+        self.ss = []
+        self.es = []
+
+    def add(self, data, ss, es):
+        self.data += data
+        self.ss.append(ss)
+        self.es.append(es)
+
+    # Sample numbers and values of every field, one entry per read: NumPy arrays, lists when NumPy is missing
+    def get_columns(self):
+        if numpy is None:
+            return self.get_lists()
+        rows = numpy.frombuffer(bytes(self.data), numpy.uint8).reshape(-1, self.size).astype(numpy.int64)
+        columns = {'ss': numpy.array(self.ss, numpy.uint64), 'es': numpy.array(self.es, numpy.uint64)}
+        for field, source in self.fields:
+            raw = numpy.zeros(len(rows), numpy.int64)
+            for i in range(source.width):
+                byte_num = i if source.order == 'little' else source.width - 1 - i
+                raw |= rows[:, source.offset + i] << 8 * byte_num
+            if isinstance(field, Part):
+                raw = field.extract(raw)
+            convert = ARRAY_CONVERTS.get((self.chip, field.name))
+            columns[field.name] = convert(raw) if convert is not None else field.value(raw)
+        return columns
+
+    def get_lists(self):
+        rows = [self.data[start:start + self.size] for start in range(0, len(self.data), self.size)]
+        columns = {'ss': list(self.ss), 'es': list(self.es)}
+        for field, source in self.fields:
+            raws = [int.from_bytes(row[source.offset:source.offset + source.width], source.order) for row in rows]
+            if isinstance(field, Part):
+                raws = [field.extract(raw) for raw in raws]
+            columns[field.name] = [field.value(raw) for raw in raws]
+        return columns
+
+
+# Keeps the bytes of complete reads of the given registers for conversion in bulk, instead of decoding them field by
+# field. Shorter reads are decoded as usual, and blocks failing their SMBus PEC are dropped.
+# install() wraps the engine's decode_transfer, the engine has to decode whole transfers.
+class BulkCollector:
+    def __init__(self, engine, registers=BULK_REGISTERS):
+        self.engine = engine
+        self.blocks = {}  # (chip, cmd) of a read -> Block
+        for chip, name in registers:
+            for register in chip.routines.registers:
+                if register.name == name and not register.write:
+                    self.blocks[(chip, register.cmd)] = Block(chip, register)
+
+    def install(self):
+        self.engine_decode_transfer = self.engine.decode_transfer
+        self.engine.decode_transfer = self.decode_transfer
+
+    def decode_transfer(self):
+        engine = self.engine
+        state = engine.state
+        buf = engine.transfer
+        block = None if state.write else self.blocks.get((state.chip, state.curr_cmd))
+        if block is None or len(buf) < block.size:
+            self.engine_decode_transfer()
+            return
+        smbus = engine.smbus
+        if smbus is None or smbus.frames is None or smbus.verdict is not False:
+            block.add(buf[:block.size], engine.transfer_ss[0], engine.transfer_es[block.size - 1])
+        state.data_key = len(buf)
+
+    # Columns of every register by 'chip.register' name, e.g. 'BMS.DAStatus1'
+    def get_columns(self):
+        return {'{}.{}'.format(block.chip.value, block.register.name): block.get_columns()
+                for block in self.blocks.values()}
+
+
+def get_collector(options, registers):
+    chips = {chip for chip, name in registers}
+    options = dict(options or {}, **BULK_OPTIONS)
+    options.update({chip.value: 'yes' if chip in chips else 'no' for chip in CHIPS})
+    engine = Engine(options)
+    engine.start()
+    collector = BulkCollector(engine, registers)
+    collector.install()
+    return collector
+
+
+# Decodes (ss, es, command, databyte) events and returns the columns of the complete reads of the registers
+def decode_bulk(events, options=None, registers=BULK_REGISTERS):
+    collector = get_collector(options, registers)
+    collector.engine.decode_events(events)
+    return collector.get_columns()
+
+
+# decode_bulk over a capture file, binary event files fed in batches
+def decode_bulk_file(path, options=None, registers=BULK_REGISTERS):
+    if not is_binary(path):
+        return decode_bulk(read_events(path), options, registers)
+    collector = get_collector(options, registers)
+    collector.engine.decode_batches(read_batches(path))
+    return collector.get_columns()
@@ -0,0 +1,116 @@
+import json
+import os
+import zlib
+from .chips import CHIPS
+from .engine import Engine, EngineState
+from .events import read_positions
+
+INDEX_VERSION = 8
+CHECKPOINT_TRANSFERS = 1000
+HEAD_BYTES = 65536  # Start of the capture hashed to tell an appended capture from a replaced one
+START_COMMANDS = ('START', 'START REPEAT')
+ADDRESS_COMMANDS = ('ADDRESS READ', 'ADDRESS WRITE')
+# Options changing the state carried between transfers, besides the option showing each chip, including the held back
+# change-only runs and the annotations rendered into them, the open summary windows and the open anomaly episodes.
+# Checkpoints taken with other values, or at another samplerate, are not reused.
+STATE_OPTIONS = ('transactions', 'shadow', 'smbus', 'changes', 'annotations', 'verbosity', 'summary',
+                 'summary_window_1', 'summary_window_2', 'summary_window_3', 'anomalies', 'max_bms_temp',
+                 'max_pic_temp', 'max_cell_delta', 'max_pack_delta')
+
+
+def index_path(path):
+    return path + '.lmi-index.json'
+
+
+def get_head(path):
+    with open(path, 'rb') as f:
+        return zlib.crc32(f.read(HEAD_BYTES))
+
+
+# Checkpoints of the sidecar index that still hold for the capture, options and samplerate, oldest first
+def load_checkpoints(path, options, samplerate=None):
+    try:
+        with open(index_path(path), encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return []
+    if (index.get('version') != INDEX_VERSION or index.get('options') != get_state_options(options)
+            or index.get('samplerate') != samplerate or index.get('size', 0) > os.path.getsize(path)
+            or index.get('head') != get_head(path)):
+        return []
+    return index['checkpoints']
+
+
+def save_checkpoints(path, options, checkpoints, samplerate=None):
+    index = {
+        'version': INDEX_VERSION,
+        'options': get_state_options(options),
+        'samplerate': samplerate,
+        'size': os.path.getsize(path),
+        'head': get_head(path),
+        'checkpoints': checkpoints,
+    }
+    with open(index_path(path), 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+
+
+def get_state_options(options):
+    return {key: options.get(key) for key in [chip.value for chip in CHIPS] + list(STATE_OPTIONS)}
+
+
+# Sample of the last checkpoint, from which decoding the appended end of a capture begins
+def get_resume_sample(path, options, samplerate=None):
+    checkpoints = load_checkpoints(path, Engine(options).options, samplerate)
+    return checkpoints[-1]['ss'] if checkpoints else 0
+
+
+# Decodes the events of a capture from sample `start` up to sample `end`, putting what a full decode would put
+# in that range. Decoding begins at the latest checkpoint of the sidecar index at or before `start`, and new
+# checkpoints are taken every `interval` transfers past the last indexed one, so re-decoding a range after an
+# option change, or the appended end of a growing capture, skips everything before it.
+# Checkpoints sit where a STOP is followed by the next transfer's address, with no transfer in flight.
+# Returns the sample decoding resumed from.
+def decode_indexed(path, options, put, start=0, end=None, interval=CHECKPOINT_TRANSFERS, samplerate=None):
+    if start or end is not None:
+        output = put
+
+        def put(ss, es, output_id, data):
+            if ss >= start and (end is None or ss < end):
+                output(ss, es, output_id, data)
+
+    engine = Engine(options, put, samplerate)
+    engine.start()
+    checkpoints = load_checkpoints(path, engine.options, samplerate)
+    last = checkpoints[-1]['transfers'] if checkpoints else 0
+    resume = None
+    for checkpoint in checkpoints:
+        if checkpoint['ss'] > start:
+            break
+        resume = checkpoint
+
+    offset, line, transfers, resume_ss = None, 0, 0, 0
+    if resume is not None:
+        engine.set_state(EngineState(**resume['state']))
+        offset, line, transfers, resume_ss = resume['offset'], resume['line'], resume['transfers'], resume['ss']
+
+    added = False
+    split = False  # Last event was a STOP, maybe followed by START
+    for (offset, line), (ss, es, command, databyte) in read_positions(path, offset, line):
+        if end is not None and ss >= end:
+            break
+        if split and command not in START_COMMANDS:
+            if command in ADDRESS_COMMANDS:
+                transfers += 1
+                if transfers > last and transfers % interval == 0:
+                    checkpoints.append({'transfers': transfers, 'offset': offset, 'line': line, 'ss': ss,
+                                        'state': engine.get_state()._asdict()})
+                    added = True
+            split = False
+        engine.decode(ss, es, (command, databyte))
+        if command == 'STOP':
+            split = True
+    engine.end()
+
+    if added:
+        save_checkpoints(path, engine.options, checkpoints, samplerate)
+    return resume_ss
@@ -0,0 +1,104 @@
+from .pic import PIC as PIC_Routines
+from .bms import BMS as BMS_Routines
+from .hall import Hall as Hall_Routines
+from .usb_pd import USB_PD as USB_Routines
+from .summary import SUMMARY_WINDOWS
+
+ADDRESSES = 128  # 7-bit i2c addresses
+CHIP_ANN = 59  # Annotation class of the first class numbered by register_chip, after the engine's own
+
+
+# A device of the registry. value is its name: the id of the option showing its traffic and the chip named in records
+# and saved state. index numbers it in binary records.
+class Chip:
+    def __init__(self, routines, index, annotations, rows, summary, summary_rows, smbus_ann):
+        self.value = routines.name
+        self.address = routines.address
+        self.routines = routines
+        self.index = index
+        self.annotations = annotations  # (class, id, description)
+        self.rows = rows  # (id, description, classes)
+        self.summary = summary  # (class, id, description) of the summary annotation of each window, or ()
+        self.summary_rows = summary_rows
+        self.frames = getattr(routines, 'frames', None)  # SMBus frame sizes of the commands, None for plain i2c
+        self.smbus_ann = smbus_ann  # Annotation class of the SMBus PEC and framing results
+        self.anomalies = getattr(routines, 'anomalies', {})  # Field name -> (check, limit) of the anomaly rules
+
+    def __repr__(self):
+        return '<Chip {}>'.format(self.value)
+
+
+# Registered chips in registration order and by name. Tables derived from them are cached per tuple of chips.
+CHIPS = []
+CHIP_NAMES = {}
+
+
+# Adds a device to the registry. routines is a class like PIC or BMS holding its register declarations, optional
+# default_read/default_write routines, and as data:
+# name, i2c address, desc and default of the option showing the chip,
+# annotations as (class, id, description), class None to have it numbered after the classes taken so far,
+# rows as (id, description, annotation classes or ids),
+# optionally summary, the key of its summary rows, by default the id of its first row, or None for no summaries, and
+# summary_classes, the annotation class of the summary of each window, numbered like annotations when left out,
+# optionally frames, the SMBus frame sizes of its commands, with smbus_ann, the annotation class or id of the PEC and
+# framing results,
+# optionally anomalies, a dict from field name to the (check, limit) of AnomalyDetector watching it.
+# Fields of the registers may give their annotation class by id, it is replaced by the class number here.
+def register_chip(routines):
+    if routines.name in CHIP_NAMES:
+        raise ValueError('Chip {} is already registered'.format(routines.name))
+    if not 0 <= routines.address < ADDRESSES:
+        raise ValueError('Address 0x{:02X} of chip {} is not a 7-bit address'.format(routines.address, routines.name))
+    for chip in CHIPS:
+        if chip.address == routines.address:
+            raise ValueError('Address 0x{:02X} of chip {} belongs to {}'.format(routines.address, routines.name,
+                                                                              chip.value))
+
+    ann = max([CHIP_ANN - 1] + [ann for chip in CHIPS for ann, ann_id, desc in chip.annotations + chip.summary]) + 1
+    annotations = []
+    for cls, ann_id, desc in routines.annotations:
+        if cls is None:
+            cls, ann = ann, ann + 1
+        annotations.append((cls, ann_id, desc))
+    classes = {ann_id: cls for cls, ann_id, desc in annotations}
+
+    key = getattr(routines, 'summary', routines.rows[0][0])
+    summary = ()
+    if key is not None:
+        summary_classes = getattr(routines, 'summary_classes', None)
+        if summary_classes is None:
+            summary_classes, ann = tuple(range(ann, ann + SUMMARY_WINDOWS)), ann + SUMMARY_WINDOWS
+        summary = tuple((cls, 'summary_{}_{}'.format(window + 1, key),
+                         '{} summary, window {}'.format(routines.name, window + 1))
+                        for window, cls in enumerate(summary_classes))
+    summary_rows = tuple((ann_id, '{} summary (window {})'.format(routines.name, window + 1), (cls,))
+                         for window, (cls, ann_id, desc) in enumerate(summary))
+    smbus_ann = None
+    if getattr(routines, 'frames', None):
+        if getattr(routines, 'smbus_ann', None) is None:
+            raise ValueError('Chip {} frames SMBus commands without an smbus_ann class'.format(routines.name))
+        smbus_ann = classes.get(routines.smbus_ann, routines.smbus_ann)
+
+    rows = tuple((row_id, desc, tuple(classes.get(cls, cls) for cls in row_classes))
+                 for row_id, desc, row_classes in routines.rows)
+    for register in routines.registers:
+        for field in register.fields:
+            for field in (field,) + tuple(field.parts or ()):
+                if isinstance(field.ann, str):
+                    field.ann = classes[field.ann]
+
+    chip = Chip(routines, len(CHIPS), tuple(annotations), rows, summary, summary_rows, smbus_ann)
+    CHIPS.append(chip)
+    CHIP_NAMES[chip.value] = chip
+    return chip
+
+
+def get_chip(name):
+    return CHIP_NAMES[name]
+
+
+# Registered in the order of their record index
+PIC = register_chip(PIC_Routines)
+BMS = register_chip(BMS_Routines)
+HALL = register_chip(Hall_Routines)
+USB = register_chip(USB_Routines)
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import json
+import os
+import sys
+from .chips import CHIPS
+from .engine import OPTIONS, OUTPUT_ANN
+from .events import convert_text
+from .parallel import decode_capture, decode_parallel, SHARD_EVENTS
+from .store import Store, parse_condition
+from .stream import get_update, decode_live, LATENCY
+from . import checkpoint, export
+
+
+def parse_options(pairs):
+    defaults = {option['id']: option['default'] for option in OPTIONS}
+    options = {}
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if not sep or key not in defaults:
+            raise SystemExit('Unknown decoder option: {}'.format(pair))
+        options[key] = type(defaults[key])(value)
+    return options
+
+
+def text_writer(out, decoder_id):
+    def put(ss, es, output, data):
+        if output == OUTPUT_ANN:
+            out.write('{}-{} {}: {}\n'.format(ss, es, decoder_id, data[1][0]))
+    return put
+
+
+def json_writer(out):
+    def put(ss, es, output, data):
+        update = get_update(ss, es, output, data)
+        if update is not None:
+            out.write(json.dumps(update, default=str) + '\n')
+    return put
+
+
+def get_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def export_dir(base, path):
+    if base is None:
+        return None
+    directory = os.path.join(base, get_name(path))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def decode_file(path, options, out, args):
+    writer = json_writer if args.json else functools.partial(text_writer, decoder_id='lmi_reflex-1')
+    put = writer(out)
+    exporter = None
+    if args.export_csv is not None or args.export_npz is not None:
+        exporter = export.ColumnExporter(export_dir(args.export_csv, path), export_dir(args.export_npz, path),
+                                  args.chunk_size)
+        write = put
+
+        def put(ss, es, output, data):
+            write(ss, es, output, data)
+            exporter.put(ss, es, output, data)
+
+    if args.index:
+        start = checkpoint.get_resume_sample(path, options, args.samplerate) if args.resume else args.start
+        checkpoint.decode_indexed(path, options, put, start, args.end, args.checkpoint_interval, args.samplerate)
+    elif args.jobs != 1:
+        decode_parallel(path, options, out, writer, args.jobs or None, args.shard_events, args.samplerate)
+    else:
+        decode_capture(path, options, put, args.samplerate)
+    if exporter is not None:
+        exporter.close()
+
+
+def open_store(path):
+    try:
+        return Store(path)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+
+# Decodes the captures into the store one after the other, each keyed by its absolute path
+def ingest_files(paths, options, args):
+    store = open_store(args.store)
+    try:
+        for path in paths:
+            store.begin_capture(get_name(path), os.path.abspath(path), args.samplerate)
+            decode_capture(path, options, store.put, args.samplerate)
+            print('{}: {} records'.format(path, store.end_capture()))
+    finally:
+        store.close()
+
+
+# Answers --where from the store: the captures meeting any condition, or with --hits every matching record
+def query_store(args):
+    store = open_store(args.store)
+    try:
+        conditions = [parse_condition(text) for text in args.where]
+        if args.hits:
+            for condition in conditions:
+                for hit in store.get_hits(condition):
+                    print(json.dumps(hit._asdict()))
+        else:
+            for hit in store.get_capture_hits(conditions):
+                print(json.dumps(dict(hit._asdict(), condition=args.where[conditions.index(hit.condition)])))
+    except ValueError as e:
+        raise SystemExit(str(e))
+    finally:
+        store.close()
+
+
+def parse_address(address):
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit():
+        raise SystemExit('Expected HOST:PORT, got {}'.format(address))
+    return host or 'localhost', int(port)
+
+
+# Streams JSON lines to stdout, unless the dashboard takes the terminal, to --jsonl and to socket clients
+def decode_live_file(path, options, args):
+    files = [] if args.dashboard else [sys.stdout]
+    address = parse_address(args.serve) if args.serve is not None else None
+    log = open(args.jsonl, 'a', encoding='utf-8') if args.jsonl is not None else None
+    if log is not None:
+        files.append(log)
+    f = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    try:
+        asyncio.run(decode_live(f, options, files, address, args.dashboard, args.follow, args.latency,
+                                args.samplerate))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if log is not None:
+            log.close()
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='lmi_reflex', description='Decode LMI Reflex I2C captures offline from '
+                                     'sigrok-cli -P i2c text output or binary I2C event files.')
+    parser.add_argument('captures', nargs='*', help='sigrok-cli i2c output or binary event files')
+    parser.add_argument('-o', '--option', action='append', default=[], metavar='ID=VALUE',
+                        help='decoder option, e.g. -o BMS=yes')
+    parser.add_argument('-j', '--json', action='store_true', help='write JSON lines instead of annotation text')
+    parser.add_argument('-r', '--records', action='store_true',
+                        help='write typed records (as JSON lines) instead of annotations')
+    parser.add_argument('-O', '--output-dir', help='write one output file per capture into this directory')
+    parser.add_argument('--export-csv', metavar='DIR', help='export numeric telemetry as per-channel CSV files')
+    parser.add_argument('--export-npz', metavar='DIR', help='export numeric telemetry as chunked NumPy .npz files')
+    parser.add_argument('--chunk-size', type=int, default=65536, help='values buffered between export flushes')
+    parser.add_argument('--samplerate', type=float, help='capture samplerate in Hz, needed by summary windows')
+    parser.add_argument('-J', '--jobs', type=int, default=1,
+                        help='decode in this many processes, 0 for one per CPU, writing annotation text or JSON lines')
+    parser.add_argument('-T', '--threads', type=int, default=1,
+                        help='decode this many captures at once, each into its own file in --output-dir')
+    parser.add_argument('--shard-events', type=int, default=SHARD_EVENTS,
+                        help='I2C events per shard when decoding in several processes')
+    parser.add_argument('--index', action='store_true',
+                        help='keep decoder checkpoints in a <capture>.lmi-index.json sidecar and start from them')
+    parser.add_argument('--start', type=int, default=0, help='with --index, output from this sample on')
+    parser.add_argument('--end', type=int, help='with --index, stop decoding at this sample')
+    parser.add_argument('--resume', action='store_true',
+                        help='with --index, output from the last checkpoint on, e.g. after the capture grew')
+    parser.add_argument('--checkpoint-interval', type=int, default=checkpoint.CHECKPOINT_TRANSFERS,
+                        help='transfers between checkpoints')
+    parser.add_argument('--convert', metavar='DIR',
+                        help='convert the captures into binary event files in this directory instead of decoding')
+    parser.add_argument('--live', action='store_true',
+                        help='decode one sigrok-cli i2c text capture, - for stdin, as it is written and stream '
+                        'JSON lines of annotations and records')
+    parser.add_argument('--follow', action='store_true', help='with --live, keep reading the capture as it grows')
+    parser.add_argument('--latency', type=float, default=LATENCY,
+                        help='with --live, seconds an update may wait to be batched')
+    parser.add_argument('--jsonl', metavar='FILE', help='with --live, also append the JSON lines to this file')
+    parser.add_argument('--serve', metavar='HOST:PORT', help='with --live, serve the JSON lines to TCP clients')
+    parser.add_argument('--dashboard', action='store_true',
+                        help='with --live, show the latest values in the terminal instead of printing JSON lines')
+    parser.add_argument('--store', metavar='DB',
+                        help='store the fields of every chip decoded from the captures in this SQLite file, or query '
+                        'it with --where')
+    parser.add_argument('--where', action='append', metavar='CONDITION',
+                        help='with --store, list the stored captures with a field meeting this condition: FIELD>X, '
+                        'FIELD<X, X<FIELD<Y or "FIELD changed", FIELD as chip.field or chip.register.field with * '
+                        'wildcards; repeat to list captures meeting any of them')
+    parser.add_argument('--hits', action='store_true', help='with --where, list the matching fields instead')
+    args = parser.parse_args(argv)
+    if not args.captures and args.where is None:
+        parser.error('the following arguments are required: captures')
+    if args.where is not None and (args.store is None or args.captures):
+        parser.error('--where queries a --store, without captures')
+    if args.hits and args.where is None:
+        parser.error('--hits requires --where')
+    if args.store is not None and (args.live or args.index or args.output_dir is not None
+                                   or args.export_csv is not None or args.export_npz is not None):
+        parser.error('--store takes the decoded fields, without --live, --index, --output-dir or exports')
+    if args.export_npz is not None and export.numpy is None:
+        parser.error('--export-npz requires NumPy')
+    if args.threads != 1 and args.output_dir is None:
+        parser.error('--threads requires --output-dir')
+    if args.jobs != 1 and (args.index or args.store is not None or args.export_csv is not None
+                           or args.export_npz is not None):
+        parser.error('--jobs decodes to text or JSON lines, without --index, --store or exports')
+    if not args.index and (args.start or args.end is not None or args.resume):
+        parser.error('--start, --end and --resume require --index')
+    if args.live and (len(args.captures) != 1 or args.index or args.jobs != 1 or args.output_dir is not None
+                      or args.export_csv is not None or args.export_npz is not None):
+        parser.error('--live decodes one capture, without --index, --jobs, --output-dir or exports')
+    if not args.live and (args.follow or args.jsonl is not None or args.serve is not None or args.dashboard):
+        parser.error('--follow, --jsonl, --serve and --dashboard require --live')
+    options = {'records': 'none'}
+    if args.records:
+        args.json = True
+        options = {'annotations': 'no', 'records': 'python'}
+    if args.export_csv is not None or args.export_npz is not None:
+        options['records'] = 'python'
+    if args.live:
+        options['records'] = 'python'  # The dashboard shows record values
+    if args.store is not None:
+        options = {'annotations': 'no', 'records': 'python'}
+        options.update({chip.value: 'yes' for chip in CHIPS})
+    options.update(parse_options(args.option))
+
+    if args.convert is not None:
+        os.makedirs(args.convert, exist_ok=True)
+        for path in args.captures:
+            convert_text(path, os.path.join(args.convert, os.path.splitext(os.path.basename(path))[0] + '.bin'))
+        return
+    if args.live:
+        decode_live_file(args.captures[0], options, args)
+        return
+    if args.where is not None:
+        query_store(args)
+        return
+    if args.store is not None:
+        ingest_files(args.captures, options, args)
+        return
+
+    if args.output_dir is None:
+        for path in args.captures:
+            decode_file(path, options, sys.stdout, args)
+        return
+
+    def decode_to_dir(path):
+        name = os.path.splitext(os.path.basename(path))[0] + ('.jsonl' if args.json else '.txt')
+        with open(os.path.join(args.output_dir, name), 'w', encoding='utf-8') as out:
+            decode_file(path, options, out, args)
+
+    # Every capture gets its own Engine, so captures of several units decode side by side. Engines share only read-only
+    # tables; threads overlap the reading of the captures, not the decoding itself.
+    with concurrent.futures.ThreadPoolExecutor(args.threads or None) as executor:
+        for _ in executor.map(decode_to_dir, args.captures):
+            pass
@@ -0,0 +1,514 @@
+import functools
+from collections import namedtuple
+from .chips import CHIPS, ADDRESSES, PIC, get_chip
+from .regmap import RegisterMap, LEVELS, pick_texts
+from .records import Record, pack_record
+from .profiler import Profiler
+from .summary import Summarizer, SUMMARY_WINDOWS
+from .smbus import SMBusFramer
+from .anomaly import AnomalyDetector
+from .events import EVENT, EVENT_DATA
+
+# Output types, numbered as in sigrokdecode
+OUTPUT_ANN = 0
+OUTPUT_PYTHON = 1
+OUTPUT_BINARY = 2
+OUTPUT_META = 4
+
+ANOMALY_ANN = 54  # Annotation class of the first anomaly rule
+
+
+# Options of the engine, following the option showing each registered chip
+ENGINE_OPTIONS = (
+    {'id': 'cache_size', 'desc': 'Annotation cache size (16/32-bit values)', 'default': 1024},
+    {'id': 'transactions', 'desc': 'Decode whole transfers at STOP instead of per byte', 'default': 'no',
+     'values': ('yes', 'no')},
+    {'id': 'annotations', 'desc': 'Format annotation strings', 'default': 'yes',
+     'values': ('yes', 'no')},
+    {'id': 'verbosity', 'desc': 'Annotation variants to generate', 'default': 'full',
+     'values': LEVELS},
+    {'id': 'records', 'desc': 'Publish typed records on the Python and/or binary output', 'default': 'none',
+     'values': ('none', 'python', 'binary', 'both')},
+    {'id': 'shadow', 'desc': 'Only annotate shadowed registers (USB-PD) when a read changes their value',
+     'default': 'yes', 'values': ('yes', 'no')},
+    {'id': 'smbus', 'desc': 'Frame SMBus (BMS) transfers by their length and check PEC bytes', 'default': 'yes',
+     'values': ('yes', 'no')},
+    {'id': 'changes', 'desc': 'Merge repeated field values (optionally within a deadband) into one annotation',
+     'default': 'no', 'values': ('no', 'yes', 'deadband')},
+    {'id': 'summary', 'desc': 'Min/max/mean summary rows of numeric fields over fixed windows', 'default': 'no',
+     'values': ('yes', 'no')},
+    {'id': 'summary_window_1', 'desc': 'First summary window in seconds (0 = off)', 'default': 0.001},
+    {'id': 'summary_window_2', 'desc': 'Second summary window in seconds (0 = off)', 'default': 0.1},
+    {'id': 'summary_window_3', 'desc': 'Third summary window in seconds (0 = off)', 'default': 1.0},
+    {'id': 'anomalies', 'desc': 'Flag over-temperature, cell imbalance, PACK/BAT mismatch, USB PD capability '
+     'mismatch and unknown addresses', 'default': 'no', 'values': ('yes', 'no')},
+    {'id': 'max_bms_temp', 'desc': 'BMS temperature limit in °C', 'default': 60.0},
+    {'id': 'max_pic_temp', 'desc': 'PIC temperature limit in °C', 'default': 70.0},
+    {'id': 'max_cell_delta', 'desc': 'Cell voltage spread limit in volts', 'default': 0.1},
+    {'id': 'max_pack_delta', 'desc': 'PACK to BAT voltage difference limit in volts', 'default': 0.5},
+    {'id': 'anomaly_log', 'desc': 'Append anomaly events as JSON lines to this file', 'default': ''},
+    {'id': 'profile', 'desc': 'Count bytes, annotations and decode time per chip and register', 'default': 'no',
+     'values': ('yes', 'no')},
+    {'id': 'profile_interval', 'desc': 'Data bytes between profile updates', 'default': 10000},
+)
+# Annotation classes of the engine as (class, id, description), the registered chips and their summaries fill in the
+# classes between
+ENGINE_ANNOTATIONS = (
+    (0, 'chip-info', 'Chip Info'),
+    (30, 'profile', 'Decode time per chip'),
+    (54, 'anomaly_temp', 'Over-temperature'),
+    (55, 'anomaly_cells', 'Cell voltage imbalance'),
+    (56, 'anomaly_pack', 'PACK/BAT voltage mismatch'),
+    (57, 'anomaly_usb', 'USB PD capability mismatch'),
+    (58, 'anomaly_address', 'Unknown chip address'),
+)
+# Annotation rows of the engine, the rows of the registered chips follow the first and their summary rows the last
+ENGINE_ROWS = (
+    ('chips', 'Chip info', (0,)),
+    ('anomalies', 'Anomalies', (54, 55, 56, 57, 58)),
+    ('profile', 'Decoder profile', (30,)),
+)
+
+
+# Options, annotation classes and annotation rows of the engine and the given chips, a tuple of registered chips,
+# built once per set of chips
+@functools.lru_cache(maxsize=None)
+def get_tables(chips):
+    options = tuple({'id': chip.value, 'desc': chip.routines.desc, 'default': chip.routines.default,
+                     'values': ('yes', 'no')} for chip in chips) + ENGINE_OPTIONS
+    classes = {}
+    annotations = ENGINE_ANNOTATIONS + tuple(ann for chip in chips for ann in chip.annotations + chip.summary)
+    for cls, ann_id, desc in annotations:
+        if cls in classes:
+            raise ValueError('Annotation class {} of {} belongs to {}'.format(cls, ann_id, classes[cls][0]))
+        classes[cls] = (ann_id, desc)
+    missing = sorted(set(range(max(classes))) - set(classes))
+    if missing:
+        raise ValueError('Annotation classes {} are not declared'.format(missing))
+    rows = ENGINE_ROWS[:1] + tuple(row for chip in chips for row in chip.rows) + ENGINE_ROWS[1:] + tuple(
+        sorted((row for chip in chips for row in chip.summary_rows), key=lambda row: row[2]))
+    return options, tuple(classes[cls] for cls in range(len(classes))), rows
+
+
+# Register maps are compiled once per set of chips and settings and shared by every Engine, they are only read
+@functools.lru_cache(maxsize=None)
+def get_register_map(chips, cache_size, level, shadow):
+    return RegisterMap({chip: chip.routines for chip in chips}, cache_size, level, shadow)
+
+
+OPTIONS, ANNOTATIONS, ANNOTATION_ROWS = get_tables(tuple(CHIPS))
+
+
+# Everything an Engine carries from one event to the next, in JSON-friendly values: chips by name, commands as
+# ints or [command, subcommand] lists, a buffered transfer as [data, ss list, es list] and the held back runs of
+# change-only mode as [key, ss, es, value, annotation] lists, the open summary windows and anomaly episodes as
+# Summarizer.get_state and AnomalyDetector.get_state give
+# them and the register shadow as [chip, address, raw] lists.
+# What is shown follows from the options, so it is not part of the state.
+EngineState = namedtuple('EngineState', ('chip', 'write', 'prev_chip', 'curr_cmd', 'chip_cmds', 'data_key',
+                                         'work_var', 'ann_start_pos', 'transfer', 'runs', 'windows', 'shadow',
+                                         'anomalies'))
+
+
+def dump_cmd(cmd):
+    return list(cmd) if isinstance(cmd, tuple) else cmd
+
+
+def load_cmd(cmd):
+    return tuple(cmd) if isinstance(cmd, list) else cmd
+
+
+# What an Engine changes while decoding one bus, apart from its tables compiled at start(). Every Engine owns one,
+# so engines decoding different buses share nothing they write to and can run side by side in threads.
+class BusState:
+    __slots__ = ('chip', 'write', 'shown', 'prev_chip', 'curr_cmd', 'chip_cmds', 'data_key', 'work_var',
+                 'ann_start_pos')
+
+    def __init__(self):
+        self.chip = PIC
+        self.write = False
+        self.shown = False  # Whether the chip of the current transfer is shown
+        self.prev_chip = None  # (chip, is_write) of the previous transfer
+        self.curr_cmd = None  # Command selecting the register map of the current transfer
+        self.chip_cmds = {}  # Last command selected on each chip, used by following reads
+        self.data_key = 0
+        self.work_var = None  # Holds any var needed across samples
+        self.ann_start_pos = 0
+
+
+# Decodes the LMI Reflex chips from i2c decoder output without needing libsigrokdecode.
+# put(ss, es, output, data) receives everything the sigrok decoder would put.
+class Engine:
+    state = None
+    shown_chips = frozenset()
+    chip_table = None  # (chip, shown) of every 7-bit address
+
+    transfer = None  # Data bytes of the current transfer in transaction mode
+    transfer_ss = None
+    transfer_es = None
+    decode_data = None
+
+    regmap = None
+    dispatch = None
+    annotate = True
+    level = 'full'
+    chip_anns = None  # Address annotation of each (chip, is_write)
+    shadow = None  # Last value of each shadowed (chip, register address)
+    runs = None  # Change-only mode: [ss, es, value, annotation] of the run held back for each field id, or 'chip'
+    use_deadbands = False
+    python_records = False
+    binary_records = False
+    out_ann = OUTPUT_ANN
+    out_python = OUTPUT_PYTHON
+    out_binary = OUTPUT_BINARY
+    out_meta = OUTPUT_META
+    profiler = None
+    summarizer = None
+    detector = None
+    smbus = None
+    samplerate = None
+
+    def __init__(self, options=None, put=None, samplerate=None):
+        self.options = {option['id']: option['default'] for option in get_tables(tuple(CHIPS))[0]}
+        if options:
+            self.options.update(options)
+        self.put = put
+        self.samplerate = samplerate
+        self.reset()
+
+    def reset(self):
+        self.state = BusState()
+        self.transfer = None
+        self.runs = {}
+        self.shadow = {}
+
+    def start(self):
+        self.level = self.options['verbosity']
+        chips = tuple(CHIPS)
+        self.shown_chips = frozenset(chip for chip in chips
+                                     if self.options.get(chip.value, chip.routines.default) == 'yes')
+        self.regmap = get_register_map(chips, self.options['cache_size'], self.level, self.options['shadow'] == 'yes')
+        self.dispatch = self.regmap.dispatch
+        self.annotate = self.options['annotations'] == 'yes'
+        self.chip_anns = {}
+        for chip in chips:
+            name = chip.value
+            self.chip_anns[(chip, True)] = [0, self.get_chip_texts(
+                ('Writing to chip: ', 'Write chip ', 'Write ', 'W '), 'WC', name)]
+            self.chip_anns[(chip, False)] = [0, self.get_chip_texts(
+                ('Reading from chip: ', 'Read chip ', 'Read ', 'R '), 'RC', name)]
+        self.python_records = self.options['records'] in ('python', 'both')
+        self.binary_records = self.options['records'] in ('binary', 'both')
+        if self.options['transactions'] == 'yes':
+            self.transfer, self.transfer_ss, self.transfer_es = bytearray(), [], []
+            self.decode_data = self.buffer_byte
+        else:
+            self.decode_data = self.decode_byte
+        if self.options['changes'] != 'no':
+            self.use_deadbands = self.options['changes'] == 'deadband'
+            self.emit_field = self.emit_field_runs
+            self.put_chip_ann = self.put_chip_run
+        else:
+            self.put_chip_ann = self.put_ann
+        # Optional features install() wrappers over the engine's methods, so an engine started without one runs the
+        # plain methods and pays nothing for it
+        if self.options['summary'] == 'yes':
+            windows = [(window, self.options['summary_window_{}'.format(window + 1)])
+                       for window in range(SUMMARY_WINDOWS)]
+            self.summarizer = Summarizer(self, [window for window in windows if window[1] > 0],
+                                         {chip: [ann[0] for ann in chip.summary] for chip in chips if chip.summary})
+            self.summarizer.install()
+            if self.samplerate is not None:
+                self.summarizer.set_samplerate(self.samplerate)
+        if self.options['anomalies'] == 'yes':
+            limits = {'bms_temp': self.options['max_bms_temp'], 'pic_temp': self.options['max_pic_temp'],
+                      'cell_delta': self.options['max_cell_delta'], 'pack_delta': self.options['max_pack_delta']}
+            self.detector = AnomalyDetector(self, limits, ANOMALY_ANN, self.options['anomaly_log'])
+            self.detector.install()
+        if self.options['smbus'] == 'yes':
+            framed = {chip.address: chip for chip in self.shown_chips if chip.frames}
+            if framed:
+                self.smbus = SMBusFramer(self, framed)
+                self.smbus.install()
+        if self.options['profile'] == 'yes':
+            self.profiler = Profiler(self, {chip.address: chip for chip in chips}, self.options['profile_interval'])
+            self.profiler.install()
+
+        # Chip of every address and whether it is shown, None for addresses of no registered chip
+        self.chip_table = [(None, False)] * ADDRESSES
+        for chip in chips:
+            self.chip_table[chip.address] = (chip, chip in self.shown_chips)
+        self.state.shown = self.state.chip in self.shown_chips
+
+    def get_state(self):
+        state = self.state
+        prev_chip = None
+        if state.prev_chip is not None:
+            prev_chip = [None if state.prev_chip[0] is None else state.prev_chip[0].value, state.prev_chip[1]]
+        transfer = None
+        if self.transfer:
+            transfer = [list(self.transfer), list(self.transfer_ss), list(self.transfer_es)]
+        return EngineState(None if state.chip is None else state.chip.value, state.write, prev_chip,
+                           dump_cmd(state.curr_cmd),
+                           {chip.value: dump_cmd(cmd) for chip, cmd in state.chip_cmds.items() if chip is not None},
+                           state.data_key, state.work_var, state.ann_start_pos, transfer,
+                           [[key] + run for key, run in self.runs.items()],
+                           self.summarizer.get_state() if self.summarizer is not None else [],
+                           [[chip.value, address, raw] for (chip, address), raw in self.shadow.items()],
+                           self.detector.get_state() if self.detector is not None else None)
+
+    # Continues decoding from a state taken by get_state, on an engine started with the same chip and transaction
+    # options
+    def set_state(self, state):
+        bus = self.state = BusState()
+        bus.chip = None if state.chip is None else get_chip(state.chip)
+        bus.write = state.write
+        bus.shown = bus.chip in self.shown_chips
+        if state.prev_chip is not None:
+            bus.prev_chip = (None if state.prev_chip[0] is None else get_chip(state.prev_chip[0]), state.prev_chip[1])
+        bus.curr_cmd = load_cmd(state.curr_cmd)
+        bus.chip_cmds = {get_chip(name): load_cmd(cmd) for name, cmd in state.chip_cmds.items()}
+        bus.data_key = state.data_key
+        bus.work_var = state.work_var
+        bus.ann_start_pos = state.ann_start_pos
+        if self.transfer is not None:
+            self.transfer[:] = state.transfer[0] if state.transfer else b''
+            self.transfer_ss[:] = state.transfer[1] if state.transfer else []
+            self.transfer_es[:] = state.transfer[2] if state.transfer else []
+        self.runs = {run[0]: run[1:] for run in state.runs}
+        if self.summarizer is not None:
+            self.summarizer.set_state(state.windows, get_chip)
+        self.shadow = {(get_chip(chip), address): raw for chip, address, raw in state.shadow}
+        if self.detector is not None and state.anomalies is not None:
+            self.detector.set_state(state.anomalies)
+
+    def get_chip_texts(self, prefixes, short, name):
+        if self.level == 'values':
+            return [prefixes[-1] + name]
+        return pick_texts([prefix + name for prefix in prefixes] + [short], self.level)
+
+    def put_ann(self, ssample, esample, data):
+        self.put(ssample, esample, self.out_ann, data)
+
+    # Summary windows are measured in samples, from the samplerate sigrok passes as metadata
+    def set_samplerate(self, samplerate):
+        self.samplerate = samplerate
+        if self.summarizer is not None:
+            self.summarizer.set_samplerate(samplerate)
+
+    # Profile snapshots go to the meta output, the sigrok adapter splits them into its registered metas
+    def put_profile(self, ssample, esample, profile):
+        self.put(ssample, esample, self.out_meta, profile)
+
+    # Transfer to an address of no known chip, checked by the anomaly rules
+    def unknown_address(self, ssample, esample, address):
+        pass
+
+    # Offset 0 holds the command itself, later offsets hold a subcommand of it
+    def select_cmd(self, field, cmd):
+        state = self.state
+        prev_cmd = state.chip_cmds.get(state.chip)
+        if field.offset == 0:
+            state.curr_cmd = cmd
+            if not (isinstance(prev_cmd, tuple) and prev_cmd[0] == cmd):
+                state.chip_cmds[state.chip] = cmd
+        else:
+            state.chip_cmds[state.chip] = (state.curr_cmd, cmd)
+
+    def put_record(self, ss, es, info, field, raw):
+        value = field.value(raw)
+        if self.python_records:
+            self.put(ss, es, self.out_python, Record(info.chip.value, info.register, info.name, value, info.unit,
+                                                     raw, ss, es))
+        if self.binary_records:
+            self.put(ss, es, self.out_binary, [0, pack_record(ss, es, info.chip.index, info.id, raw, value)])
+
+    # Publishes a completed field on every enabled output
+    def emit_field(self, ss, es, slot, raw):
+        if slot[6] is not None and self.emit_special(ss, es, slot, raw):
+            return
+        field = slot[0]
+        if field.select:
+            self.select_cmd(field, raw)
+        if self.annotate:
+            data = slot[4](raw)
+            if data:
+                self.put_ann(ss, es, data)
+        if field.record and (self.python_records or self.binary_records):
+            self.put_record(ss, es, slot[5], field, raw)
+
+    # Drops reads of a shadowed register repeating its last value, and emits a frame as each of its parts.
+    # Returns whether the field was handled.
+    def emit_special(self, ss, es, slot, raw):
+        special = slot[6]
+        if special.shadow is not None:
+            if not special.write and self.shadow.get(special.shadow) == raw:
+                return True
+            self.shadow[special.shadow] = raw
+        if special.parts is not None:
+            for part in special.parts:
+                self.emit_field(ss, es, part, part[0].extract(raw))
+            return True
+        return False
+
+    # Change-only mode: a field's annotation is held back while the field repeats its value, or stays within its
+    # deadband of the first value, and put once spanning the whole run when the value changes or decoding ends.
+    # Records are still published for every value.
+    def emit_field_runs(self, ss, es, slot, raw):
+        if slot[6] is not None and self.emit_special(ss, es, slot, raw):
+            return
+        field = slot[0]
+        if field.select:
+            self.select_cmd(field, raw)
+        if self.annotate and field.ann is not None:
+            key = slot[5].id
+            run = self.runs.get(key)
+            if self.use_deadbands and field.deadband:
+                value = field.value(raw)
+                same = run is not None and abs(value - run[2]) <= field.deadband
+            else:
+                value = raw
+                same = run is not None and value == run[2]
+            if same:
+                run[1] = es
+            else:
+                if run is not None:
+                    self.put_ann(run[0], run[1], run[3])
+                data = slot[4](raw)
+                if data:
+                    self.runs[key] = [ss, es, value, data]
+                else:
+                    self.runs.pop(key, None)
+        if field.record and (self.python_records or self.binary_records):
+            self.put_record(ss, es, slot[5], field, raw)
+
+    # Consecutive transfers to the same chip and direction share one chip annotation in change-only mode
+    def put_chip_run(self, ss, es, data):
+        run = self.runs.get('chip')
+        if run is not None and run[3] == data:
+            run[1] = es
+            return
+        if run is not None:
+            self.put_ann(run[0], run[1], run[3])
+        self.runs['chip'] = [ss, es, data, data]
+
+    def put_runs(self):
+        for run in sorted(self.runs.values(), key=lambda run: run[0]):
+            self.put_ann(run[0], run[1], run[3])
+        self.runs.clear()
+
+    def decode_default(self, ss, es, databyte):
+        state = self.state
+        default = self.regmap.get_default(state.chip, state.write, state.curr_cmd)
+        if default and self.annotate:
+            data = default(self, databyte)
+            if data:
+                self.put_ann(ss, es, data)
+
+    def decode_byte(self, ss, es, databyte):
+        state = self.state
+        slot = self.dispatch.get((state.chip, state.write, state.curr_cmd, state.data_key))
+        if slot is None:
+            self.decode_default(ss, es, databyte)
+        else:
+            if slot[2]:  # First byte of a field
+                state.ann_start_pos = ss
+                state.work_var = 0
+            state.work_var |= databyte << slot[1]
+            if slot[3]:
+                self.emit_field(state.ann_start_pos, es, slot, state.work_var)
+        state.data_key += 1
+
+    def buffer_byte(self, ss, es, databyte):
+        self.transfer.append(databyte)
+        self.transfer_ss.append(ss)
+        self.transfer_es.append(es)
+
+    # Decodes the buffered transfer in one pass, one annotation per field
+    def decode_transfer(self):
+        state = self.state
+        buf = self.transfer
+        key = 0
+        while key < len(buf):
+            slot = self.dispatch.get((state.chip, state.write, state.curr_cmd, key))
+            if slot is None or not slot[2]:
+                state.data_key = key
+                self.decode_default(self.transfer_ss[key], self.transfer_es[key], buf[key])
+                key += 1
+                continue
+
+            field = slot[0]
+            end = key + field.width
+            if end > len(buf):
+                break
+            raw = int.from_bytes(buf[key:end], field.order)
+            self.emit_field(self.transfer_ss[key], self.transfer_es[end - 1], slot, raw)
+            key = end
+        state.data_key = len(buf)
+
+    def end_transfer(self):
+        if self.transfer:
+            self.decode_transfer()
+            self.transfer.clear()
+            self.transfer_ss.clear()
+            self.transfer_es.clear()
+
+    def decode(self, ss, es, data):
+        command, databyte = data
+        state = self.state
+
+        if command == 'STOP':
+            if self.transfer is not None:
+                self.end_transfer()
+        elif command == 'ADDRESS WRITE':
+            if self.transfer is not None:
+                self.end_transfer()
+            state.prev_chip = (state.chip, state.write)
+            state.chip, state.shown = self.chip_table[databyte] if databyte < ADDRESSES else (None, False)
+            state.write = True
+            if state.chip is None:
+                self.unknown_address(ss, es, databyte)
+            state.curr_cmd = None
+            state.data_key = 0
+
+            if self.annotate and state.shown:
+                self.put_chip_ann(ss, es, self.chip_anns[(state.chip, True)])
+        elif command == 'ADDRESS READ':
+            if self.transfer is not None:
+                self.end_transfer()
+            state.prev_chip = (state.chip, state.write)
+            state.chip, state.shown = self.chip_table[databyte] if databyte < ADDRESSES else (None, False)
+            state.write = False
+            if state.chip is None:
+                self.unknown_address(ss, es, databyte)
+            state.curr_cmd = state.chip_cmds.get(state.chip)
+            state.data_key = 0
+
+            if self.annotate and state.shown:
+                self.put_chip_ann(ss, es, self.chip_anns[(state.chip, False)])
+        elif state.shown:
+            if command in ('DATA READ', 'DATA WRITE'):
+                self.decode_data(ss, es, databyte)
+            elif command == "NACK":
+                pass
+
+    # Decodes anything still buffered at the end of the capture
+    def end(self):
+        if self.transfer is not None:
+            self.end_transfer()
+        if self.runs:
+            self.put_runs()
+
+    def decode_events(self, events):
+        for ss, es, command, databyte in events:
+            self.decode(ss, es, (command, databyte))
+        self.end()
+
+    # Decodes batches of packed binary events, e.g. from events.read_batches, without a string or data tuple per event
+    def decode_batches(self, batches):
+        decode = self.decode
+        for batch in batches:
+            for ss, es, code, databyte in EVENT.iter_unpack(batch):
+                decode(ss, es, EVENT_DATA[code][databyte])
+        self.end()
+
@@ -0,0 +1,167 @@
+import mmap
+import re
+import struct
+
+# I2C decoder commands, indexed by their code in binary event files
+COMMANDS = ('START', 'START REPEAT', 'STOP', 'ACK', 'NACK', 'ADDRESS READ', 'ADDRESS WRITE', 'DATA READ',
+            'DATA WRITE')
+COMMAND_CODES = {command: code for code, command in enumerate(COMMANDS)}
+# The (command, databyte) data of every event code and byte, shared by all events read from binary files
+EVENT_DATA = tuple(tuple((command, databyte) for databyte in range(256)) for command in COMMANDS)
+
+# Annotation texts printed by sigrok-cli -P i2c
+TEXT_COMMANDS = {'Start': 'START', 'Start repeat': 'START REPEAT', 'Stop': 'STOP', 'ACK': 'ACK', 'NACK': 'NACK',
+                 'Address read': 'ADDRESS READ', 'Address write': 'ADDRESS WRITE', 'Data read': 'DATA READ',
+                 'Data write': 'DATA WRITE'}
+TEXT_LINE = re.compile(r'^(?:(\d+)-(\d+) )?\S+: (.*)$')
+
+# Binary event file: magic, then fixed-width (ss, es, command code, databyte) records
+BINARY_MAGIC = b'LMII2C\x00\x01'
+EVENT = struct.Struct('<QQBB')
+CHUNK_EVENTS = 65536
+# Fields of the NumPy dtype of an event. NumPy is imported by map_array only, the decoder loaded by sigrok never needs
+# it.
+EVENT_FIELDS = [('ss', '<u8'), ('es', '<u8'), ('command', 'u1'), ('databyte', 'u1')]
+
+
+# Parses one line of sigrok-cli i2c output, with or without --protocol-decoder-samplenum.
+# Without sample numbers the line number stands in for both.
+def parse_line(line, num):
+    match = TEXT_LINE.match(line.rstrip('\r\n'))
+    if match is None:
+        return None
+    name, _, value = match.group(3).partition(': ')
+    command = TEXT_COMMANDS.get(name)
+    if command is None:
+        return None
+    databyte = int(value, 16) if value else None
+    if match.group(1) is None:
+        return num, num, command, databyte
+    return int(match.group(1)), int(match.group(2)), command, databyte
+
+
+def read_text(lines, start=0):
+    for num, line in enumerate(lines, start):
+        event = parse_line(line, num)
+        if event is not None:
+            yield event
+
+
+def read_binary(f):
+    if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError('Not an I2C event file')
+    yield from read_records(f)
+
+
+def read_records(f):
+    while True:
+        chunk = f.read(CHUNK_EVENTS * EVENT.size)
+        chunk = chunk[:len(chunk) - len(chunk) % EVENT.size]  # A capture still being written can end mid-event
+        if not chunk:
+            break
+        for ss, es, code, databyte in EVENT.iter_unpack(chunk):
+            yield ss, es, COMMANDS[code], databyte
+
+
+def write_binary(f, events):
+    f.write(BINARY_MAGIC)
+    chunk = []
+    for ss, es, command, databyte in events:
+        chunk.append(EVENT.pack(ss, es, COMMAND_CODES[command], databyte or 0))
+        if len(chunk) == CHUNK_EVENTS:
+            f.write(b''.join(chunk))
+            chunk = []
+    f.write(b''.join(chunk))
+
+
+# Converts sigrok-cli i2c text output into a binary event file, a chunk at a time
+def convert_text(src, dst):
+    with open(dst, 'wb') as f:
+        write_binary(f, read_events(src))
+
+
+# Maps a binary event file into memory, returns the mapping and the span of its whole events from offset on (the first
+# event by default). The mapping is closed once the last view of it is gone.
+def map_file(path, offset=None):
+    with open(path, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError('Not an I2C event file')
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # A capture still being written can end mid-event
+    start = len(BINARY_MAGIC) if offset is None else offset
+    return mapped, start, start + max(0, len(mapped) - start) // EVENT.size * EVENT.size
+
+
+def map_events(path, offset=None):
+    mapped, start, end = map_file(path, offset)
+    return memoryview(mapped)[start:end]
+
+
+# Slices of batch_events events of a mapped binary event file, up to byte offset end if given, without copying them.
+# The pages of a batch are let go once the next one is asked for, so memory stays flat however large the file is.
+def read_batches(path, offset=None, batch_events=CHUNK_EVENTS, end=None):
+    mapped, start, stop = map_file(path, offset)
+    end = stop if end is None else min(end, stop)
+    view = memoryview(mapped)
+    size = batch_events * EVENT.size
+    dropped = 0
+    for pos in range(start, end, size):
+        yield view[pos:min(pos + size, end)]
+        done = (pos + size) // mmap.PAGESIZE * mmap.PAGESIZE
+        if hasattr(mmap, 'MADV_DONTNEED') and done > dropped:
+            mapped.madvise(mmap.MADV_DONTNEED, dropped, min(done, len(mapped)) - dropped)
+            dropped = done
+
+
+# The events of a binary event file as a NumPy structured array (ss, es, command code, databyte) over the mapping
+def map_array(path, offset=None):
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError('NumPy is required to map events as an array') from None
+    return numpy.frombuffer(map_events(path, offset), numpy.dtype(EVENT_FIELDS))
+
+
+def is_binary(path):
+    with open(path, 'rb') as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+# Picks the reader from the file contents.
+# Reading can resume from a position given by read_positions, the byte offset and line (or event) number of an event.
+def read_events(path, offset=None, line=0):
+    if is_binary(path):
+        with open(path, 'rb') as f:
+            if offset is None:
+                yield from read_binary(f)
+            else:
+                f.seek(offset)
+                yield from read_records(f)
+    elif offset is None:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            yield from read_text(f)
+    else:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            yield from read_text((raw.decode('utf-8', 'replace') for raw in f), line)
+
+
+# Events paired with the (offset, line) position read_events can resume reading them from
+def read_positions(path, offset=None, line=0):
+    if is_binary(path):
+        if offset is None:
+            offset = len(BINARY_MAGIC)
+        for event in read_events(path, offset):
+            yield (offset, line), event
+            offset += EVENT.size
+            line += 1
+        return
+    with open(path, 'rb') as f:
+        offset = offset or 0
+        f.seek(offset)
+        for raw in f:
+            event = parse_line(raw.decode('utf-8', 'replace'), line)
+            if event is not None:
+                yield (offset, line), event
+            offset += len(raw)
+            line += 1
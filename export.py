@@ -0,0 +1,106 @@
+import os
+import re
+from array import array
+from .chips import CHIPS
+from .engine import OUTPUT_PYTHON
+from .regmap import Choice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NPZ_CHUNK = re.compile(r'^chunk-\d{5,}\.npz$')
+
+
+# Channels of the fields selecting a command or picking a text, whose numbers are codes rather than measurements
+def get_code_channels():
+    return {'{}.{}'.format(chip.value, field.name) for chip in CHIPS for register in chip.routines.registers
+            for field in register.fields if field.select or isinstance(field, Choice)}
+
+
+# Streams numeric records into per-channel columns (sample numbers and values) and writes them out
+# every chunk_size values, so memory stays bounded however long the capture is.
+# Channels are named 'chip.field', e.g. 'BMS.cell1_voltage'; channels limits the export to those names. Command and
+# Choice fields such as 'BMS.command' are not exported.
+# CSV output writes 'sample,value' rows to <csv_dir>/<channel>.csv, NumPy output writes one
+# <npz_dir>/chunk-NNNNN.npz per chunk holding '<channel>.sample' and '<channel>.value' arrays.
+# An export replaces the one before it in the same directories: the CSV files and chunks there are deleted when the
+# exporter is made.
+class ColumnExporter:
+    def __init__(self, csv_dir=None, npz_dir=None, chunk_size=65536, channels=None):
+        if npz_dir is not None and numpy is None:
+            raise RuntimeError('NumPy is required for .npz export')
+        self.csv_dir = csv_dir
+        self.npz_dir = npz_dir
+        self.chunk_size = chunk_size
+        self.channels = set(channels) if channels else None
+        self.codes = get_code_channels()
+        self.columns = {}
+        self.pending = 0
+        self.chunks = 0
+        self.written = set()  # Channels whose CSV file this export has started
+        if csv_dir is not None:
+            for name in os.listdir(csv_dir):
+                if name.endswith('.csv'):
+                    os.remove(os.path.join(csv_dir, name))
+        if npz_dir is not None:
+            for name in os.listdir(npz_dir):
+                if NPZ_CHUNK.match(name):
+                    os.remove(os.path.join(npz_dir, name))
+
+    def put(self, ss, es, output, data):
+        if output == OUTPUT_PYTHON:
+            self.add(data)
+
+    def add(self, record):
+        value = record.value
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return
+        name = '{}.{}'.format(record.chip, record.field)
+        column = self.columns.get(name)
+        if column is None:
+            if name in self.codes or self.channels is not None and name not in self.channels:
+                return
+            column = self.columns[name] = (array('Q'), array('d'))
+        column[0].append(record.ss)
+        column[1].append(value)
+        self.pending += 1
+        if self.pending >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.csv_dir is not None:
+            self.write_csv()
+        if self.npz_dir is not None:
+            self.write_npz()
+        for samples, values in self.columns.values():
+            del samples[:]
+            del values[:]
+        self.pending = 0
+        self.chunks += 1
+
+    def write_csv(self):
+        for name, (samples, values) in self.columns.items():
+            if not samples:
+                continue
+            path = os.path.join(self.csv_dir, name + '.csv')
+            new = name not in self.written
+            self.written.add(name)
+            with open(path, 'w' if new else 'a', encoding='utf-8') as f:
+                if new:
+                    f.write('sample,value\n')
+                f.writelines('{},{}\n'.format(sample, value) for sample, value in zip(samples, values))
+
+    def write_npz(self):
+        arrays = {}
+        for name, (samples, values) in self.columns.items():
+            if samples:
+                arrays[name + '.sample'] = numpy.frombuffer(samples, dtype=numpy.uint64)
+                arrays[name + '.value'] = numpy.frombuffer(values, dtype=numpy.float64)
+        numpy.savez(os.path.join(self.npz_dir, 'chunk-{:05d}.npz'.format(self.chunks)), **arrays)
+
+    def close(self):
+        self.flush()
@@ -1,18 +1,123 @@
+import math
+from .regmap import Field, Frame, Part, Register
+
+MILLITESLA_PER_LSB = 0.098
+TEMP_OFFSET = 340  # Temperature reading at 25°C
+CELSIUS_PER_LSB = 1.1
+
+
+# Infineon TLV493D-A1B6 read registers: bytes 0-6 hold the 12-bit Bx, By, Bz and temperature values split into high
+# bytes and nibbles, the frame counter, channel and flags. They are taken as one big-endian int and sliced per part.
 class Hall:
+    name = 'Hall'
+    address = 0x5E
+    desc = 'Display Hall sensor traffic'
+    default = 'yes'
+    annotations = (
+        (28, 'hall_flux', 'Hall sensor magnetic flux density magnitude (in milliteslas)'),
+        (29, 'hall_factory', 'Hall sensor factory settings'),
+        (43, 'hall_bx', 'Hall sensor Bx (in milliteslas)'),
+        (44, 'hall_by', 'Hall sensor By (in milliteslas)'),
+        (45, 'hall_bz', 'Hall sensor Bz (in milliteslas)'),
+        (46, 'hall_angle', 'Hall sensor field angle in the XY plane'),
+        (47, 'hall_temp', 'Hall sensor temperature'),
+        (48, 'hall_frame', 'Hall sensor frame counter, channel and flags'),
+    )
+    rows = (
+        ('hall', 'Hall Effect sensor (Infineon TLV493D-A1B6)', (28, 29)),
+        ('hall_x', 'Hall Bx', (43,)),
+        ('hall_y', 'Hall By', (44,)),
+        ('hall_z', 'Hall Bz', (45,)),
+        ('hall_angle', 'Hall angle', (46,)),
+        ('hall_temp', 'Hall temperature', (47,)),
+        ('hall_frame', 'Hall frame', (48,)),
+    )
+    summary_classes = (34, 38, 42)
+    registers = (
+        Register('measurement', False, None, (
+            Frame('frame', 0, 7, (
+                Part('bx', 43, ('Bx: {}mT', 'Bx {}mT', '{}mT'), extract=lambda n: Hall.get_bx(n),
+                     convert=lambda n: Hall.get_mag_flux_density(n), unit='mT', deadband=0.2),
+                Part('by', 44, ('By: {}mT', 'By {}mT', '{}mT'), extract=lambda n: Hall.get_by(n),
+                     convert=lambda n: Hall.get_mag_flux_density(n), unit='mT', deadband=0.2),
+                Part('bz', 45, ('Bz: {}mT', 'Bz {}mT', '{}mT'), extract=lambda n: Hall.get_bz(n),
+                     convert=lambda n: Hall.get_mag_flux_density(n), unit='mT', deadband=0.2),
+                Part('magnitude', 28, ('Magnetic flux density: {}mT', 'Mag flux density: {}mT', '|B|: {}mT',
+                                       '{}mT'), extract=lambda n: Hall.get_axes(n),
+                     convert=lambda n: Hall.get_magnitude(n), unit='mT', deadband=0.2, cache=False),
+                Part('angle', 46, ('XY angle: {}°', 'Angle: {}°', '{}°'), extract=lambda n: Hall.get_axes(n),
+                     convert=lambda n: Hall.get_angle(n), unit='°', deadband=1, cache=False),
+                Part('temperature', 47, ('Temperature: {}°C', 'Temp: {}°C', '{}°C'),
+                     extract=lambda n: Hall.get_temp(n), convert=lambda n: Hall.get_temperature(n), unit='°C',
+                     deadband=2.2),
+                Part('frame_counter', 48, extract=lambda n: Hall.get_status(n), convert=lambda n: n >> 10 & 0b11,
+                     fmt=lambda n, level: Hall.frame_texts(n, level), summary=False),
+            )),
+            Field('factory_settings', 7, 29, ('Factory settings: {:06X}', 'Factory: {:06X}', '{:06X}'), width=3,
+                  order='big', summary=False),
+        )),
+    )
+
+    @staticmethod
+    def get_bx(frame):
+        return (frame >> 44 & 0xFF0) | (frame >> 20 & 0xF)
+
+    @staticmethod
+    def get_by(frame):
+        return (frame >> 36 & 0xFF0) | (frame >> 16 & 0xF)
+
+    @staticmethod
+    def get_bz(frame):
+        return (frame >> 28 & 0xFF0) | (frame >> 8 & 0xF)
+
+    @staticmethod
+    def get_temp(frame):
+        return (frame >> 20 & 0xF00) | (frame & 0xFF)
+
+    # Byte 3 (frame counter, channel) and byte 5 (test mode, fuse parity and power-down flags) as one value
     @staticmethod
-    def read(decoder, databyte):
-        if decoder.data_key > 7:
-            return [29, ['Padding', '---', '-']]
-        else:
-            mag_flux_density = Hall.get_mag_flux_density(databyte)
-            return [28, ['Magnetic flux density: {}mT'.format(mag_flux_density),
-                         'Mag flux density: {}mT'.format(mag_flux_density), 'MFD: {}mT'.format(mag_flux_density),
-                         '{}mT'.format(mag_flux_density)]]
+    def get_status(frame):
+        return (frame >> 16 & 0xFF00) | (frame >> 8 & 0xFF)
+
+    # All three axes in one int, for the parts combining them
+    @staticmethod
+    def get_axes(frame):
+        return Hall.get_bx(frame) << 24 | Hall.get_by(frame) << 12 | Hall.get_bz(frame)
+
+    # Two's complement of a 12-bit value, works on NumPy arrays too
+    @staticmethod
+    def get_signed(value):
+        return value - ((value & 0x800) << 1)
 
     # Returns magnetic flux in milliteslas
     @staticmethod
-    def get_mag_flux_density(databyte):
-        measure = int(databyte & 0b01111111)
-        if databyte & 0b10000000:
-            measure -= 128
-        return measure
+    def get_mag_flux_density(value):
+        return round(Hall.get_signed(value) * MILLITESLA_PER_LSB, 3)
+
+    @staticmethod
+    def get_magnitude(axes):
+        x, y, z = (Hall.get_signed(axes >> shift & 0xFFF) for shift in (24, 12, 0))
+        return round(math.sqrt(x * x + y * y + z * z) * MILLITESLA_PER_LSB, 3)
+
+    @staticmethod
+    def get_angle(axes):
+        return round(math.degrees(math.atan2(Hall.get_signed(axes >> 12 & 0xFFF), Hall.get_signed(axes >> 24))), 1)
+
+    @staticmethod
+    def get_temperature(value):
+        return round((value - TEMP_OFFSET) * CELSIUS_PER_LSB + 25, 1)
+
+    @staticmethod
+    def frame_texts(value, level):
+        counter = value >> 10 & 0b11
+        channel = value >> 8 & 0b11
+        if level == 'values':
+            return ['{}'.format(counter)]
+        elif level == 'minimal':
+            return ['F{}'.format(counter)]
+        elif level == 'compact':
+            return ['Frame {}, ch {}'.format(counter, channel), 'F{}'.format(counter)]
+        flags = [name for bit, name in ((6, 'Test mode'), (5, 'Fuse parity error'), (4, 'Power-down'))
+                 if value >> bit & 1]
+        return ['Frame {}, channel {}{}'.format(counter, channel, ''.join(', ' + flag for flag in flags)),
+                'Frame {}, ch {}'.format(counter, channel), 'F{}'.format(counter)]
@@ -0,0 +1,291 @@
+import collections
+import concurrent.futures
+import io
+import itertools
+import os
+import re
+from .chips import get_chip
+from .engine import Engine
+from .events import (BINARY_MAGIC, CHUNK_EVENTS, COMMAND_CODES, COMMANDS, EVENT, is_binary, map_file, read_batches,
+                     parse_line, read_events, read_positions)
+
+SHARD_EVENTS = 200000
+START_COMMANDS = ('START', 'START REPEAT')
+ADDRESS_COMMANDS = ('ADDRESS READ', 'ADDRESS WRITE')
+# Events that can change the state carried from one transfer into the next
+STATE_COMMANDS = ('STOP', 'ADDRESS READ', 'ADDRESS WRITE', 'DATA WRITE')
+SAMPLE_BYTES = 65536  # Head of a text capture measured for its bytes per line
+TEXT_CHUNK = 1 << 20  # Bytes of text scanned at a time
+CODE_OFFSET = EVENT.size - 2  # Offset of the command code in a binary event
+
+
+def get_code_class(commands):
+    return b'[' + re.escape(bytes(COMMAND_CODES[command] for command in commands)) + b']'
+
+
+# In the command codes of binary events: a STOP, then only starts up to the next transfer's address, and the events
+# the state depends on
+BOUNDARY_CODES = re.compile(get_code_class(('STOP',)) + get_code_class(START_COMMANDS) + b'*'
+                            + get_code_class(ADDRESS_COMMANDS))
+STATE_CODES = re.compile(get_code_class(STATE_COMMANDS))
+# In sigrok-cli text, the lines that may hold a STOP, an address or a data write
+STATE_LINES = re.compile(rb'^[^\n]*(?:Stop|Address|Data write)[^\n]*$', re.M)
+DATA_READ_CODE = COMMAND_CODES['DATA READ']
+
+
+# Decodes a whole capture in this process
+def decode_capture(path, options, put, samplerate=None):
+    engine = Engine(options, put, samplerate)
+    engine.start()
+    if is_binary(path):
+        engine.decode_batches(read_batches(path))
+    else:
+        engine.decode_events(read_events(path))
+
+
+# Byte offset of the first event (binary) or line (text) at or after offset
+def align_offset(path, binary, offset):
+    if binary:
+        start = len(BINARY_MAGIC)
+        return start + max(0, offset - start + EVENT.size - 1) // EVENT.size * EVENT.size
+    if offset == 0:
+        return 0
+    with open(path, 'rb') as f:
+        f.seek(offset - 1)
+        f.readline()
+        return f.tell()
+
+
+# Byte offsets of about shard_events events each, from the first event to the end of the file. Text captures are
+# measured by the lines of their head.
+def get_offsets(path, binary, shard_events):
+    size = os.path.getsize(path)
+    if binary:
+        start, step = len(BINARY_MAGIC), shard_events * EVENT.size
+    else:
+        with open(path, 'rb') as f:
+            head = f.read(SAMPLE_BYTES)
+        start, step = 0, max(1, shard_events * len(head) // max(1, head.count(b'\n')))
+    return [align_offset(path, binary, offset) for offset in range(start, size, step)] + [size]
+
+
+# Follows the state carried across transfers through one shard without knowing the state the shard starts from: the
+# command last selected on each chip and the register shadow. A chip's command is settled by a select that does not
+# depend on the command before it, a subcommand or a command without subcommands. The chip's events up to then are
+# kept, to be replayed onto the state the shard starts from; after it the chip's command and the shadowed values read
+# or written are those the shard leaves.
+class ShardScan:
+    def __init__(self, options):
+        tracker = self.tracker = Engine(dict(options, annotations='no', records='none', profile='no'))
+        tracker.start()
+        self.shadow_chips = tracker.regmap.shadow_chips
+        # Commands holding a subcommand, whose own select keeps the chip's subcommand
+        self.sub_cmds = {(key[0], key[2]) for key, slot in tracker.dispatch.items()
+                         if slot[0].select and slot[0].offset}
+        self.prefixes = {}  # Chip -> its events up to its settled command
+        # Chips without selects carry no command, they are settled from the start
+        self.settled = ({chip for chip, shown in tracker.chip_table if chip is not None}
+                        - {key[0] for key, slot in tracker.dispatch.items() if slot[0].select})
+        self.engine_select_cmd = tracker.select_cmd
+        tracker.select_cmd = self.select_cmd
+
+    def select_cmd(self, field, cmd):
+        self.engine_select_cmd(field, cmd)
+        state = self.tracker.state
+        if state.chip not in self.settled and (field.offset and state.write or not field.offset
+                                               and (state.chip, cmd) not in self.sub_cmds):
+            self.settled.add(state.chip)
+            shadow = self.tracker.shadow
+            for key in [key for key in shadow if key[0] is state.chip]:
+                del shadow[key]
+
+    def keep(self, chip, event):
+        if chip is not None and chip not in self.settled and chip in self.tracker.shown_chips:
+            self.prefixes.setdefault(chip, []).append(event)
+
+    def decode(self, event):
+        command = event[2]
+        state = self.tracker.state
+        if command in ADDRESS_COMMANDS:
+            self.tracker.decode(event[0], event[1], (command, event[3]))
+            self.keep(state.chip, event)
+        elif command in STATE_COMMANDS or command == 'DATA READ' and state.chip in self.shadow_chips:
+            self.keep(state.chip, event)
+            self.tracker.decode(event[0], event[1], (command, event[3]))
+
+    # Prefixes by chip name, settled commands by chip name and the shadow of the settled chips as [chip, address, raw]
+    def get_result(self):
+        return ({chip.value: events for chip, events in self.prefixes.items()},
+                {chip.value: cmd for chip, cmd in self.tracker.state.chip_cmds.items() if chip in self.settled},
+                [[chip.value, address, raw] for (chip, address), raw in self.tracker.shadow.items()
+                 if chip in self.settled])
+
+
+# Phase one, in a worker: finds where the shard between the nominal offsets start and end begins and ends, and scans
+# its state. Shards begin at the address following a STOP whose offset is at or after the nominal start, the first
+# shard at the first event. Returns the (offset, line) of both ends, lines (events of binary files) counted from
+# start, the end None at the end of the file, and ShardScan.get_result().
+def scan_shard(path, options, start, end, first):
+    scan = ShardScan(options)
+    if is_binary(path):
+        return scan_binary(scan, path, start, end, first)
+    return scan_text(scan, path, start, end, first)
+
+
+# scan_shard of a binary event file. The boundaries and the events the state depends on are found in the command
+# codes of the events, only these events are unpacked.
+def scan_binary(scan, path, start, end, first):
+    mapped, start, stop = map_file(path, start)
+    view = memoryview(mapped)
+    size = EVENT.size
+    codes = b''
+    limit = start
+    match = None
+    while match is None and limit < stop:
+        limit = min(stop, max(end, limit) + CHUNK_EVENTS * size)
+        codes += bytes(view[start + len(codes) * size:limit])[CODE_OFFSET::size]
+        match = BOUNDARY_CODES.search(codes, max(0, (end - start) // size))
+    if first:
+        begin = 0
+    else:
+        found = BOUNDARY_CODES.search(codes)
+        begin = len(codes) if found is None else found.end() - 1
+    last = len(codes) if match is None else match.end() - 1
+
+    reads = None  # Index of the first event not yet scanned while the tracker is on a shadowed chip
+    for key in itertools.chain((found.start() for found in STATE_CODES.finditer(codes, begin, last)), (last,)):
+        if reads is not None:
+            for index in range(reads, key):
+                if codes[index] == DATA_READ_CODE:
+                    ss, es, code, databyte = EVENT.unpack_from(view, start + index * size)
+                    scan.decode((ss, es, 'DATA READ', databyte))
+        if key == last:
+            break
+        ss, es, code, databyte = EVENT.unpack_from(view, start + key * size)
+        scan.decode((ss, es, COMMANDS[code], databyte))
+        reads = key + 1 if scan.tracker.state.chip in scan.shadow_chips else None
+    return ((start + begin * size, begin), None if match is None else (start + last * size, last)) + scan.get_result()
+
+
+# scan_shard of sigrok-cli text. Only the lines that may hold a STOP, an address or a data write are parsed, and the
+# lines after them while a STOP waits for the next address or the tracker is on a shadowed chip.
+def scan_text(scan, path, start, end, first):
+    begin = (start, 0) if first else None
+    split = None  # Offset of a STOP not yet followed by an address
+    reads = False  # The tracker is on a shadowed chip, whose reads the state depends on
+    offset, line = start, 0  # Position of the first line of data
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while True:
+            data = f.read(TEXT_CHUNK) + f.readline()
+            if not data:
+                break
+            pos = counted = 0  # End of the last line parsed, and up to where lines are counted
+            for match in itertools.chain(STATE_LINES.finditer(data), (None,)):
+                found = len(data) if match is None else match.start()
+                if split is not None or reads:
+                    for raw in data[pos:found].split(b'\n'):
+                        event = parse_line(raw.decode('utf-8', 'replace'), line)
+                        if event is not None:
+                            if event[2] not in START_COMMANDS:
+                                split = None
+                            if reads:
+                                scan.decode(event)
+                if match is None:
+                    break
+                line += data.count(b'\n', counted, found)
+                counted = found
+                event = parse_line(match.group().decode('utf-8', 'replace'), line)
+                pos = match.end()
+                if event is None:
+                    continue
+                position = (offset + found, line)
+                command = event[2]
+                if split is not None and command not in START_COMMANDS:
+                    if command in ADDRESS_COMMANDS:
+                        if split >= end:
+                            return (begin or position, position) + scan.get_result()
+                        if begin is None:
+                            begin = position
+                    split = None
+                if command == 'STOP':
+                    split = position[0]
+                if begin is not None:
+                    scan.decode(event)
+                    reads = scan.tracker.state.chip in scan.shadow_chips
+            line += data.count(b'\n', counted)
+            offset += len(data)
+    return (begin, None) + scan.get_result()
+
+
+# Phase two, in a worker: decodes the events from position start up to byte offset end, None for the end of the file,
+# from the state the shard starts from, and returns what writer(out) wrote
+def decode_shard(path, options, writer, start, end, state, samplerate):
+    out = io.StringIO()
+    engine = Engine(options, writer(out), samplerate)
+    engine.start()
+    if state is not None:
+        engine.set_state(state)
+    offset, line = start
+    if is_binary(path):
+        engine.decode_batches(read_batches(path, offset, end=end))
+    else:
+        positions = read_positions(path, offset, line)
+        if end is not None:
+            positions = itertools.takewhile(lambda item: item[0][0] < end, positions)
+        engine.decode_events(event for position, event in positions)
+    return out.getvalue()
+
+
+# Decodes a capture in a process pool, writing to out exactly what writer(out), a function making a put, writes
+# decoding it in one process. writer has to be picklable, e.g. a module function or a partial of one.
+# Shards of about shard_events are cut where a STOP is followed by the next transfer's address, so no transfer is in
+# flight and the address resets curr_cmd, data_key and the field state. What is carried over, the command last
+# selected on each chip and the register shadow, depends on each chip's own traffic: workers scan their shards for it
+# first, and the states are composed here by replaying only the events of each chip before its first settled select.
+# Workers then decode their shards from these states and return their output as text, written here in order, so
+# this process neither decodes nor handles single puts.
+# Profiling counts per process, and change-only runs, summary windows and anomaly episodes would break at shard ends,
+# so these fall back to a serial decode.
+def decode_parallel(path, options, out, writer, jobs=None, shard_events=SHARD_EVENTS, samplerate=None):
+    options = dict(options or {})
+    if (options.get('profile') == 'yes' or options.get('changes', 'no') != 'no' or options.get('summary') == 'yes'
+            or options.get('anomalies') == 'yes' or jobs == 1):
+        decode_capture(path, options, writer(out), samplerate)
+        return
+
+    offsets = get_offsets(path, is_binary(path), shard_events)
+    composer = Engine(dict(options, annotations='no', records='none', profile='no'))
+    composer.start()
+    jobs = jobs or os.cpu_count() or 1
+    pending = collections.deque()
+
+    def flush(limit):
+        while len(pending) > limit:
+            out.write(pending.popleft().result())
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        scans = [executor.submit(scan_shard, path, options, offsets[k], offsets[k + 1], k == 0)
+                 for k in range(len(offsets) - 2)]
+        start = (offsets[0], 0)
+        state = None
+        for scan in scans:
+            begin, end, prefixes, cmds, shadow = scan.result()
+            pending.append(executor.submit(decode_shard, path, options, writer, start, None if end is None else end[0],
+                                           state, samplerate))
+            flush(2 * jobs)
+            if end is None:
+                for later in scans:
+                    later.cancel()
+                break
+            for name, events in prefixes.items():
+                for ss, es, command, databyte in events:
+                    composer.decode(ss, es, (command, databyte))
+                composer.decode(0, 0, ('STOP', None))
+            composer.state.chip_cmds.update({get_chip(name): cmd for name, cmd in cmds.items()})
+            composer.shadow.update({(get_chip(name), address): raw for name, address, raw in shadow})
+            state = composer.get_state()
+            start = (end[0], start[1] - begin[1] + end[1])
+        else:
+            pending.append(executor.submit(decode_shard, path, options, writer, start, None, state, samplerate))
+        flush(0)
@@ -1,55 +1,74 @@
+from .regmap import Field, Register
+
+
 class PIC:
+    name = 'PIC'
+    address = 0x50
+    desc = 'Display PIC traffic'
+    default = 'no'
+    annotations = (
+        (1, 'pic_volt', 'Voltage'),
+        (2, 'pic_temp', 'Temperature'),
+        (3, 'pic_firm', 'Firmware'),
+        (4, 'pic_lumens', 'Lumens'),
+        (5, 'pic_fan', 'PWM fan'),
+        (6, 'pic_burst_stops', 'Burst(stops)'),
+        (7, 'pic_led', 'LED'),
+        (8, 'pic_flags', 'Flags'),
+        (9, 'pic_burst_pwm', 'Burst PWM'),
+        (10, 'pic_burst_delay', 'Burst Delay'),
+    )
+    rows = (
+        ('pic', 'PIC chip', (1, 2, 3, 4, 5, 6, 7, 8, 9, 10)),
+    )
+    summary_classes = (31, 35, 39)
+    anomalies = {'temperature': ('celsius', 'pic_temp')}
+    LED_STATES = {0: 'Red', 1: 'Red', 2: 'Green', 3: 'Amber'}
+    FLAG_MAP = {0: 'Sleep', 1: 'HSS', 2: 'Mux', 3: 'Pro', 4: 'Burst_En', 5: 'Debug'}
+
+    registers = (
+        Register('config', True, None, (
+            Field('lumens', 1, 4, ('Lumens: {} lm', '{} lm', 'lm'), convert=lambda n: 100 * n, unit='lm'),
+            Field('fan_pwm', 2, 5, ('Fan motor PWM: {}', 'Fan PWM: {}', 'Fan')),
+            Field('burst_stops', 3, 6, ('Burst (stops): {}', 'Stops: {}', 'Stops'), convert=lambda n: n // 10),
+            Field('led', 4, 7, ('LED color: {}', 'LED: {}', 'LED'), convert=lambda n: PIC.LED_STATES.get(n)),
+            Field('flags', 5, 8, convert=lambda n: PIC.get_flags(n), fmt=lambda n, level: PIC.flag_texts(n, level)),
+            Field('burst_pwm', 6, 9, ('Burst PWM: {}', 'Burst: {}', 'Burst')),
+            Field('burst_delay', 7, 10, ('Burst delay: {}', 'Delay: {}', 'Delay'), width=2, order='big'),
+        )),
+        Register('status', False, None, (
+            Field('voltage', 0, 1, ('Voltage: {}V', 'Volts: {}V', '{}V'), convert=lambda n: n / 10, unit='V',
+                  deadband=0.1),
+            Field('temperature', 1, 2, ('Temperature {}°C', 'Temp: {}°C', '{}°C'), convert=lambda n: n / 2,
+                  unit='°C', deadband=0.5),
+            Field('firmware_flavor', 2, 3, ('Firmware flavor: {}', 'Flavor: {}', 'Flavor'), width=2, order='big',
+                  summary=False),
+            Field('firmware_version', 4, 3, ('Firmware version: {}', 'Version: {}', 'Version'), width=2,
+                  order='big', convert=lambda n: PIC.get_version(n)),
+        )),
+    )
+
+    @staticmethod
+    def get_flags(databyte):
+        flag_list = []
+        for i in range(5, -1, -1):
+            if (databyte >> i) & 1:
+                flag_list.append(PIC.FLAG_MAP.get(i))
+        return flag_list
+
+    # The flag list is only built for the levels showing it
     @staticmethod
-    def write(decoder, databyte):
-        data = []
-        if decoder.data_key == 1:
-            lumens = 100 * int(databyte)
-            data = [4, ['Lumens: {} lm'.format(lumens), '{} lm'.format(lumens), 'lm']]
-        elif decoder.data_key == 2:
-            pwm = int(databyte)
-            data = [5, ['Fan motor PWM: {}'.format(pwm), 'Fan PWM: {}'.format(pwm), 'Fan']]
-        elif decoder.data_key == 3:
-            stops = int(databyte) // 10
-            data = [6, ['Burst (stops): {}'.format(stops), 'Stops: {}'.format(stops), 'Stops']]
-        elif decoder.data_key == 4:
-            led_states = {0: 'Red', 1: 'Red', 2: 'Green', 3: 'Amber'}
-            led = led_states.get(int(databyte))
-            data = [7, ['LED color: {}'.format(led), 'LED: {}'.format(led), 'LED']]
-        elif decoder.data_key == 5:
-            flag_map = {0: 'Sleep', 1: 'HSS', 2: 'Mux', 3: 'Pro', 4: 'Burst_En', 5: 'Debug'}
-            flag_list = []
-            for i in range(5, -1, -1):
-                bit = (databyte >> i) & 1
-                if bit == 1:
-                    flag_list.append(flag_map.get(i))
-            data = [8, ['Flags: {}'.format(flag_list), 'Flags: {}'.format(len(flag_list)), 'Flags']]
-        elif decoder.data_key == 6:
-            pwm = int(databyte)
-            data = [9, ['Burst PWM: {}'.format(pwm), 'Burst: {}'.format(pwm), 'Burst']]
-        elif decoder.data_key == 7:
-            decoder.work_var = int(databyte)  # First 8 bits of delay
-        elif decoder.data_key == 8:
-            delay = int((decoder.work_var << 8) | databyte)
-            data = [10, ['Burst delay: {}'.format(delay), 'Delay: {}'.format(delay), 'Delay']]
-        return data
+    def flag_texts(databyte, level):
+        if level == 'values':
+            return ['{}'.format(PIC.get_flags(databyte))]
+        elif level == 'full':
+            flags = PIC.get_flags(databyte)
+            return ['Flags: {}'.format(flags), 'Flags: {}'.format(len(flags)), 'Flags']
+        elif level == 'compact':
+            return ['Flags: {}'.format(bin(databyte & 0b111111).count('1')), 'Flags']
+        return ['Flags']
 
+    # Minor version is sent before the major version letter
     @staticmethod
-    def read(decoder, databyte):
-        data = []
-        if decoder.data_key == 0:
-            voltage = int(databyte) / 10
-            data = [1, ['Voltage: {}V'.format(voltage), 'Volts: {}V'.format(voltage), '{}V'.format(voltage)]]
-        elif decoder.data_key == 1:
-            temp = int(databyte) / 2
-            data = [2, ['Temperature {}°C'.format(temp), 'Temp: {}°C'.format(temp), '{}°C'.format(temp)]]
-        elif decoder.data_key == 2:
-            decoder.work_var = databyte  # Get first 8 bits of flavor
-        elif decoder.data_key == 3:
-            flavor = int((decoder.work_var << 8) | databyte)  # Append new databyte to end of old
-            data = [3, ['Firmware flavor: {}'.format(flavor), 'Flavor: {}'.format(flavor), 'Flavor']]
-        elif decoder.data_key == 4:
-            decoder.work_var = int(databyte)  # Minor version
-        elif decoder.data_key == 5:
-            version = '{}{}'.format(chr(databyte), decoder.work_var)
-            data = [3, ['Firmware version: {}'.format(version), 'Version: {}'.format(version), 'Version']]
-        return data
+    def get_version(num):
+        return '{}{}'.format(chr(num & 0xFF), num >> 8)
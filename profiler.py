@@ -0,0 +1,157 @@
+import time
+from .regmap import Choice, pick_texts
+
+ADDRESS_COMMANDS = ('ADDRESS READ', 'ADDRESS WRITE')
+DATA_COMMANDS = ('DATA READ', 'DATA WRITE')
+
+# Indices into a counter list
+BYTES, ANNOTATIONS, UNKNOWN, SECONDS = range(4)
+
+
+# Per chip and register counters of the decoding hot path. install() wraps the engine's decode, put_ann, emit_field,
+# end_transfer and end with counting wrappers.
+# Counters are keyed by (chip, is_write, cmd), address bytes count under the 'address' command of their chip.
+# A snapshot of them is published every `interval` data bytes and once more at the end of decoding.
+class Profiler:
+    def __init__(self, engine, chip_map, interval=10000):
+        self.engine = engine
+        self.chip_map = chip_map
+        self.interval = interval
+        self.counters = {}
+        self.unknown_addresses = {}
+        self.counter = None  # Counter of the event being decoded
+        self.nested = 0  # Seconds of the event spent in a nested, separately counted call
+        self.pending = interval
+        self.interval_ss = None
+        self.last_es = 0
+        self.last_chips = {}
+
+    def install(self):
+        engine = self.engine
+        self.engine_decode = engine.decode
+        self.engine_put_ann = engine.put_ann
+        self.engine_emit_field = engine.emit_field
+        self.engine_end_transfer = engine.end_transfer
+        self.engine_end = engine.end
+        engine.decode = self.decode
+        engine.put_ann = self.put_ann
+        engine.emit_field = self.emit_field
+        engine.end_transfer = self.end_transfer
+        engine.end = self.end
+
+    def get_counter(self, chip, write, cmd):
+        counter = self.counters.get((chip, write, cmd))
+        if counter is None:
+            counter = self.counters[(chip, write, cmd)] = [0, 0, 0, 0.0]
+        return counter
+
+    # Counter of the register the engine is currently decoding
+    def get_curr_counter(self):
+        state = self.engine.state
+        return self.get_counter(state.chip, state.write, state.curr_cmd)
+
+    def decode(self, ss, es, data):
+        command, databyte = data
+        if self.interval_ss is None:
+            self.interval_ss = ss
+        if command in ADDRESS_COMMANDS:
+            chip = self.chip_map.get(databyte)
+            if chip is None:
+                self.unknown_addresses[databyte] = self.unknown_addresses.get(databyte, 0) + 1
+            counter = self.get_counter(chip, command == 'ADDRESS WRITE', 'address')
+        else:
+            counter = self.get_curr_counter()
+        self.counter = counter
+        self.nested = 0
+
+        start = time.perf_counter()
+        self.engine_decode(ss, es, data)
+        counter[SECONDS] += time.perf_counter() - start - self.nested
+
+        self.last_es = es
+        if command in DATA_COMMANDS or command in ADDRESS_COMMANDS:
+            counter[BYTES] += 1
+            self.pending -= 1
+            if self.pending <= 0:
+                self.publish(es, False)
+
+    def put_ann(self, ssample, esample, data):
+        self.counter[ANNOTATIONS] += 1
+        self.engine_put_ann(ssample, esample, data)
+
+    def emit_field(self, ss, es, slot, raw):
+        field = slot[0]
+        if isinstance(field, Choice) and raw not in field.choices:
+            self.counter[UNKNOWN] += 1
+        self.engine_emit_field(ss, es, slot, raw)
+
+    # Buffered transfers are decoded while handling the next event, their time goes to their own register
+    def end_transfer(self):
+        outer = self.counter
+        self.counter = self.get_curr_counter()
+        start = time.perf_counter()
+        self.engine_end_transfer()
+        elapsed = time.perf_counter() - start
+        self.counter[SECONDS] += elapsed
+        self.nested += elapsed
+        self.counter = outer
+
+    def end(self):
+        self.counter = self.get_curr_counter()
+        self.engine_end()
+        self.publish(self.last_es, True)
+
+    @staticmethod
+    def get_label(chip, write, cmd):
+        name = 'Unknown' if chip is None else chip.value
+        if isinstance(cmd, tuple):
+            cmd = '/'.join('0x{:02X}'.format(part) for part in cmd)
+        elif isinstance(cmd, int):
+            cmd = '0x{:02X}'.format(cmd)
+        return '{} {} {}'.format(name, 'W' if write else 'R', cmd)
+
+    def snapshot(self, final):
+        registers = self.engine.regmap.registers
+        totals = [0, 0, 0, 0.0]
+        per_register = {}
+        per_chip = {}
+        for (chip, write, cmd), counter in self.counters.items():
+            label = self.get_label(chip, write, registers.get((chip, write, cmd), cmd))
+            per_register[label] = dict(zip(('bytes', 'annotations', 'unknown_commands', 'seconds'), counter))
+            chip_totals = per_chip.setdefault('Unknown' if chip is None else chip.value, [0, 0, 0, 0.0])
+            for i, count in enumerate(counter):
+                totals[i] += count
+                chip_totals[i] += count
+        return {
+            'final': final,
+            'bytes': totals[BYTES],
+            'annotations': totals[ANNOTATIONS],
+            'unknown_commands': totals[UNKNOWN],
+            'unknown_addresses': sum(self.unknown_addresses.values()),
+            'seconds': totals[SECONDS],
+            'addresses': {'0x{:02X}'.format(address): count for address, count in self.unknown_addresses.items()},
+            'chips': per_chip,
+            'registers': per_register,
+            'cache': self.engine.regmap.cache_info(),
+        }
+
+    # Puts the snapshot, and annotates the decode time each chip took since the last one
+    def publish(self, es, final):
+        snapshot = self.snapshot(final)
+        self.engine.put_profile(self.interval_ss or 0, es, snapshot)
+        if self.engine.annotate and self.interval_ss is not None:
+            self.engine_put_ann(self.interval_ss, es, self.get_interval_ann(snapshot['chips']))
+        self.last_chips = snapshot['chips']
+        self.interval_ss = None
+        self.pending = self.interval
+
+    def get_interval_ann(self, chips):
+        times = []
+        for name, totals in chips.items():
+            last = self.last_chips.get(name, (0, 0, 0, 0.0))
+            times.append((totals[SECONDS] - last[SECONDS], totals[BYTES] - last[BYTES], name))
+        times.sort(reverse=True)
+        parts = ['{}: {} bytes, {:.2f} ms'.format(name, count, 1000 * seconds) for seconds, count, name in times]
+        texts = ('Decode time: ' + ', '.join(parts), ', '.join(parts),
+                 'Slowest: {} {:.2f} ms'.format(times[0][2], 1000 * times[0][0]))
+        return [30, pick_texts(texts, self.engine.level)]
@@ -0,0 +1,27 @@
+import struct
+from collections import namedtuple
+
+# Decoded field published on OUTPUT_PYTHON
+Record = namedtuple('Record', ('chip', 'register', 'field', 'value', 'unit', 'raw', 'ss', 'es'))
+
+# Record packed for OUTPUT_BINARY: ss, es, chip index, flags, field id (index in RegisterMap.fields),
+# raw value and the converted value as a double (NaN when it is not a number).
+# Raw values of wide fields, like the BMS ManufacturerInfo block or a whole TLV493D frame, may not fit in 32 bits:
+# such a raw is written as 0 with RAW_OMITTED set in the flags, the Python records carry it whole.
+RECORD = struct.Struct('<QQBBHId')
+RAW_OMITTED = 0x01
+NAN = float('nan')
+
+
+def pack_record(ss, es, chip_index, field_id, raw, value):
+    if not isinstance(value, (int, float)):
+        value = NAN
+    flags = 0
+    if not 0 <= raw <= 0xFFFFFFFF:
+        raw = 0
+        flags = RAW_OMITTED
+    return RECORD.pack(ss, es, chip_index, flags, field_id, raw, value)
+
+
+def unpack_records(buf):
+    return RECORD.iter_unpack(buf)
@@ -0,0 +1,249 @@
+import functools
+from collections import namedtuple
+
+# Identifies a declared field in records, id is its index in RegisterMap.fields
+FieldInfo = namedtuple('FieldInfo', ('id', 'chip', 'register', 'name', 'unit'))
+
+# Fields that are not simply annotated and recorded: a Frame emitted as its parts, a shadowed register emitted
+# when its value changes, or both. shadow is None or the (chip, address) key of the register's last value.
+Special = namedtuple('Special', ('parts', 'shadow', 'write'))
+
+# Annotation verbosity: every variant, all but the longest, only the shortest, only the value and unit
+LEVELS = ('full', 'compact', 'minimal', 'values')
+
+
+# Picks the variants of a longest-first text list shown at a verbosity level
+def pick_texts(texts, level):
+    if level == 'full':
+        return list(texts)
+    elif level == 'compact':
+        return list(texts[1:] or texts)
+    return [texts[-1]]
+
+
+class Field:
+    parts = None
+
+    # A value spread over `width` data bytes starting at byte `offset` of a transfer.
+    # fmt(raw, level) replaces the texts for annotations that need more than one format call.
+    # Converted values within deadband of each other count as unchanged in change-only annotation mode,
+    # summary=False keeps a numeric field out of the windowed summaries.
+    # A field with a shadow address holds a chip register read or written through an auto-incrementing pointer.
+    def __init__(self, name, offset, ann, texts=(), width=1, order='little', convert=None, fmt=None, unit='',
+                 select=False, deadband=0, summary=True, shadow=None):
+        self.name = name
+        self.offset = offset
+        self.ann = ann
+        self.texts = texts
+        self.width = width
+        self.order = order
+        self.convert = convert
+        self.fmt = fmt
+        self.unit = unit
+        self.select = select  # Raw value selects the command used by later bytes/reads
+        self.deadband = deadband
+        self.summary = summary
+        self.shadow = shadow
+        self.record = ann is not None  # Whether records are published for the field
+        self.tables = {}
+        self.picked = {}  # Level -> the texts shown at it
+
+    # Annotations of every possible value of an 8-bit field, built once per level and shared by all sessions
+    def get_table(self, level='full'):
+        table = self.tables.get(level)
+        if table is None:
+            table = self.tables[level] = [self.render(raw, level) for raw in range(256)]
+        return table
+
+    def get_texts(self, level):
+        texts = self.picked.get(level)
+        if texts is None:
+            texts = self.picked[level] = pick_texts(self.texts, level)
+        return texts
+
+    def value(self, raw):
+        if self.convert is None:
+            return raw
+        return self.convert(raw)
+
+    def render(self, raw, level='full'):
+        if self.ann is None:
+            return None
+        if self.fmt is not None:
+            return [self.ann, self.fmt(raw, level)]
+        value = self.value(raw)
+        if level == 'values':
+            return [self.ann, ['{}{}'.format(value, self.unit)]]
+        return [self.ann, [text.format(value) for text in self.get_texts(level)]]
+
+
+class Choice(Field):
+    # A field whose raw value picks one of a fixed set of annotation texts
+    def __init__(self, name, offset, ann, choices, default=None, width=1, order='little', select=False):
+        Field.__init__(self, name, offset, ann, width=width, order=order, select=select)
+        self.choices = choices
+        self.default = default
+
+    # The choices as picked at a level, a value shows its shortest text
+    def get_texts(self, level):
+        choices = self.picked.get(level)
+        if choices is None:
+            shown = 'minimal' if level == 'values' else level
+            choices = self.picked[level] = {raw: pick_texts(texts, shown) for raw, texts in self.choices.items()}
+        return choices
+
+    def render(self, raw, level='full'):
+        texts = self.get_texts(level).get(raw)
+        if texts is None:
+            if self.default is None:
+                return None
+            texts = pick_texts(self.default, 'minimal' if level == 'values' else level)
+        return [self.ann, texts]
+
+
+class Part(Field):
+    # A quantity sliced out of the raw value of a Frame, extract(frame raw) gives the raw value of the part.
+    # Parts combining several quantities can skip the render cache, their values rarely repeat.
+    # record=True publishes records of a part without annotation class, a quantity another part annotates.
+    def __init__(self, name, ann, texts=(), extract=None, convert=None, fmt=None, unit='', deadband=0, summary=True,
+                 cache=True, record=False):
+        Field.__init__(self, name, 0, ann, texts, convert=convert, fmt=fmt, unit=unit, deadband=deadband,
+                       summary=summary)
+        self.extract = extract
+        self.cache = cache
+        self.record = self.record or record
+
+
+class Frame(Field):
+    # Bytes decoded together as one int and split into parts, each annotated and recorded like a field of its own
+    def __init__(self, name, offset, width, parts, order='big', shadow=None):
+        Field.__init__(self, name, offset, None, width=width, order=order, summary=False, shadow=shadow)
+        self.parts = parts
+        for part in parts:
+            part.offset = offset
+            part.width = width
+
+
+class Bitfield:
+    # Flag texts of a register word. fields are (lsb, bits, texts) with texts a format string shown when the value is
+    # nonzero, a dict of the texts of some values or a function of the value returning a text or None.
+    # Fields are packed into 8-bit windows with a precomputed 256-entry table each, so a 32-bit word takes at most
+    # four lookups.
+    def __init__(self, fields):
+        self.windows = []
+        window = []
+        for field in sorted(fields, key=lambda field: field[0]):
+            if window and field[0] + field[1] > window[0][0] + 8:
+                self.windows.append(self.get_window(window))
+                window = []
+            window.append(field)
+        if window:
+            self.windows.append(self.get_window(window))
+
+    @staticmethod
+    def get_window(fields):
+        start = fields[0][0]
+        table = []
+        for byte in range(256):
+            flags = []
+            for lsb, bits, texts in fields:
+                value = byte >> (lsb - start) & ((1 << bits) - 1)
+                if isinstance(texts, str):
+                    text = texts.format(value) if value else None
+                elif isinstance(texts, dict):
+                    text = texts.get(value)
+                else:
+                    text = texts(value)
+                if text is not None:
+                    flags.append(text)
+            table.append(tuple(flags))
+        return start, tuple(table), tuple(len(flags) for flags in table)
+
+    def flags(self, word):
+        flags = []
+        for start, table, counts in self.windows:
+            flags.extend(table[word >> start & 0xFF])
+        return flags
+
+    def count(self, word):
+        return sum(counts[word >> start & 0xFF] for start, table, counts in self.windows)
+
+
+class Register:
+    # The fields transferred in one direction while `cmd` is the selected command
+    def __init__(self, name, write, cmd, fields):
+        self.name = name
+        self.write = write
+        self.cmd = cmd
+        self.fields = fields
+
+
+# Register declarations of a set of chips compiled into direct lookup tables.
+# dispatch maps (chip, is_write, cmd, data_key) to (field, shift, is_first, is_last, render, info, special),
+# special being None or a Special, whose parts are the slots of the parts of a Frame.
+# shadow=False compiles shadowed registers as plain fields, emitted on every read.
+# defaults maps (chip, is_write) to the routine decoding bytes of undeclared commands,
+# registers maps (chip, is_write, cmd) to the name of the declared register.
+# 8-bit fields render from precomputed tables, wider fields through an LRU cache of cache_size values.
+class RegisterMap:
+    def __init__(self, chips, cache_size=1024, level='full', shadow=True):
+        self.dispatch = {}
+        self.defaults = {}
+        self.registers = {}
+        self.caches = []
+        self.fields = []
+        self.shadow_chips = set()
+        for chip, routines in chips.items():
+            for reg in routines.registers:
+                self.registers[(chip, reg.write, reg.cmd)] = reg.name
+                for field in reg.fields:
+                    render = self.get_renderer(field, cache_size, level)
+                    info = self.add_info(chip, reg, field)
+                    special = parts = key = None
+                    if field.parts is not None:
+                        parts = tuple((part, 0, True, True, self.get_renderer(part, cache_size, level),
+                                       self.add_info(chip, reg, part), None) for part in field.parts)
+                    if shadow and field.shadow is not None:
+                        key = (chip, field.shadow)
+                        self.shadow_chips.add(chip)
+                    if parts is not None or key is not None:
+                        special = Special(parts, key, reg.write)
+                    for i in range(field.width):
+                        byte_num = i if field.order == 'little' else field.width - 1 - i
+                        self.dispatch[(chip, reg.write, reg.cmd, field.offset + i)] = (field, 8 * byte_num, i == 0,
+                                                                                        i == field.width - 1, render,
+                                                                                        info, special)
+            for write, name in ((True, 'default_write'), (False, 'default_read')):
+                routine = getattr(routines, name, None)
+                if routine is not None:
+                    self.defaults[(chip, write)] = routine
+
+    def add_info(self, chip, reg, field):
+        info = FieldInfo(len(self.fields), chip, reg.name, field.name, field.unit)
+        self.fields.append(info)
+        return info
+
+    def get_renderer(self, field, cache_size, level):
+        if field.parts is not None:
+            return None
+        elif isinstance(field, Part) and not field.cache:
+            return functools.partial(field.render, level=level)
+        elif field.width == 1:
+            return field.get_table(level).__getitem__
+        render = functools.lru_cache(maxsize=cache_size)(functools.partial(field.render, level=level))
+        self.caches.append(render)
+        return render
+
+    # Hit and miss counts summed over the caches of all wide fields
+    def cache_info(self):
+        hits = misses = 0
+        for render in self.caches:
+            info = render.cache_info()
+            hits += info.hits
+            misses += info.misses
+        return {'hits': hits, 'misses': misses}
+
+    def get_default(self, chip, write, cmd):
+        if (chip, write, cmd) in self.registers:
+            return None
+        return self.defaults.get((chip, write))
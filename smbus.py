@@ -0,0 +1,185 @@
+from .regmap import pick_texts
+
+BLOCK = 'block'  # Frame size of a command transferring a length byte followed by that many data bytes
+DATA_COMMANDS = ('DATA READ', 'DATA WRITE')
+ADDRESS_COMMANDS = ('ADDRESS READ', 'ADDRESS WRITE')
+
+
+# CRC-8 with polynomial x^8 + x^2 + x + 1 of every byte value, the PEC of a message is the table folded over its bytes
+def get_pec_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc << 1 ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+        table.append(crc)
+    return tuple(table)
+
+
+PEC_TABLE = get_pec_table()
+
+
+def get_pec(data, crc=0):
+    for byte in data:
+        crc = PEC_TABLE[crc ^ byte]
+    return crc
+
+
+# Frames the transfers of SMBus chips: the command written first gives the size of the data, a word or a block whose
+# first byte is its length, and a byte following the data is the PEC of the whole message, from the first address
+# byte on, a read continuing the command written before its repeated start.
+# Fields of a message are held back until its PEC byte arrives and dropped when it does not match, so a corrupted block
+# is flagged instead of decoded, only the commands it selects are kept. Messages sent without PEC are emitted
+# unverified at their end.
+# install() wraps the engine's decode, emit_field and end.
+# chips maps i2c addresses to chips with frames, the frame sizes of their commands, and smbus_ann, the annotation class
+# of their results. Messages end at a STOP or the next address, which is where checkpoints and parallel shards split,
+# so no state is carried in EngineState.
+class SMBusFramer:
+    def __init__(self, engine, chips):
+        self.engine = engine
+        self.chips = chips
+        self.frames = None  # Frame sizes of the chip of the current transfer, None for other chips
+        self.ann = None  # Annotation class of the chip of the current transfer
+        self.repeated = False  # The current transfer began with a repeated start
+        self.last_write = None  # (address, command, crc) of a write continued by a read after a repeated start
+        self.read = False
+        self.address = None
+        self.crc = 0
+        self.pos = 0
+        self.cmd = None
+        self.pec_pos = None  # Position of the PEC byte in the transfer, once known
+        self.verdict = None  # Whether the PEC matched, None until it arrives
+        self.held = []
+        self.start_ss = None
+        self.last_es = None
+
+    def install(self):
+        engine = self.engine
+        self.engine_decode = engine.decode
+        self.engine_emit_field = engine.emit_field
+        self.engine_end = engine.end
+        engine.decode = self.decode
+        engine.emit_field = self.emit_field
+        engine.end = self.end
+
+    def decode(self, ss, es, data):
+        command = data[0]
+        if command in DATA_COMMANDS:
+            if self.frames is not None and not self.decode_byte(ss, es, data[1]):
+                return
+        elif command in ADDRESS_COMMANDS:
+            self.end_transfer()
+            self.begin_transfer(data[1], command == 'ADDRESS READ')
+        elif command == 'STOP':
+            self.end_transfer()
+            self.last_write = None
+        elif command == 'START':
+            self.repeated = False
+        elif command == 'START REPEAT':
+            self.repeated = True
+        self.engine_decode(ss, es, data)
+
+    # Commands are selected as soon as they arrive, the bytes following them depend on it
+    def emit_field(self, ss, es, slot, raw):
+        if self.frames is None or self.verdict:
+            self.engine_emit_field(ss, es, slot, raw)
+            return
+        if slot[0].select:
+            self.engine.select_cmd(slot[0], raw)
+        if self.verdict is None:
+            self.held.append((ss, es, slot, raw))
+
+    def begin_transfer(self, address, read):
+        chip = self.chips.get(address)
+        if chip is None:
+            self.frames = None
+            return
+        self.frames = chip.frames
+        self.ann = chip.smbus_ann
+        byte = address << 1 | read
+        last_write = self.last_write
+        if read and self.repeated and last_write is not None and last_write[0] == address:
+            self.cmd = last_write[1]
+            self.crc = PEC_TABLE[last_write[2] ^ byte]
+        else:
+            self.cmd = None
+            self.crc = PEC_TABLE[byte]
+        self.last_write = None
+        self.address = address
+        self.read = read
+        self.pos = 0
+        self.verdict = None
+        self.pec_pos = None
+        size = self.frames.get(self.cmd)
+        if read and size is not None and size != BLOCK:
+            self.pec_pos = size
+
+    # Checks one data byte of an SMBus chip, returns whether the engine decodes it
+    def decode_byte(self, ss, es, databyte):
+        pos = self.pos
+        self.pos += 1
+        expected = self.crc
+        self.crc = PEC_TABLE[expected ^ databyte]
+        if pos == 0:
+            self.start_ss = ss
+        self.last_es = es
+        if self.verdict is not None:
+            self.put_texts(ss, es, ('Byte after PEC: 0x{0:02X}', 'Extra byte 0x{0:02X}', 'Extra'), '0x{0:02X}',
+                           databyte)
+            return False
+        if not self.read:
+            if pos == 0:
+                self.cmd = databyte
+                size = self.frames.get(databyte)
+                if size is not None and size != BLOCK:
+                    self.pec_pos = 1 + size
+            elif pos == 1 and self.frames.get(self.cmd) == BLOCK:
+                self.pec_pos = 2 + databyte
+        elif pos == 0 and self.frames.get(self.cmd) == BLOCK:
+            self.pec_pos = 1 + databyte
+        if pos != self.pec_pos:
+            return True
+
+        # A message followed by its PEC folds to zero
+        self.verdict = self.crc == 0
+        if self.engine.transfer is not None:
+            self.engine.end_transfer()
+        if self.verdict:
+            for held in self.held:
+                self.engine_emit_field(*held)
+            self.put_texts(ss, es, ('PEC OK: 0x{0:02X}', 'PEC OK', 'OK'), '0x{0:02X}', databyte)
+        else:
+            self.put_texts(self.start_ss, es, (
+                'PEC error: got 0x{0:02X}, expected 0x{1:02X}, frame dropped', 'PEC error: 0x{0:02X} != 0x{1:02X}',
+                'PEC error', 'PEC!'), '0x{0:02X}', databyte, expected)
+        self.held = []
+        return False
+
+    # Emits what a message sent without PEC held back, and flags a transfer cut short of its frame size
+    def end_transfer(self):
+        if self.frames is None:
+            return
+        if self.engine.transfer is not None:
+            self.engine.end_transfer()
+        if self.verdict is None:
+            for held in self.held:
+                self.engine_emit_field(*held)
+            self.held = []
+            if self.pec_pos is not None and 0 < self.pos < self.pec_pos and (self.read or self.pos > 1):
+                self.put_texts(self.start_ss, self.last_es, ('Transfer truncated: {} of {} bytes', 'Truncated: {}/{}',
+                                                             'Truncated'), '{}/{}', self.pos, self.pec_pos)
+            elif not self.read:
+                self.last_write = (self.address, self.cmd, self.crc)
+        self.frames = None
+
+    # Formats only the variants of texts, or the value template, shown at the verbosity level
+    def put_texts(self, ss, es, texts, value, *args):
+        if self.engine.annotate:
+            level = self.engine.level
+            self.engine.put_ann(ss, es, [self.ann, [text.format(*args) for text in
+                                                    ([value] if level == 'values' else pick_texts(texts, level))]])
+
+    def end(self):
+        self.end_transfer()
+        self.engine_end()
@@ -0,0 +1,200 @@
+import json
+import re
+import sqlite3
+from collections import namedtuple
+from .engine import OUTPUT_PYTHON
+
+BATCH_ROWS = 65536  # Records written per transaction
+STORE_VERSION = 2  # Schema version kept in the user_version of the database
+
+# One row per decoded record. Numbers, bools included, go to value and anything else as text, JSON for tuples like
+# the USB-PD PDO sinks. changed marks a record whose value differs from the one before it of the same field in the
+# capture. Captures are keyed by the absolute path of their file, so captures of the same name from different units
+# are kept apart. A capture's record count stays NULL until its ingestion is complete, queries skip it until then.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS captures (id INTEGER PRIMARY KEY, name TEXT NOT NULL, path TEXT NOT NULL UNIQUE,
+                                     samplerate REAL, records INTEGER);
+CREATE TABLE IF NOT EXISTS fields (id INTEGER PRIMARY KEY, chip TEXT NOT NULL, register TEXT NOT NULL,
+                                   field TEXT NOT NULL, unit TEXT, UNIQUE (chip, register, field));
+CREATE TABLE IF NOT EXISTS records (capture INTEGER NOT NULL, field INTEGER NOT NULL, ss INTEGER NOT NULL,
+                                    es INTEGER NOT NULL, value REAL, text TEXT, changed INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS records_value ON records (field, value);
+CREATE INDEX IF NOT EXISTS records_capture ON records (capture, field, ss);
+CREATE INDEX IF NOT EXISTS records_changed ON records (field, capture, ss) WHERE changed;
+'''
+
+# A query on one field: FIELD>X, FIELD<X, X<FIELD<Y or FIELD changed. FIELD is chip.field or chip.register.field and
+# may hold * wildcards. above and below are exclusive.
+Condition = namedtuple('Condition', ('name', 'above', 'below', 'changed'))
+CONDITION = re.compile(r'^(?:(?P<low>[^<>\s]+)\s*<\s*(?=[^<>\s]+\s*<))?(?P<name>[^<>\s]+)'
+                       r'(?:\s*(?P<op>[<>])\s*(?P<value>[^<>\s]+)|\s+(?P<changed>changed))?$')
+
+# A record matching a condition, time in seconds when the capture's samplerate is known
+Hit = namedtuple('Hit', ('capture', 'path', 'chip', 'register', 'field', 'value', 'unit', 'ss', 'es', 'time'))
+# The records of one capture matching a condition: how many, the range of their values and where they start and end
+CaptureHits = namedtuple('CaptureHits', ('capture', 'path', 'condition', 'count', 'min', 'max', 'ss', 'es'))
+
+
+def parse_condition(text):
+    match = CONDITION.match(text.strip())
+    if match is None or match.group('low') is not None and match.group('op') != '<':
+        raise ValueError('Expected FIELD>X, FIELD<X, X<FIELD<Y or FIELD changed, got {}'.format(text))
+    try:
+        above = float(match.group('low')) if match.group('low') is not None else None
+        value = float(match.group('value')) if match.group('value') is not None else None
+    except ValueError:
+        raise ValueError('Expected a number in {}'.format(text)) from None
+    if match.group('op') == '>':
+        above = value
+    below = value if match.group('op') == '<' else None
+    return Condition(match.group('name'), above, below, match.group('changed') is not None)
+
+
+def get_columns(value):
+    if isinstance(value, (int, float)):
+        return float(value), None
+    return None, value if isinstance(value, str) else json.dumps(value, default=str)
+
+
+# Decoded fields of many captures in one SQLite file, so questions across captures are answered from its indexes
+# instead of decoding the captures again.
+# Ingestion takes the records an engine puts between begin_capture() and end_capture() and writes them in
+# transactions of batch_rows. A capture ingested again from the same path replaces the one stored before.
+class Store:
+    def __init__(self, path, batch_rows=BATCH_ROWS):
+        self.db = sqlite3.connect(path)
+        version, = self.db.execute('PRAGMA user_version').fetchone()
+        if version != STORE_VERSION:
+            if self.db.execute("SELECT name FROM sqlite_master WHERE name = 'captures'").fetchone() is not None:
+                self.db.close()
+                raise ValueError('{} was made by another version of the store, ingest into a new file'.format(path))
+            self.db.execute('PRAGMA user_version = {}'.format(STORE_VERSION))
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self.batch_rows = batch_rows
+        self.field_ids = {(chip, register, field): field_id for field_id, chip, register, field
+                          in self.db.execute('SELECT id, chip, register, field FROM fields')}
+        self.capture = None
+        self.rows = []
+        self.last = {}  # Field id -> (value, text) last ingested in the capture
+        self.count = 0
+
+    def begin_capture(self, name, path, samplerate=None):
+        with self.db:
+            row = self.db.execute('SELECT id FROM captures WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                self.db.execute('DELETE FROM records WHERE capture = ?', row)
+                self.db.execute('DELETE FROM captures WHERE id = ?', row)
+            self.capture = self.db.execute('INSERT INTO captures (name, path, samplerate) VALUES (?, ?, ?)',
+                                           (name, path, samplerate)).lastrowid
+        self.last = {}
+        self.count = 0
+
+    def put(self, ss, es, output, data):
+        if output == OUTPUT_PYTHON:
+            self.add(data)
+
+    def add(self, record):
+        field = self.field_ids.get((record.chip, record.register, record.field))
+        if field is None:
+            field = self.add_field(record)
+        columns = get_columns(record.value)
+        last = self.last.get(field)
+        self.last[field] = columns
+        self.rows.append((self.capture, field, record.ss, record.es, columns[0], columns[1],
+                          last is not None and last != columns))
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def add_field(self, record):
+        key = (record.chip, record.register, record.field)
+        with self.db:
+            self.field_ids[key] = self.db.execute('INSERT INTO fields (chip, register, field, unit) '
+                                                  'VALUES (?, ?, ?, ?)', key + (record.unit,)).lastrowid
+        return self.field_ids[key]
+
+    def flush(self):
+        if self.rows:
+            with self.db:
+                self.db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?)', self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+    # Completes the capture and returns its number of records
+    def end_capture(self):
+        self.flush()
+        with self.db:
+            self.db.execute('UPDATE captures SET records = ? WHERE id = ?', (self.count, self.capture))
+        self.capture = None
+        return self.count
+
+    # Completed captures as (name, path, samplerate, records)
+    def get_captures(self):
+        return self.db.execute('SELECT name, path, samplerate, records FROM captures WHERE records IS NOT NULL '
+                               'ORDER BY name, path').fetchall()
+
+    # Ids of the stored fields matching a field name, which raises ValueError listing the stored fields if none do,
+    # so a misspelled name is not mistaken for a field without hits
+    def get_field_ids(self, name):
+        parts = name.split('.')
+        if len(parts) == 2:
+            rows = self.db.execute('SELECT id FROM fields WHERE chip GLOB ? AND field GLOB ?', parts)
+        elif len(parts) == 3:
+            rows = self.db.execute('SELECT id FROM fields WHERE chip GLOB ? AND register GLOB ? AND field GLOB ?',
+                                   parts)
+        else:
+            raise ValueError('Expected chip.field or chip.register.field, got {}'.format(name))
+        field_ids = [field_id for field_id, in rows]
+        if not field_ids:
+            known = sorted('.'.join(key) for key in self.db.execute('SELECT chip, register, field FROM fields'))
+            raise ValueError('No stored field matches {}, known fields: {}'.format(name, ', '.join(known) or 'none'))
+        return field_ids
+
+    # WHERE clause and parameters selecting the records matching a condition, in captures of the given names and
+    # from sample start to end
+    def get_where(self, condition, captures=None, start=None, end=None):
+        field_ids = self.get_field_ids(condition.name)
+        terms = ['r.field IN ({})'.format(', '.join('?' * len(field_ids))), 'c.records IS NOT NULL']
+        params = list(field_ids)
+        for term, param in (('r.value > ?', condition.above), ('r.value < ?', condition.below),
+                            ('r.ss >= ?', start), ('r.ss < ?', end)):
+            if param is not None:
+                terms.append(term)
+                params.append(param)
+        if condition.changed:
+            terms.append('r.changed')
+        if captures is not None:
+            terms.append('c.name IN ({})'.format(', '.join('?' * len(captures))))
+            params.extend(captures)
+        return ' AND '.join(terms), params
+
+    # Records matching a condition, by capture and sample
+    def get_hits(self, condition, captures=None, start=None, end=None, limit=None):
+        where, params = self.get_where(condition, captures, start, end)
+        query = ('SELECT c.name, c.path, f.chip, f.register, f.field, r.value, r.text, f.unit, r.ss, r.es, '
+                 'c.samplerate FROM records r JOIN fields f ON f.id = r.field JOIN captures c ON c.id = r.capture '
+                 'WHERE {} ORDER BY r.capture, r.ss'.format(where))
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return [Hit(capture, path, chip, register, field, text if value is None else value, unit, ss, es,
+                    ss / samplerate if samplerate else None)
+                for capture, path, chip, register, field, value, text, unit, ss, es, samplerate
+                in self.db.execute(query, params)]
+
+    # Captures with records matching any of the conditions, e.g. every unit whose FET got too hot or whose PDO sinks
+    # changed, one CaptureHits per capture and condition met, by capture
+    def get_capture_hits(self, conditions, captures=None, start=None, end=None):
+        hits = []
+        for condition in conditions:
+            where, params = self.get_where(condition, captures, start, end)
+            query = ('SELECT c.name, c.path, count(*), min(r.value), max(r.value), min(r.ss), max(r.es) '
+                     'FROM records r JOIN captures c ON c.id = r.capture WHERE {} GROUP BY r.capture'.format(where))
+            hits.extend(CaptureHits(capture, path, condition, count, low, high, ss, es)
+                        for capture, path, count, low, high, ss, es in self.db.execute(query, params))
+        hits.sort(key=lambda hit: (hit.capture, hit.path))
+        return hits
+
+    def close(self):
+        self.db.close()
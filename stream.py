@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import stat
+import sys
+from .engine import Engine, ANNOTATIONS, ANOMALY_ANN, OUTPUT_ANN, OUTPUT_PYTHON, OUTPUT_META
+from .events import parse_line
+
+LATENCY = 0.1  # Seconds an output may wait in a batch
+BATCH_OUTPUTS = 4096
+QUEUE_BATCHES = 64  # Batches a subscriber may fall behind
+CHUNK_BYTES = 65536
+QUEUE_CHUNKS = 16
+POLL = 0.1  # Seconds between looks at a followed file
+DASHBOARD_INTERVAL = 0.5
+DASHBOARD_EVENTS = 5
+
+
+# An engine output as a JSON-friendly dict, the lines written by the CLI's --json
+def get_update(ss, es, output, data):
+    if output == OUTPUT_ANN:
+        return {'ss': ss, 'es': es, 'ann': ANNOTATIONS[data[0]][0], 'texts': data[1]}
+    elif output == OUTPUT_PYTHON:
+        return data._asdict()
+    elif output == OUTPUT_META:
+        return {'ss': ss, 'es': es, 'profile': data}
+    return None
+
+
+def get_json_lines(batch):
+    lines = []
+    for output in batch:
+        update = get_update(*output)
+        if update is not None:
+            lines.append(json.dumps(update, default=str) + '\n')
+    return ''.join(lines)
+
+
+# Reads a capture in chunks as it is written: a pipe until it closes, a file until its end, or with follow forever,
+# like tail -f
+async def read_chunks(f, follow=False):
+    if stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            if chunk:
+                yield chunk
+            elif follow:
+                await asyncio.sleep(POLL)
+            else:
+                return
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), f)
+    try:
+        while True:
+            chunk = await reader.read(CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        transport.close()
+
+
+# Queue of output batches for one consumer. A lossless subscription makes the stream wait for it, a lossy one drops
+# its oldest batch instead, so a slow consumer costs only itself.
+class Subscription:
+    def __init__(self, maxsize=QUEUE_BATCHES, lossy=False):
+        self.queue = asyncio.Queue(maxsize)
+        self.lossy = lossy
+        self.dropped = 0  # Outputs dropped by a lossy subscription
+
+    async def put(self, batch):
+        if self.lossy and self.queue.full():
+            self.dropped += len(self.queue.get_nowait())
+        await self.queue.put(batch)
+
+    # Ends the subscription at once, dropping its oldest batch if it is full, for when the stream fails
+    def abort(self):
+        if self.queue.full():
+            self.dropped += len(self.queue.get_nowait())
+        self.queue.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        batch = await self.queue.get()
+        if batch is None:
+            raise StopAsyncIteration
+        return batch
+
+
+# Decodes sigrok-cli i2c text output as it arrives and publishes what the engine puts, in (ss, es, output, data)
+# batches, to every subscription.
+# A batch is published once it holds batch_outputs outputs or its first output is `latency` seconds old, whether or
+# not more input arrives, so at low bus load outputs wait at most `latency` and at full load they go in large batches.
+# Input is read ahead by at most QUEUE_CHUNKS chunks: when lossless subscribers fall behind, the stream waits for
+# them and stops reading, which blocks the writer of the pipe instead of buffering without bound.
+class Stream:
+    def __init__(self, options, latency=LATENCY, batch_outputs=BATCH_OUTPUTS, samplerate=None):
+        self.engine = Engine(options, self.put, samplerate)
+        self.latency = latency
+        self.batch_outputs = batch_outputs
+        self.subscriptions = []
+        self.batch = []
+        self.batch_time = None  # Loop time of the first output in the batch
+        self.max_wait = 0.0  # Longest time an output waited in a batch
+        self.loop = None
+
+    def subscribe(self, maxsize=QUEUE_BATCHES, lossy=False):
+        subscription = Subscription(maxsize, lossy)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+
+    def put(self, ss, es, output, data):
+        if self.batch_time is None:
+            self.batch_time = self.loop.time()
+        self.batch.append((ss, es, output, data))
+
+    async def publish(self):
+        if self.batch:
+            self.max_wait = max(self.max_wait, self.loop.time() - self.batch_time)
+            batch, self.batch, self.batch_time = self.batch, [], None
+            for subscription in list(self.subscriptions):
+                await subscription.put(batch)
+
+    # Queues the chunks read, then None, or the error that ended reading
+    async def read(self, chunks, queue):
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    async def run(self, chunks):
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(QUEUE_CHUNKS)
+        reader = asyncio.ensure_future(self.read(chunks, queue))
+        engine = self.engine
+        engine.start()
+        rest = b''
+        num = 0
+        try:
+            while True:
+                timeout = None
+                if self.batch_time is not None:
+                    timeout = max(0.0, self.batch_time + self.latency - self.loop.time())
+                try:
+                    chunk = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    await self.publish()
+                    continue
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if chunk is None:
+                    lines = [rest] if rest else []
+                else:
+                    lines = (rest + chunk).split(b'\n')
+                    rest = lines.pop()
+                for line in lines:
+                    event = parse_line(line.decode('utf-8', 'replace'), num)
+                    num += 1
+                    if event is not None:
+                        ss, es, command, databyte = event
+                        engine.decode(ss, es, (command, databyte))
+                if chunk is None:
+                    break
+                if len(self.batch) >= self.batch_outputs or (
+                        self.batch_time is not None and self.loop.time() - self.batch_time >= self.latency):
+                    await self.publish()
+            engine.end()
+            await self.publish()
+            for subscription in list(self.subscriptions):
+                await subscription.put(None)
+        except BaseException:
+            for subscription in self.subscriptions:
+                subscription.abort()
+            raise
+        finally:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
+
+async def write_file(subscription, out):
+    async for batch in subscription:
+        out.write(get_json_lines(batch))
+        out.flush()
+
+
+# Serves JSON lines to every client connecting to host:port. Each client gets a lossy subscription; after a client
+# fell behind, a {"dropped": n} line tells how many outputs it missed so far.
+async def serve_socket(stream, host, port):
+    async def client(reader, writer):
+        subscription = stream.subscribe(lossy=True)
+        dropped = 0
+        try:
+            async for batch in subscription:
+                if subscription.dropped != dropped:
+                    dropped = subscription.dropped
+                    writer.write((json.dumps({'dropped': dropped}) + '\n').encode())
+                writer.write(get_json_lines(batch).encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            stream.unsubscribe(subscription)
+            writer.close()
+
+    return await asyncio.start_server(client, host, port)
+
+
+# Terminal view of the last value of every record field and the last anomalies, redrawn at most every interval
+async def show_dashboard(subscription, out=sys.stdout, interval=DASHBOARD_INTERVAL):
+    values = {}
+    events = []
+    outputs = 0
+    drawn = None
+    loop = asyncio.get_running_loop()
+    async for batch in subscription:
+        for ss, es, output, data in batch:
+            if output == OUTPUT_PYTHON:
+                values[data.chip, data.field] = (data.value, data.unit)
+            elif output == OUTPUT_ANN and data[0] >= ANOMALY_ANN:
+                events = (events + ['{}-{} {}'.format(ss, es, data[1][0])])[-DASHBOARD_EVENTS:]
+        outputs += len(batch)
+        if drawn is None or loop.time() - drawn >= interval:
+            drawn = loop.time()
+            out.write(get_dashboard(values, events, outputs, subscription.dropped))
+            out.flush()
+    out.write(get_dashboard(values, events, outputs, subscription.dropped))
+    out.flush()
+
+
+def get_dashboard(values, events, outputs, dropped):
+    lines = ['\x1b[H\x1b[J{} outputs, {} dropped'.format(outputs, dropped), '']
+    for (chip, field), (value, unit) in sorted(values.items()):
+        lines.append('{:<8} {:<28} {} {}'.format(chip, field, value, unit or '').rstrip())
+    if events:
+        lines += ['', 'Anomalies:'] + events
+    return '\n'.join(lines) + '\n'
+
+
+# Streams one capture, f opened in binary mode, to JSON line files, a socket server and/or a terminal dashboard.
+# files are open text files. Returns the stream, e.g. for its max_wait.
+async def decode_live(f, options, files=(), address=None, dashboard=False, follow=False, latency=LATENCY,
+                      samplerate=None):
+    stream = Stream(options, latency, samplerate=samplerate)
+    consumers = [write_file(stream.subscribe(), out) for out in files]
+    if dashboard:
+        consumers.append(show_dashboard(stream.subscribe(lossy=True)))
+    server = None
+    if address is not None:
+        server = await serve_socket(stream, *address)
+    try:
+        await asyncio.gather(stream.run(read_chunks(f, follow)), *consumers)
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+    return stream
@@ -0,0 +1,111 @@
+from .regmap import Choice, pick_texts
+
+SUMMARY_WINDOWS = 3  # Window lengths set by the options, each chip has a summary annotation class per window
+# Indices into the stats of a field in a window
+MIN, MAX, TOTAL, COUNT = range(4)
+
+
+# Aggregates every numeric field into min/max/mean/count per fixed sample window, one set of windows per window
+# length, and puts one annotation per chip and window. Each value costs a constant amount of work and only the
+# open windows are kept.
+# install() wraps the engine's emit_field and end.
+# windows are (window, length in seconds) pairs, chips maps the chips summarized to the annotation class of each of
+# their windows. Windows need the samplerate, values before set_samplerate are not aggregated.
+class Summarizer:
+    def __init__(self, engine, windows, chips):
+        self.engine = engine
+        self.windows = windows
+        self.chips = chips
+        self.samples = None  # (window, length in samples) pairs
+        self.open = {}  # (window, chip) -> [start, end, {field id: stats}]
+        self.numeric = {}  # Field id -> whether the field is aggregated
+
+    def install(self):
+        engine = self.engine
+        self.engine_emit_field = engine.emit_field
+        self.engine_end = engine.end
+        engine.emit_field = self.emit_field
+        engine.end = self.end
+
+    def set_samplerate(self, samplerate):
+        self.samples = [(window, max(1, int(round(seconds * samplerate)))) for window, seconds in self.windows]
+
+    def emit_field(self, ss, es, slot, raw):
+        self.engine_emit_field(ss, es, slot, raw)
+        if self.samples is None:
+            return
+        info = slot[5]
+        numeric = self.numeric.get(info.id)
+        field = slot[0]
+        value = field.value(raw)
+        if numeric is None:
+            numeric = self.numeric[info.id] = (info.chip in self.chips and field.ann is not None and field.summary
+                                               and not isinstance(field, Choice) and isinstance(value, (int, float))
+                                               and not isinstance(value, bool))
+        if numeric:
+            self.add(ss, info, value)
+
+    def add(self, ss, info, value):
+        for window, samples in self.samples:
+            key = (window, info.chip)
+            entry = self.open.get(key)
+            if entry is None or ss >= entry[1]:
+                if entry is not None:
+                    self.put_window(key, entry)
+                start = ss - ss % samples
+                entry = self.open[key] = [start, start + samples, {}]
+            stats = entry[2].get(info.id)
+            if stats is None:
+                entry[2][info.id] = [value, value, value, 1]
+            else:
+                if value < stats[MIN]:
+                    stats[MIN] = value
+                elif value > stats[MAX]:
+                    stats[MAX] = value
+                stats[TOTAL] += value
+                stats[COUNT] += 1
+
+    def put_window(self, key, entry):
+        if not self.engine.annotate:
+            return
+        window, chip = key
+        fields = self.engine.regmap.fields
+        level = self.engine.level
+        full, compact, means = [], [], []
+        count = 0
+        for field_id in sorted(entry[2]):
+            low, high, total, num = entry[2][field_id]
+            count += num
+            if level == 'minimal':
+                continue
+            info = fields[field_id]
+            mean = '{:.4g}{}'.format(total / num, info.unit)
+            if level == 'values':
+                means.append(mean)
+                continue
+            if level == 'full':
+                full.append('{}: {}..{}{}, mean {}, {} values'.format(info.name, low, high, info.unit, mean, num))
+            compact.append('{}: {}'.format(info.name, mean))
+        if level == 'values':
+            texts = [', '.join(means)]
+        else:
+            texts = pick_texts(('; '.join(full), '; '.join(compact), '{} values'.format(count)), level)
+        self.engine.put_ann(entry[0], entry[1], [self.chips[chip][window], texts])
+
+    def put_windows(self):
+        for key, entry in sorted(self.open.items(), key=lambda item: item[1][0]):
+            self.put_window(key, entry)
+        self.open.clear()
+
+    # Open windows as JSON-friendly [window, chip name, start, end, [[field id, min, max, total, count], ...]] lists
+    def get_state(self):
+        return [[window, chip.value, entry[0], entry[1], [[field_id] + stats for field_id, stats in entry[2].items()]]
+                for (window, chip), entry in self.open.items()]
+
+    def set_state(self, state, chip_type):
+        self.open = {(window, chip_type(chip)): [start, end, {stats[0]: stats[1:] for stats in fields}]
+                     for window, chip, start, end, fields in state}
+
+    def end(self):
+        self.engine_end()
+        self.put_windows()
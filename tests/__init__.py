@@ -0,0 +1,10 @@
+from ..engine import Engine
+
+
+# Everything a serial Engine puts while decoding events, as (ss, es, output, data) tuples
+def decode_serial(events, options, samplerate=None):
+    out = []
+    engine = Engine(options, lambda ss, es, output, data: out.append((ss, es, output, data)), samplerate)
+    engine.start()
+    engine.decode_events(events)
+    return out
@@ -0,0 +1,46 @@
+import pytest
+from ..benchmark.traffic import Traffic
+from ..engine import Engine, OUTPUT_PYTHON
+from .. import bulk
+
+
+@pytest.fixture(scope='module')
+def events():
+    return Traffic('reflex', seed=1).generate(0.5)
+
+
+# Values of every field of the bulk registers, by 'chip.register' and field name, from a decode publishing records
+def get_record_values(events):
+    values = {}
+
+    def put(ss, es, output, data):
+        if output == OUTPUT_PYTHON:
+            values.setdefault('{}.{}'.format(data.chip, data.register), {}).setdefault(data.field, []).append(
+                data.value)
+
+    engine = Engine({'BMS': 'yes', 'Hall': 'yes', 'USB-PD': 'no', 'PIC': 'no', 'annotations': 'no',
+                     'records': 'python'}, put)
+    engine.start()
+    engine.decode_events(events)
+    return values
+
+
+def check_columns(columns, events):
+    values = get_record_values(events)
+    assert sorted(columns) == ['BMS.DAStatus1', 'BMS.DAStatus2', 'Hall.measurement']
+    for name, register in columns.items():
+        fields = {field: list(column) for field, column in register.items() if field not in ('ss', 'es')}
+        assert len(register['ss']) > 0
+        assert fields == values[name]
+
+
+@pytest.mark.skipif(bulk.numpy is None, reason='NumPy is not installed')
+def test_numpy_columns_match_records(events):
+    columns = bulk.decode_bulk(events)
+    check_columns({name: {field: column.tolist() for field, column in register.items()}
+                   for name, register in columns.items()}, events)
+
+
+def test_list_columns_match_records(events, monkeypatch):
+    monkeypatch.setattr(bulk, 'numpy', None)
+    check_columns(bulk.decode_bulk(events), events)
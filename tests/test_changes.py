@@ -0,0 +1,52 @@
+import pytest
+from . import decode_serial
+from ..benchmark.traffic import Traffic
+from ..chips import HALL
+from ..engine import OUTPUT_ANN, OUTPUT_PYTHON
+
+BX = 43  # Annotation class of the Hall Bx part
+
+
+# Hall sensor polls of the given raw 12-bit Bx values, the other axes and the temperature left unchanged
+def poll_bx(values):
+    traffic = Traffic('hall')
+    for bx in values:
+        traffic.read(HALL.address, [bx >> 4, 0x10, 0x10, 0x30, (bx & 0xF) << 4, 0, 0x40, 0x12, 0x34, 0x56])
+    return traffic.events
+
+
+def decode(events, changes):
+    return decode_serial(events, {'Hall': 'yes', 'changes': changes, 'records': 'python'})
+
+
+def get_anns(out, cls):
+    return [(ss, es, data[1]) for ss, es, output, data in out if output == OUTPUT_ANN and data[0] == cls]
+
+
+# A repeated value is put once, spanning its whole run, while every value is still recorded
+def test_repeats_merge_into_one_annotation():
+    events = poll_bx([100, 100, 100, 120, 120])
+    every = get_anns(decode(events, 'no'), BX)
+    out = decode(events, 'yes')
+    assert get_anns(out, BX) == [(every[0][0], every[2][1], every[0][2]), (every[3][0], every[4][1], every[3][2])]
+    assert len([data for ss, es, output, data in out if output == OUTPUT_PYTHON and data.field == 'bx']) == 5
+
+
+# Consecutive reads of the same chip share one chip annotation
+def test_chip_annotations_merge():
+    events = poll_bx([100, 110, 120])
+    chips = [(ss, es, data) for ss, es, output, data in decode(events, 'no')
+             if output == OUTPUT_ANN and data[1][0] == 'Reading from chip: Hall']
+    merged = [(ss, es, data) for ss, es, output, data in decode(events, 'yes')
+              if output == OUTPUT_ANN and data[1][0] == 'Reading from chip: Hall']
+    assert len(chips) == 3
+    assert merged == [(chips[0][0], chips[-1][1], chips[0][2])]
+
+
+# Within the deadband of the first value of a run the value counts as unchanged: steps of one LSB (0.098 mT) stay
+# in a 0.2 mT run until they drift 0.294 mT away from it
+@pytest.mark.parametrize('changes, runs', (('yes', 4), ('deadband', 2)))
+def test_deadband(changes, runs):
+    anns = get_anns(decode(poll_bx([100, 101, 102, 103]), changes), BX)
+    assert len(anns) == runs
+    assert anns[-1][2] == get_anns(decode(poll_bx([103]), 'no'), BX)[0][2]
@@ -0,0 +1,90 @@
+import pytest
+from . import decode_serial
+from ..benchmark.traffic import Traffic
+from ..checkpoint import decode_indexed, get_resume_sample, load_checkpoints
+from ..engine import Engine
+from ..events import write_binary
+
+OPTIONS = {'PIC': 'yes', 'BMS': 'yes', 'USB-PD': 'yes', 'Hall': 'yes', 'records': 'both'}
+INTERVAL = 20  # Transfers between checkpoints
+
+
+def decode_from(path, options, start, samplerate=None):
+    out = []
+    resume = decode_indexed(path, options, lambda ss, es, output, data: out.append((ss, es, output, data)), start,
+                            interval=INTERVAL, samplerate=samplerate)
+    return resume, out
+
+
+def write_capture(path, events):
+    with open(path, 'wb') as f:
+        write_binary(f, events)
+
+
+# Resumes from every checkpoint, and from between two of them, after a first decode took the checkpoints
+def check_resume(path, events, options, samplerate=None):
+    full = decode_serial(events, options, samplerate)
+    assert decode_from(path, options, 0, samplerate) == (0, full)
+    checkpoints = load_checkpoints(path, Engine(options).options, samplerate)
+    assert len(checkpoints) > 2
+
+    starts = [checkpoint['ss'] for checkpoint in checkpoints] + [checkpoints[1]['ss'] + 1]
+    for start in starts:
+        resume, out = decode_from(path, options, start, samplerate)
+        assert resume == max(checkpoint['ss'] for checkpoint in checkpoints if checkpoint['ss'] <= start)
+        assert out == [output for output in full if output[0] >= start]
+
+
+@pytest.mark.parametrize('transactions', ('no', 'yes'))
+def test_resume_matches_full_decode(tmp_path, transactions):
+    events = Traffic('reflex', seed=2).generate(0.2)
+    path = str(tmp_path / 'capture.bin')
+    write_capture(path, events)
+    check_resume(path, events, dict(OPTIONS, transactions=transactions))
+
+
+# Held back change-only runs are resumed, and an index taken under other change or verbosity options is not reused
+@pytest.mark.parametrize('indexed', ({}, {'changes': 'yes'}, {'changes': 'yes', 'verbosity': 'minimal'}))
+@pytest.mark.parametrize('changes', ('yes', 'deadband'))
+def test_resume_with_changes(tmp_path, indexed, changes):
+    events = Traffic('all', seed=4).generate(0.2)
+    path = str(tmp_path / 'capture.bin')
+    write_capture(path, events)
+    decode_from(path, dict(OPTIONS, **indexed), 0)
+    check_resume(path, events, dict(OPTIONS, changes=changes))
+
+
+# Open summary windows are resumed, and an index taken under other summary options or samplerate is not reused
+@pytest.mark.parametrize('indexed', (({}, 1e6), ({'summary': 'yes'}, 2e6),
+                                     ({'summary': 'yes', 'summary_window_1': 0.002}, 1e6)))
+def test_resume_with_summary(tmp_path, indexed):
+    events = Traffic('all', seed=5).generate(0.2)
+    path = str(tmp_path / 'capture.bin')
+    write_capture(path, events)
+    decode_from(path, dict(OPTIONS, **indexed[0]), 0, indexed[1])
+    check_resume(path, events, dict(OPTIONS, summary='yes'), 1e6)
+
+
+# Open anomaly episodes are resumed, and an index taken under other anomaly options is not reused
+@pytest.mark.parametrize('indexed', ({}, {'anomalies': 'yes', 'max_bms_temp': 30.0}))
+def test_resume_with_anomalies(tmp_path, indexed):
+    events = Traffic('all', seed=6).generate(0.2)
+    path = str(tmp_path / 'capture.bin')
+    write_capture(path, events)
+    decode_from(path, dict(OPTIONS, **indexed), 0)
+    check_resume(path, events, dict(OPTIONS, anomalies='yes', max_cell_delta=0.01, max_bms_temp=25.0))
+
+
+# The capture grows after it was indexed: decoding resumes from the last checkpoint of the part indexed before
+def test_resume_after_capture_grew(tmp_path):
+    events = Traffic('all', seed=3).generate(0.2)
+    path = str(tmp_path / 'capture.bin')
+    write_capture(path, events[:len(events) // 2])
+    decode_from(path, OPTIONS, 0)
+    write_capture(path, events)
+
+    start = get_resume_sample(path, OPTIONS)
+    assert start > 0
+    resume, out = decode_from(path, OPTIONS, start)
+    assert resume == start
+    assert out == [output for output in decode_serial(events, OPTIONS) if output[0] >= start]
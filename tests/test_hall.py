@@ -0,0 +1,34 @@
+import math
+from . import decode_serial
+from ..benchmark.traffic import Traffic
+from ..chips import HALL
+from ..engine import OUTPUT_ANN, OUTPUT_PYTHON
+
+FRAME_ANN = 48  # Annotation class of the frame counter, channel and flags
+
+
+# One TLV493D read: 12-bit axes and temperature split into high bytes and nibbles, frame counter and channel in byte
+# 3, flags in the high nibble of byte 5, then the factory settings
+def read_frame(bx, by, bz, temp, counter, channel, flags):
+    traffic = Traffic('hall')
+    traffic.read(HALL.address, [bx >> 4, by >> 4, bz >> 4, temp >> 8 << 4 | counter << 2 | channel,
+                                (bx & 0xF) << 4 | by & 0xF, flags << 4 | bz & 0xF, temp & 0xFF, 0x12, 0x34, 0x56])
+    return decode_serial(traffic.events, {'Hall': 'yes', 'records': 'python'})
+
+
+# The axes and the temperature are put together from their high bytes and nibbles as signed 12-bit values
+def test_frame_parts():
+    out = read_frame(0x064, 0xF9C, 0x800, 350, 2, 1, 0b001)
+    values = {data.field: data.value for ss, es, output, data in out if output == OUTPUT_PYTHON}
+    assert values == {'bx': 9.8, 'by': -9.8, 'bz': -200.704,
+                      'magnitude': round(math.sqrt(100 ** 2 + 100 ** 2 + 2048 ** 2) * 0.098, 3), 'angle': -45.0,
+                      'temperature': 36.0, 'frame_counter': 2, 'factory_settings': 0x123456}
+    texts = [data[1][0] for ss, es, output, data in out if output == OUTPUT_ANN and data[0] == FRAME_ANN]
+    assert texts == ['Frame 2, channel 1, Power-down']
+
+
+# Every part of the frame spans the bytes of the whole frame
+def test_parts_span_frame():
+    out = read_frame(0x100, 0x200, 0x300, 340, 0, 0, 0)
+    spans = {(ss, es) for ss, es, output, data in out if output == OUTPUT_PYTHON and data.field != 'factory_settings'}
+    assert len(spans) == 1
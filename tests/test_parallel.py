@@ -0,0 +1,70 @@
+import io
+import random
+import pytest
+from ..benchmark.traffic import Traffic
+from ..chips import BMS, USB
+from ..cli import json_writer
+from ..events import TEXT_COMMANDS, write_binary
+from ..parallel import decode_capture, decode_parallel
+
+OPTIONS = {'PIC': 'yes', 'BMS': 'yes', 'USB-PD': 'yes', 'Hall': 'yes', 'records': 'python'}
+TEXT_NAMES = {command: name for name, command in TEXT_COMMANDS.items()}
+
+
+# sigrok-cli i2c output without sample numbers, whose events are numbered by their line
+def write_text(f, events):
+    for ss, es, command, databyte in events:
+        f.write(b'i2c-1: ' + TEXT_NAMES[command].encode())
+        f.write(b'\n' if databyte is None else ': {:02X}\n'.format(databyte).encode())
+
+
+# Writes selecting a register or command alone, and reads continuing from the one selected before them, so chips
+# enter many shards without a select settling their command
+def get_unsettled_traffic(seed):
+    traffic = Traffic('all', seed=seed)
+    rng = random.Random(seed)
+    for _ in range(300):
+        pick = rng.randrange(6)
+        if pick == 0:
+            traffic.write(USB.address, [rng.choice((0x70, 0x85, 0x91))])
+        elif pick == 1:
+            traffic.read(USB.address, [rng.choice((1, 2)), 0x90, 0x41, 0x04])
+        elif pick == 2:
+            traffic.write(BMS.address, [0x44])
+        elif pick == 3:
+            traffic.read(BMS.address, [0x06, rng.choice((0x71, 0x72)), 0x00, 0x10, 0x0E, 0x20, 0x0E])
+        elif pick == 4:
+            traffic.bms_da_status_1()
+        else:
+            traffic.bms_soc()
+    return traffic.events
+
+
+# Small shards, so the register shadow and the selected commands are handed over at many shard ends
+@pytest.mark.parametrize('transactions', ('no', 'yes'))
+@pytest.mark.parametrize('mix', ('all', 'reflex'))
+@pytest.mark.parametrize('write', (write_binary, write_text))
+def test_parallel_matches_serial(tmp_path, write, mix, transactions):
+    path = str(tmp_path / 'capture')
+    with open(path, 'wb') as f:
+        write(f, Traffic(mix, seed=1).generate(0.2))
+    options = dict(OPTIONS, transactions=transactions)
+    serial = io.StringIO()
+    decode_capture(path, options, json_writer(serial))
+    out = io.StringIO()
+    decode_parallel(path, options, out, json_writer, jobs=2, shard_events=2000)
+    assert out.getvalue() == serial.getvalue()
+
+
+@pytest.mark.parametrize('transactions', ('no', 'yes'))
+@pytest.mark.parametrize('seed', (1, 2))
+def test_parallel_replays_unsettled_chips(tmp_path, seed, transactions):
+    path = str(tmp_path / 'capture.bin')
+    with open(path, 'wb') as f:
+        write_binary(f, get_unsettled_traffic(seed))
+    options = dict(OPTIONS, transactions=transactions)
+    serial = io.StringIO()
+    decode_capture(path, options, json_writer(serial))
+    out = io.StringIO()
+    decode_parallel(path, options, out, json_writer, jobs=2, shard_events=60)
+    assert out.getvalue() == serial.getvalue()
@@ -0,0 +1,74 @@
+import pytest
+from ..benchmark.traffic import Traffic
+from ..chips import BMS
+from ..engine import Engine, OUTPUT_ANN, OUTPUT_PYTHON
+from ..smbus import get_pec
+
+SOC = 0x0D
+MBA = 0x44
+DA_STATUS_2 = 0x72
+
+
+def get_message_pec(write, read=None):
+    message = [BMS.address << 1] + write
+    if read is not None:
+        message += [BMS.address << 1 | 1] + read
+    return get_pec(message)
+
+
+# Reads a command's data with its PEC byte, or with the PEC byte corrupted
+def read(traffic, command, data, corrupt=False):
+    traffic.read(BMS.address, data + [get_message_pec(command, data) ^ (0xFF if corrupt else 0)], command=command)
+
+
+def read_block(traffic, subcommand, words, corrupt=False):
+    write = [MBA, 0x02, subcommand, 0x00]
+    traffic.write(BMS.address, write + [get_message_pec(write)])
+    data = traffic.words(words)
+    read(traffic, [MBA], [len(data) + 2, subcommand, 0x00] + data, corrupt)
+
+
+# The short text of every SMBus verdict and the (register, field, value) of every record
+def decode(traffic, transactions):
+    verdicts, records = [], []
+
+    def put(ss, es, output, data):
+        if output == OUTPUT_ANN and data[0] == BMS.smbus_ann:
+            verdicts.append(data[1][-1])
+        elif output == OUTPUT_PYTHON and data.register != 'command':
+            records.append((data.register, data.field, data.value))
+
+    engine = Engine({'BMS': 'yes', 'transactions': transactions, 'records': 'python'}, put)
+    engine.start()
+    engine.decode_events(traffic.events)
+    return verdicts, records
+
+
+def test_pec_check_value():
+    assert get_pec(b'123456789') == 0xF4
+
+
+@pytest.mark.parametrize('transactions', ('no', 'yes'))
+def test_word_verdicts(transactions):
+    traffic = Traffic('bms')
+    read(traffic, [SOC], [40, 0])
+    read(traffic, [SOC], [41, 0], corrupt=True)
+    traffic.read(BMS.address, [42], command=[SOC])  # Truncated
+    traffic.read(BMS.address, [43, 0], command=[SOC])  # Sent without PEC
+    verdicts, records = decode(traffic, transactions)
+    assert verdicts == ['OK', 'PEC!', 'Truncated']
+    # The corrupted word is dropped, the unverified one is emitted
+    assert [value for register, field, value in records] == [60, 57]
+
+
+@pytest.mark.parametrize('transactions', ('no', 'yes'))
+def test_block_verdicts(transactions):
+    temps = [2981, 2990, 3001, 0, 0, 3011, 3020] + [0] * 9
+    traffic = Traffic('bms')
+    read_block(traffic, DA_STATUS_2, temps)
+    read_block(traffic, DA_STATUS_2, temps, corrupt=True)
+    verdicts, records = decode(traffic, transactions)
+    # The subcommand write and the first block pass, the corrupted block is dropped whole
+    assert verdicts == ['OK', 'OK', 'OK', 'PEC!']
+    temperatures = [value for register, field, value in records if register == 'DAStatus2']
+    assert temperatures == [temp / 10 for temp in temps[:7]]
@@ -0,0 +1,92 @@
+import pytest
+from ..benchmark.traffic import Traffic
+from ..chips import USB
+from ..engine import Engine
+from ..store import Store, parse_condition
+
+OPTIONS = {'PIC': 'yes', 'BMS': 'yes', 'USB-PD': 'yes', 'Hall': 'yes', 'annotations': 'no', 'records': 'python'}
+
+
+def get_values(store, condition):
+    return [hit.value for hit in store.get_hits(parse_condition(condition))]
+
+
+def ingest(store, name, path, events):
+    store.begin_capture(name, path)
+    engine = Engine(OPTIONS, store.put)
+    engine.start()
+    engine.decode_events(events)
+    return store.end_capture()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path / 'store.db'))
+    yield store
+    store.close()
+
+
+# Captures of the same name from different units are kept apart, ingesting a path again replaces its capture
+def test_captures_keyed_by_path(store):
+    events = Traffic('all', seed=1).generate(0.1)
+    count = ingest(store, 'run1', '/unitA/run1.txt', events)
+    half = ingest(store, 'run1', '/unitB/run1.txt', events[:len(events) // 2])
+    assert 0 < half < count
+    assert ingest(store, 'run1', '/unitA/run1.txt', events) == count
+    assert store.get_captures() == [('run1', '/unitA/run1.txt', None, count), ('run1', '/unitB/run1.txt', None, half)]
+    assert store.db.execute('SELECT count(*) FROM records').fetchone() == (count + half,)
+
+
+def ingest_pdo_sinks(store, path, volts):
+    traffic = Traffic('usb')
+    for value in volts:
+        word = 300 | value * 20 << 10 | 1 << 26  # 3A, USB communication capable
+        traffic.write(USB.address, [0x85] + list(word.to_bytes(4, 'little')))
+    return ingest(store, 'usb', path, traffic.events)
+
+
+# The current and voltage of a PDO word are numbers of their own, so a sink's voltage can be compared and its changes
+# found apart from the rest of the word
+def test_pdo_sink_values(store):
+    ingest_pdo_sinks(store, '/usb', (5, 9, 9, 20))
+    assert get_values(store, 'USB-PD.pdo1_sink_voltage>5') == [9.0, 9.0, 20.0]
+    assert get_values(store, 'USB-PD.pdo1_sink_voltage<9') == [5.0]
+    assert get_values(store, '5<USB-PD.pdo1_sink_voltage<20') == [9.0, 9.0]
+    assert get_values(store, 'USB-PD.DPM_SNK_PDO1.pdo1_sink_voltage changed') == [9.0, 20.0]
+    assert get_values(store, 'USB-PD.pdo1_sink_current changed') == []
+
+
+@pytest.mark.parametrize('text, condition', (
+    ('BMS.soc>50', ('BMS.soc', 50.0, None, False)),
+    ('BMS.soc < 2.5e1', ('BMS.soc', None, 25.0, False)),
+    ('-1<BMS.*.cell?_voltage<4.2', ('BMS.*.cell?_voltage', -1.0, 4.2, False)),
+    ('USB-PD.pdo*_sink_voltage changed', ('USB-PD.pdo*_sink_voltage', None, None, True)),
+))
+def test_parse_condition(text, condition):
+    assert parse_condition(text) == condition
+
+
+@pytest.mark.parametrize('text', ('1<BMS.soc>2', 'BMS.soc>x', 'x<BMS.soc<2', 'BMS.soc>1 changed'))
+def test_parse_condition_errors(text):
+    with pytest.raises(ValueError):
+        parse_condition(text)
+
+
+# Wildcards match chip, register and field names, a name matching no stored field is an error rather than no hits
+def test_field_names(store):
+    ingest_pdo_sinks(store, '/usb', (5, 9))
+    assert get_values(store, 'USB-PD.pdo?_sink_voltage>0') == [5.0, 9.0]
+    assert get_values(store, 'USB-*.DPM_SNK_PDO*.pdo1_sink_voltage>0') == [5.0, 9.0]
+    with pytest.raises(ValueError, match='known fields: .*USB-PD.DPM_SNK_PDO1.pdo1_sink_voltage'):
+        get_values(store, 'USB-PD.pdo1_sink_volts>0')
+    with pytest.raises(ValueError):
+        get_values(store, 'pdo1_sink_voltage>0')
+
+
+# The captures meeting any condition, with the count and range of their matching values
+def test_capture_hits(store):
+    ingest_pdo_sinks(store, '/unitA/usb.txt', (5, 9, 20))
+    ingest_pdo_sinks(store, '/unitB/usb.txt', (5, 5))
+    conditions = [parse_condition('USB-PD.pdo1_sink_voltage>6'), parse_condition('USB-PD.pdo1_sink_voltage changed')]
+    hits = [(hit.path, hit.condition, hit.count, hit.min, hit.max) for hit in store.get_capture_hits(conditions)]
+    assert hits == [('/unitA/usb.txt', conditions[0], 2, 9.0, 20.0), ('/unitA/usb.txt', conditions[1], 2, 9.0, 20.0)]
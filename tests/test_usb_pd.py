@@ -0,0 +1,80 @@
+import random
+import pytest
+from . import decode_serial
+from ..benchmark.traffic import Traffic
+from ..chips import USB
+from ..engine import OUTPUT_ANN, OUTPUT_PYTHON
+from ..regmap import Bitfield
+from ..usb_pd import RDO_STATUS_BITS, USB_PD
+
+PDO_NUM_ANN = 25
+DPM_PDO_NUMB = 0x70
+ALERT_STATUS_1 = 0x0B
+PORT_STATUS_0 = 0x0D
+
+
+def decode(traffic, shadow):
+    return decode_serial(traffic.events, {'USB-PD': 'yes', 'shadow': shadow, 'records': 'python'})
+
+
+def get_values(out, field):
+    return [data.value for ss, es, output, data in out if output == OUTPUT_PYTHON and data.field == field]
+
+
+# Reads repeating the shadowed value are dropped, writes are always shown and update the shadow
+@pytest.mark.parametrize('shadow, numbers', (('yes', [3, 2, 2]), ('no', [3, 3, 2, 2, 2])))
+def test_shadow_drops_repeated_reads(shadow, numbers):
+    traffic = Traffic('usb')
+    for number in (3, 3, 2):
+        traffic.read(USB.address, [number], command=[DPM_PDO_NUMB])
+    traffic.write(USB.address, [DPM_PDO_NUMB, 2])
+    traffic.read(USB.address, [2], command=[DPM_PDO_NUMB])
+    out = decode(traffic, shadow)
+    assert get_values(out, 'pdo_number') == numbers
+    anns = [data for ss, es, output, data in out if output == OUTPUT_ANN and data[0] == PDO_NUM_ANN]
+    assert len(anns) == len(numbers)
+
+
+# The pointer auto-increments over the registers following it, which are shadowed by address whatever pointer read them
+def test_auto_increment_shares_shadow():
+    traffic = Traffic('usb')
+    traffic.read(USB.address, [0x01, 0x02, 0x01], command=[ALERT_STATUS_1])
+    traffic.read(USB.address, [0x01, 0x00], command=[PORT_STATUS_0])
+    out = decode(traffic, 'yes')
+    assert get_values(out, 'alert_status_1') == [0x01]
+    assert get_values(out, 'alert_status_1_mask') == [0x02]
+    assert get_values(out, 'port_status_0') == [0x01]
+    assert get_values(out, 'port_status_1') == [0x00]
+
+
+# Flags of the table lookups match the fields taken one at a time, for fields within and across 8-bit windows
+@pytest.mark.parametrize('fields', (
+    ((0, 1, 'A'), (3, 3, 'B {}'), (6, 4, {1: 'C one', 15: 'C all'}), (14, 2, lambda n: 'D {}'.format(n) if n else None),
+     (30, 2, {0: 'E zero'})),
+    ((20, 3, 'Reserved'), (28, 3, lambda n: 'Position {}'.format(n)), (31, 1, 'Top')),
+))
+def test_bitfield_tables(fields):
+    bits = Bitfield(fields)
+    rng = random.Random(1)
+    for word in [0, 0xFFFFFFFF] + [rng.getrandbits(32) for _ in range(200)]:
+        flags = []
+        for lsb, width, texts in sorted(fields):
+            value = word >> lsb & ((1 << width) - 1)
+            if isinstance(texts, str):
+                flags.append(texts.format(value) if value else None)
+            elif isinstance(texts, dict):
+                flags.append(texts.get(value))
+            else:
+                flags.append(texts(value))
+        flags = [flag for flag in flags if flag is not None]
+        assert bits.flags(word) == flags
+        assert bits.count(word) == len(flags)
+
+
+# The reserved RDO status bits are named apart from each other
+def test_rdo_status_flags():
+    word = 0b1001 << 28 | 0b1 << 24 | 0b101 << 20 | 150 << 10 | 300
+    assert USB_PD.rdo_reg_status_read(word) == (3.0, 1.5, ['Reserved bits 20-22 set', 'No USB suspend',
+                                                           'GiveBack enabled', 'Object position 1',
+                                                           'Reserved bit 31 set'])
+    assert RDO_STATUS_BITS.count(word) == 5
@@ -1,118 +1,237 @@
+from .regmap import Bitfield, Choice, Field, Frame, Part, Register, pick_texts
+
+ALERT_BITS = Bitfield((
+    (0, 1, 'PHY status'),
+    (1, 1, 'PRT status'),
+    (3, 1, 'PD/Type-C status'),
+    (4, 1, 'HW fault'),
+    (5, 1, 'Monitoring status'),
+    (6, 1, 'CC detection status'),
+    (7, 1, 'Hard reset'),
+))
+ATTACH_MODES = {0: 'No device', 1: 'Sink attached', 2: 'Source attached', 3: 'Debug accessory',
+                4: 'Audio accessory', 5: 'Power accessory'}
+CC_STATES = {1: 'Rp default', 2: 'Rp 1.5A', 3: 'Rp 3.0A'}
+TYPEC_STATES = {0: 'Unattached.SNK', 1: 'AttachWait.SNK', 2: 'Attached.SNK', 3: 'DebugAccessory.SNK',
+                12: 'Try.SRC', 13: 'Unattached.Accessory', 14: 'AttachWait.Accessory', 19: 'Error recovery'}
+
+# Status and alert registers: address, name, label, annotation class, flags, writable
+STATUS_REGISTERS = (
+    (0x0B, 'ALERT_STATUS_1', 'Alerts', 49, ALERT_BITS, False),
+    (0x0C, 'ALERT_STATUS_1_MASK', 'Alert mask', 49, ALERT_BITS, True),
+    (0x0D, 'PORT_STATUS_0', 'Port transition', 50, Bitfield((
+        (0, 1, 'Attach transition'),
+    )), False),
+    (0x0E, 'PORT_STATUS_1', 'Port', 50, Bitfield((
+        (0, 1, {0: 'Detached', 1: 'Attached'}),
+        (1, 1, 'VCONN supply'),
+        (2, 1, {0: 'UFP', 1: 'DFP'}),
+        (3, 1, {0: 'Sink', 1: 'Source'}),
+        (4, 1, 'Start-up power mode'),
+        (5, 3, lambda n: ATTACH_MODES.get(n, 'Attach mode {}'.format(n))),
+    )), False),
+    (0x0F, 'TYPEC_MONITORING_STATUS_0', 'VBUS transition', 50, Bitfield((
+        (1, 1, 'VBUS valid transition'),
+        (2, 1, 'VBUS vSafe0V transition'),
+        (3, 1, 'VBUS ready transition'),
+        (4, 1, 'VBUS low'),
+        (5, 1, 'VBUS high'),
+    )), False),
+    (0x10, 'TYPEC_MONITORING_STATUS_1', 'VBUS', 50, Bitfield((
+        (1, 1, 'VBUS valid'),
+        (2, 1, 'VBUS vSafe0V'),
+        (3, 1, 'VBUS ready'),
+    )), False),
+    (0x11, 'CC_STATUS', 'CC', 50, Bitfield((
+        (0, 2, lambda n: 'CC1 ' + CC_STATES.get(n, 'open')),
+        (2, 2, lambda n: 'CC2 ' + CC_STATES.get(n, 'open')),
+        (4, 1, {0: 'Presenting Rp', 1: 'Presenting Rd'}),
+        (5, 1, 'Looking for connection'),
+    )), False),
+    (0x12, 'CC_HW_FAULT_STATUS_0', 'HW fault transition', 50, Bitfield((
+        (4, 1, 'VPU valid transition'),
+        (5, 1, 'VPU OVP fault transition'),
+    )), False),
+    (0x13, 'CC_HW_FAULT_STATUS_1', 'HW fault', 50, Bitfield((
+        (4, 1, 'VSRC discharge fault'),
+        (6, 1, 'VPU valid'),
+        (7, 1, 'VPU OVP fault'),
+    )), False),
+    (0x14, 'PD_TYPEC_STATUS', 'PD handshake', 50, Bitfield((
+        (0, 4, 'Handshake {}'),
+    )), False),
+    (0x15, 'TYPEC_STATUS', 'Type-C', 50, Bitfield((
+        (0, 5, lambda n: TYPEC_STATES.get(n, 'State {}'.format(n))),
+        (7, 1, 'Reversed'),
+    )), False),
+    (0x16, 'PRT_STATUS', 'Protocol', 50, Bitfield((
+        (0, 1, 'Hard reset received'),
+        (2, 1, 'Message received'),
+        (4, 1, 'BIST received'),
+    )), False),
+)
+
+PDO_SINK_BITS = Bitfield((
+    (20, 3, 'Invalid'),
+    (23, 2, {0: 'Fast swap unsupported', 1: 'Default USB power', 2: '1.5A at 5V', 3: '3.0A at 5V'}),
+    (25, 1, 'Dual role data'),
+    (26, 1, 'USB communication capable'),
+    (27, 1, 'Unconstrained power'),
+    (28, 1, 'High capability'),
+    (29, 1, 'Dual role power'),
+    (30, 2, {0: 'Fixed supply', 1: 'Battery supply', 2: 'Variable supply', 3: 'Augmented PDO'}),
+))
+RDO_STATUS_BITS = Bitfield((
+    (20, 3, 'Reserved bits 20-22 set'),
+    (23, 1, 'Unchunked extended messages supported'),
+    (24, 1, {0: 'USB suspend', 1: 'No USB suspend'}),
+    (25, 1, 'USB communication capable'),
+    (26, 1, 'Capability mismatch'),
+    (27, 1, {0: 'GiveBack enabled'}),
+    (28, 3, lambda n: 'Object position {}'.format(n) if n else 'Invalid object position'),
+    (31, 1, 'Reserved bit 31 set'),
+))
+
+DPM_PDO_NUMB = 0x70
+DPM_SNK_PDO1 = 0x85
+PDO_SINKS = ((DPM_SNK_PDO1, 1), (0x89, 2), (0x8D, 3))
+RDO_REG_STATUS = 0x91
+
+POINTER_TEXTS = {
+    DPM_PDO_NUMB: ('USB-PD -> PDO number register', 'USB-PD -> PDO number', 'PDO number', 'PDO #'),
+    RDO_REG_STATUS: ('USB-PD -> Register status 0', 'USB-PD -> Reg status 0', 'USB-PD -> Reg stat 0', 'REG STAT 0',
+                     'REG STAT'),
+}
+POINTER_TEXTS.update({address: ('USB-PD -> PDO{} SNK 0 register'.format(num), 'USB-PD -> PDO{} SNK 0'.format(num),
+                                'PDO{} SNK 0'.format(num), 'PDO{} SNK'.format(num)) for address, num in PDO_SINKS})
+POINTER_TEXTS.update({address: ('USB-PD -> {} register'.format(name), 'USB-PD -> {}'.format(name), name, label)
+                      for address, name, label, ann, bits, writable in STATUS_REGISTERS})
+
+
+# STUSB4500 register shadow. Reads and writes go through the register pointer set by the first written byte, which
+# auto-increments, so the register map holds the registers following every start address at their offsets.
+# Every register is shadowed by address, reads repeating the shadowed value are not annotated again.
 class USB_PD:
+    name = 'USB-PD'
+    address = 0x28
+    desc = 'Display USB PD IC traffic'
+    default = 'yes'
+    annotations = (
+        (24, 'usb_access_cmd', 'USB PD access commands'),
+        (25, 'usb_pdo_num', 'DPM PDO number'),
+        (26, 'usb_pdo_sink', 'DPM PDO sink'),
+        (27, 'usb_rdo_reg_status', 'RDO register status'),
+        (49, 'usb_alert', 'USB PD alert status and mask'),
+        (50, 'usb_status', 'USB PD port, CC, VBUS and protocol status'),
+    )
+    rows = (
+        ('usb', 'USB-PD chip (STUSB4500)', (24, 25, 26, 27, 49, 50)),
+    )
+    summary_classes = (33, 37, 41)
+    anomalies = {'rdo_status': ('rdo', None)}
+
+    @staticmethod
+    def get_registers(start, offset):
+        fields = []
+        for address, name, label, ann, bits, writable in STATUS_REGISTERS:
+            fields.append((address, writable, Field(
+                name.lower(), address - start + offset, ann, fmt=lambda n, level, name=name, label=label, bits=bits:
+                USB_PD.status_texts(name, label, bits, n, level), shadow=address)))
+        fields.append((DPM_PDO_NUMB, True, Field(
+            'pdo_number', DPM_PDO_NUMB - start + offset, 25, ('DPM_PDO_NUM: {}', 'PDO NUM: {}', 'PDO = {}', '{}'),
+            convert=lambda n: n & 0b00000111, shadow=DPM_PDO_NUMB)))
+        # PDO and RDO words are annotated whole, their currents and voltage are also recorded as numbers of their own
+        for address, num in PDO_SINKS:
+            name = 'pdo{}_sink'.format(num)
+            fields.append((address, True, Frame(name + '_word', address - start + offset, 4, (
+                Part(name, 26, extract=lambda n: n, convert=lambda n: USB_PD.pdo_sink_read(n),
+                     fmt=lambda n, level: USB_PD.pdo_sink_texts(n, level)),
+                Part(name + '_current', None, extract=lambda n: n & 0x3FF, convert=lambda n: USB_PD.get_current(n),
+                     unit='A', summary=False, cache=False, record=True),
+                Part(name + '_voltage', None, extract=lambda n: n >> 10 & 0x3FF,
+                     convert=lambda n: USB_PD.get_voltage(n), unit='V', summary=False, cache=False, record=True),
+            ), order='little', shadow=address)))
+        fields.append((RDO_REG_STATUS, False, Frame('rdo_status_word', RDO_REG_STATUS - start + offset, 4, (
+            Part('rdo_status', 27, extract=lambda n: n, convert=lambda n: USB_PD.rdo_reg_status_read(n),
+                 fmt=lambda n, level: USB_PD.rdo_reg_status_texts(n, level)),
+            Part('rdo_max_current', None, extract=lambda n: n & 0x3FF, convert=lambda n: USB_PD.get_current(n),
+                 unit='A', summary=False, cache=False, record=True),
+            Part('rdo_current', None, extract=lambda n: n >> 10 & 0x3FF, convert=lambda n: USB_PD.get_current(n),
+                 unit='A', summary=False, cache=False, record=True),
+        ), order='little', shadow=RDO_REG_STATUS)))
+        return [(address, writable, field) for address, writable, field in fields if address >= start]
+
+    @staticmethod
+    def compile_registers():
+        registers = [
+            Register('pointer', True, None, (
+                Choice('register', 0, 24, POINTER_TEXTS, select=True),
+            )),
+        ]
+        starts = sorted(POINTER_TEXTS)
+        names = {address: name for address, name, label, ann, bits, writable in STATUS_REGISTERS}
+        names.update({DPM_PDO_NUMB: 'DPM_PDO_NUMB', RDO_REG_STATUS: 'RDO_REG_STATUS'})
+        names.update({address: 'DPM_SNK_PDO{}'.format(num) for address, num in PDO_SINKS})
+        for start in starts:
+            registers.append(Register(names[start], False, start, tuple(
+                field for address, writable, field in USB_PD.get_registers(start, 0))))
+            # Written values follow the pointer byte
+            written = tuple(field for address, writable, field in USB_PD.get_registers(start, 1) if writable)
+            if written:
+                registers.append(Register(names[start], True, start, written))
+        return tuple(registers)
+
     @staticmethod
-    def write(decoder, databyte):
-        data = []
-        decoder.curr_cmd = databyte
-        if databyte == 0x70:
-            data = [24, ['USB-PD -> PDO number register', 'USB-PD -> PDO number', 'PDO number', 'PDO #']]
-        elif databyte == 0x8D:
-            data = [24, ['USB-PD -> PDO3 SNK 0 register', 'USB-PD -> PDO3 SNK 0', 'PDO3 SNK 0', 'PDO3 SNK']]
-        elif databyte == 0x91:
-            data = [24, ['USB-PD -> Register status 0', 'USB-PD -> Reg status 0', 'USB-PD -> Reg stat 0', 'REG STAT 0',
-                         'REG STAT']]
-        return data
+    def status_texts(name, label, bits, databyte, level):
+        if level == 'values':
+            return ['0x{:02X}'.format(databyte)]
+        elif level == 'minimal':
+            return ['{} 0x{:02X}'.format(label, databyte)]
+        flags = ', '.join(bits.flags(databyte)) or 'None'
+        return pick_texts(('{}: {}'.format(name, flags), '{}: {}'.format(label, flags),
+                           '{} 0x{:02X}'.format(label, databyte)), level)
 
     @staticmethod
-    def read(decoder, databyte):
-        data = []
-        if decoder.curr_cmd == 0x70:
-            pdo_num = int(databyte & 0b00000111)
-            data = [25, ['DPM_PDO_NUM: {}'.format(pdo_num), 'PDO NUM: {}'.format(pdo_num), 'PDO = {}'.format(pdo_num),
-                         '{}'.format(pdo_num)]]
-        elif decoder.curr_cmd == 0x8D:
-            data = USB_PD.pdo_sink_read(databyte, decoder)
-        elif decoder.curr_cmd == 0x91:
-            data = USB_PD.rdo_reg_status_read(databyte, decoder)
-        return data
+    def pdo_sink_read(word):
+        amps = USB_PD.get_current(word & 0x3FF)
+        volts = USB_PD.get_voltage((word >> 10) & 0x3FF)
+        return amps, volts, PDO_SINK_BITS.flags(word)
 
     @staticmethod
-    def pdo_sink_read(databyte, decoder):
-        data = []
-        if decoder.data_key == 0:
-            decoder.work_var = databyte
-        elif decoder.data_key == 1:
-            decoder.work_var = databyte << 8 | decoder.work_var
-        elif decoder.data_key == 2:
-            decoder.work_var = databyte << 16 | decoder.work_var
-        elif decoder.data_key == 3:
-            decoder.work_var = databyte << 24 | decoder.work_var
-
-            flags = []
-            amps = USB_PD.get_current(decoder.work_var & 0x3FF)
-            volts = USB_PD.get_voltage((decoder.work_var >> 10) & 0x3FF)
-
-            # Checks reserved bits
-            if (decoder.work_var >> 20 & 0b111) != 0:
-                flags.append('Invalid')
-
-            # Fast role swap required USB-Type-C current
-            fast_swap = (decoder.work_var >> 23) & 0b11
-            if fast_swap == 0b00:
-                flags.append('Fast swap unsupported')
-            elif fast_swap == 0b01:
-                flags.append('Default USB power')
-            elif fast_swap == 0b10:
-                flags.append('1.5A at 5V')
-            elif fast_swap == 0b11:
-                flags.append('3.0A at 5V')
-
-            if (decoder.work_var >> 25) & 0b1 == 0b1:
-                flags.append('Dual role data')
-            if (decoder.work_var >> 26) & 0b1 == 0b1:
-                flags.append('USB communication capable')
-            if (decoder.work_var >> 27) & 0b1 == 0b1:
-                flags.append('Unconstrained power')
-            if (decoder.work_var >> 28) & 0b1 == 0b1:
-                flags.append('High capability')
-            if (decoder.work_var >> 29) & 0b1 == 0b1:
-                flags.append('Dual role power')
-
-            flags.append('Fixed supply {}'.format(int(decoder.work_var >> 30)))
-
-            data = [26, ['Operational current: {}A, Voltage: {}V, Flags: {}'.format(amps, volts, flags),
-                         '{}A, {}V, Flags: {}'.format(amps, volts, flags),
-                         '{}A, {}V, {} flags'.format(amps, volts, len(flags))]]
-        return data
+    def pdo_sink_texts(word, level):
+        amps = USB_PD.get_current(word & 0x3FF)
+        volts = USB_PD.get_voltage((word >> 10) & 0x3FF)
+        if level == 'values':
+            return ['{}A, {}V'.format(amps, volts)]
+        elif level == 'minimal':
+            return ['{}A, {}V, {} flags'.format(amps, volts, PDO_SINK_BITS.count(word))]
+        flags = PDO_SINK_BITS.flags(word)
+        texts = ['{}A, {}V, Flags: {}'.format(amps, volts, flags), '{}A, {}V, {} flags'.format(amps, volts, len(flags))]
+        if level == 'full':
+            texts.insert(0, 'Operational current: {}A, Voltage: {}V, Flags: {}'.format(amps, volts, flags))
+        return texts
 
     @staticmethod
-    def rdo_reg_status_read(databyte, decoder):
-        data = []
-        if decoder.data_key == 0:
-            decoder.work_var = databyte
-        elif decoder.data_key == 1:
-            decoder.work_var = databyte << 8 | decoder.work_var
-        elif decoder.data_key == 2:
-            decoder.work_var = databyte << 16 | decoder.work_var
-        elif decoder.data_key == 3:
-            decoder.work_var = databyte << 24 | decoder.work_var
-
-            max_amps = USB_PD.get_current(decoder.work_var & 0x3FF)
-            amps = USB_PD.get_current(decoder.work_var >> 10 & 0x3FF)
-            flags = []
-
-            if (decoder.work_var >> 20 & 0b111) != 0 or (decoder.work_var >> 31) != 0:
-                flags.append('Invalid')
-            if decoder.work_var >> 23 & 0b1 == 1:
-                flags.append('Unchunked extended messages supported')
-
-            flags.append('No USB suspend' if decoder.work_var >> 24 & 0b1 == 1 else 'USB suspend')
-            if (decoder.work_var >> 25) & 0b1 == 0b1:
-                flags.append('USB communication capable')
-            if (decoder.work_var >> 26) & 0b1 == 0b1:
-                flags.append('Capability mismatch')
-            if (decoder.work_var >> 27) & 0b1 == 0b0:
-                flags.append('GiveBack enabled')
-            object_pos = int((decoder.work_var >> 28) & 0b111)
-            if object_pos != 0:
-                flags.append('Object position {}'.format(object_pos))
-            else:
-                flags.append('Invalid object position')
-
-            data = [27, ['Max operating current: {}A, Operating current: {}A, Flags: {}'.format(max_amps, amps, flags),
-                         '{}A, {}A, Flags: {}'.format(max_amps, amps, flags),
-                         '{}A, {}A, {} flags'.format(max_amps, amps, len(flags))]]
-
-        return data
+    def rdo_reg_status_read(word):
+        max_amps = USB_PD.get_current(word & 0x3FF)
+        amps = USB_PD.get_current(word >> 10 & 0x3FF)
+        return max_amps, amps, RDO_STATUS_BITS.flags(word)
+
+    @staticmethod
+    def rdo_reg_status_texts(word, level):
+        max_amps = USB_PD.get_current(word & 0x3FF)
+        amps = USB_PD.get_current(word >> 10 & 0x3FF)
+        if level == 'values':
+            return ['{}A, {}A'.format(max_amps, amps)]
+        elif level == 'minimal':
+            return ['{}A, {}A, {} flags'.format(max_amps, amps, RDO_STATUS_BITS.count(word))]
+        flags = RDO_STATUS_BITS.flags(word)
+        texts = ['{}A, {}A, Flags: {}'.format(max_amps, amps, flags),
+                 '{}A, {}A, {} flags'.format(max_amps, amps, len(flags))]
+        if level == 'full':
+            texts.insert(0, 'Max operating current: {}A, Operating current: {}A, Flags: {}'.format(max_amps, amps,
+                                                                                                    flags))
+        return texts
 
     @staticmethod
     def get_current(databyte):
@@ -121,3 +240,6 @@ class USB_PD:
     @staticmethod
     def get_voltage(databyte):
         return int(databyte) / 20
+
+
+USB_PD.registers = USB_PD.compile_registers()